@@ -0,0 +1,112 @@
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from server_lib.book import BOOK_MAGIC, OpeningBook, position_key, write_table
+from server_lib.bot import BOARD_MASK, BOTTOM_MASK, COLUMN_MASKS, Engine, winning_cells
+from server_lib.zobrist import COLUMNS
+
+# Default number of stones of the deepest positions in the book
+BOOK_PLIES = 8
+
+# Default search depth of book moves. Deeper than bots search in a game, the
+# book is generated once and played every game
+BOOK_DEPTH = 10
+
+# Transposition table entries of each generator process
+BOOK_TABLE_SIZE = 1 << 20
+
+# Engine of a generator process, created when the process starts
+solver: Engine|None = None
+
+
+def start_solver(depth: int) -> None:
+    """Create the engine of a generator process"""
+    global solver
+    solver = Engine(depth, BOOK_TABLE_SIZE)
+
+
+def solve(position: int, mask: int) -> tuple[int, int]:
+    """Best column and score of the position. Run in a generator process"""
+    return solver.search(position, mask)
+
+
+def book_column(entries: dict[int, tuple[int, int]], position: int, mask: int) -> int:
+    """Column of a position found in the book entries, as played on the position"""
+    key, mirrored = position_key(position, mask)
+    column = entries[key][0]
+    return COLUMNS - 1 - column if mirrored else column
+
+
+def generate(logger: logging.Logger, entries: dict[int, tuple[int, int]], plies: int, depth: int, jobs: int) -> None:
+    """Add the positions a bot can reach in its first plies to the book entries.
+    The bot plays the book move and the opponent any move, for a bot moving
+    first and for a bot moving second. Positions already in the entries are
+    not searched again. Each ply is searched by a pool of jobs processes"""
+    # Positions of the current ply, as (position, mask, bot to move). Position
+    # is the stones of the player to move
+    frontier = [(0, 0, True), (0, 0, False)]
+    with ProcessPoolExecutor(jobs, initializer=start_solver, initargs=(depth,)) as executor:
+        for ply in range(plies + 1):
+            start = time.monotonic()
+            positions: dict[int, tuple[int, int, bool]] = {}
+            for position, mask, bot in frontier:
+                if bot:
+                    key, mirrored = position_key(position, mask)
+                    positions.setdefault(key, (position, mask, mirrored))
+            missing = [key for key in positions if key not in entries]
+            results = executor.map(solve, [positions[key][0] for key in missing], [positions[key][1] for key in missing],
+                                   chunksize=8)
+            for key, (column, score) in zip(missing, results):
+                # Entries are stored for the canonical orientation
+                entries[key] = (COLUMNS - 1 - column if positions[key][2] else column, score)
+            logger.info(f"Ply {ply}: {len(positions)} positions, {len(missing)} searched in {time.monotonic() - start:.1f}s")
+            if ply == plies:
+                break
+
+            children = {}
+            for position, mask, bot in frontier:
+                possible = (mask + BOTTOM_MASK) & BOARD_MASK
+                wins = winning_cells(position, mask)
+                columns = (book_column(entries, position, mask),) if bot else range(COLUMNS)
+                for column in columns:
+                    move = possible & COLUMN_MASKS[column]
+                    # A winning move ends the game
+                    if not move or move & wins:
+                        continue
+                    child = (position ^ mask, mask | move, not bot)
+                    # A position and its mirror image lead to the same book entries
+                    children.setdefault((position_key(child[0], child[1])[0], child[2]), child)
+            frontier = list(children.values())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate an opening book for the ConnectFour server bots")
+    parser.add_argument("-o", "--output", required=True, help="Book file to write")
+    parser.add_argument("--plies", help=f"Stones of the deepest book positions: Default {BOOK_PLIES}", type=int, default=BOOK_PLIES)
+    parser.add_argument("--depth", help=f"Plies searched for each book move: Default {BOOK_DEPTH}", type=int, default=BOOK_DEPTH)
+    parser.add_argument("-j", "--jobs", help="Processes searching positions: Default the number of CPUs", type=int,
+                        default=os.cpu_count() or 1)
+    parser.add_argument("--extend", help="Keep the positions of an existing book at the output and only search new ones",
+                        action="store_true")
+    parser.add_argument("--loglevel", help="Log verbosity level: Default INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="INFO")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger('CONNECT-FOUR BOOK')
+    entries: dict[int, tuple[int, int]] = {}
+    plies = args.plies
+    if args.extend and os.path.exists(args.output):
+        book = OpeningBook(args.output)
+        entries = {key: (column, score) for key, column, score in book.entries()}
+        plies = max(plies, book.limit)
+        book.close()
+        logger.info(f"Extending {args.output}, {len(entries)} positions")
+    try:
+        generate(logger, entries, args.plies, args.depth, args.jobs)
+    except KeyboardInterrupt:
+        print("Interrupt signal received, shutting down")
+        raise SystemExit(1)
+    write_table(args.output, BOOK_MAGIC, entries, plies)
+    logger.info(f"Wrote {len(entries)} positions to {args.output}")
@@ -1,23 +1,26 @@
 import logging
-import struct
 import argparse
 
 import socket
 import selectors
 import threading
 import os
-import json
 
-from client_lib.action import Action
+from client_lib.action import HEADER, Action
 from client_lib.tui import ConnectFour
 from client_lib.message_handler import MessageHandler
 
+# Most bytes read from the server per receive
+RECV_SIZE = 64 * 1024
+
 
 class Client:
 
-    def __init__(self, log_level, addr) -> None:
+    def __init__(self, log_level, addr, codec_name: str = "json", session: str|None = None) -> None:
         """Initialize client and connect to server at given address
-        Logger is configured later as part of TUI"""
+        Logger is configured later as part of TUI. codec_name is the
+        message encoding offered to the server. session is the token of
+        a game to resume"""
 
         # Logging
         self.logger = logging.getLogger('CONNECT-FOUR CLIENT')
@@ -25,25 +28,26 @@ class Client:
 
         # Selector
         self.addr = addr
+        self.session = session
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sel = selectors.DefaultSelector()
 
         # Sending actions, UI, nad receiving handler
-        self.action = Action(self.logger)
-        self.ui = ConnectFour(self.sock, self.logger)
-        self.handler = MessageHandler(self.logger, self.ui, self.sock)
+        self.action = Action(self.logger, codec_name)
+        self.ui = ConnectFour(self.sock, self.logger, self.action)
+        self.handler = MessageHandler(self.logger, self.ui, self.sock, self.action)
 
 
     def connect(self) -> None:
         """Connect to the server and start the receiving thread
         Start the UI (BLOCKING)"""
-        self.logger.info(f"Connecting to host: {self.addr[0]}, port: {self.addr[1]}")
+        self.logger.info("Connecting to host: %s, port: %s", self.addr[0], self.addr[1])
         # Start receiving thread
         rec = threading.Thread(target=self.receive)
         self.sock.connect(self.addr)
         rec.start()
         # send connection message to server
-        self.sock.sendall(self.action.connect())
+        self.sock.sendall(self.action.connect(self.session))
 
         exit_val = self.ui.run()
         # UI interface has exited, shutdown all threads.
@@ -52,6 +56,8 @@ class Client:
         else:
             rec.join()
             print('Server connection was lost! exiting...')
+            if self.handler.session is not None:
+                print(f'Reconnect with --session {self.handler.session} to resume the game')
 
 
     def shutdown(self) -> None:
@@ -63,36 +69,44 @@ class Client:
 
     def receive(self) -> None:
         """Receive loop for the client.
-        Ran in separate thread"""
+        Ran in separate thread. Reads straight into a preallocated buffer, then
+        handles every complete frame received so far in order. Bytes from start
+        to end have been received but not yet parsed"""
+        buf = bytearray(RECV_SIZE)
+        view = memoryview(buf)
+        start = end = 0
         while True:
-            bmsg_len = b""
-            chunk = self.sock.recv(4)
-            if not chunk:
-                self.closed_connection()
-            bmsg_len += chunk
-            # Ensure all 4 bytes have been read
-            while (len(bmsg_len) != 4):
-                chunk = self.sock.recv(4-len(bmsg_len))
-                if not chunk:
-                    self.closed_connection()
-                bmsg_len += chunk
-
-            msg_len = struct.unpack('<i', bmsg_len)[0]
-            msg = ""
-            chunk = self.sock.recv(msg_len).decode("utf-8")
+            try:
+                size = self.sock.recv_into(view[end:])
+            except OSError:
+                size = 0
             # Server has unexpectadly closed
-            if not chunk:
+            if not size:
                 self.closed_connection()
-            msg += chunk
-            # Ensure the full message has been received
-            while (len(msg) != msg_len):
-                chunk = self.sock.recv(msg_len-len(msg)).decode("utf-8")
-                if not chunk:
-                    self.closed_connection()
-                msg += chunk
-            
-            json_msg = json.loads(msg)
-            self.handler.handle_message(json_msg)
+            end += size
+            while end - start >= 4:
+                msg_len = HEADER.unpack_from(buf, start)[0]
+                stop = start + 4 + msg_len
+                # Wait for the rest of the frame
+                if stop > end:
+                    break
+                # Decoded with the codec in use when the message arrives
+                decoded_msg = self.action.codec.loads(view[start + 4:stop])
+                self.handler.handle_message(decoded_msg)
+                start = stop
+            # Move the partial frame to the front, growing the buffer if it cannot hold it
+            needed = end - start
+            if needed >= 4:
+                needed = max(needed, 4 + HEADER.unpack_from(buf, start)[0])
+            if needed >= len(buf):
+                grown = bytearray(2 * needed)
+                grown[:end - start] = view[start:end]
+                buf = grown
+                view = memoryview(buf)
+            elif start:
+                view[:end - start] = view[start:end]
+            end -= start
+            start = 0
 
     def closed_connection(self) -> None:
         """When an empty message was read on socket.
@@ -106,6 +120,8 @@ if __name__ == '__main__':
     parser.add_argument("-i", "--ip", required=True, help="The ip address or DNS of the running ConnectFour server")
     parser.add_argument("-p","--port", required=True, help="Port used by the running ConnectFour server", type=int)
     parser.add_argument("--loglevel", help="Log verbosity level: Default INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    parser.add_argument("--session", help="Session token of a game to resume after a disconnect")
+    parser.add_argument("--codec", help="Message encoding offered to the server: Default json", choices=["json", "msgpack"], default="json")
     args = parser.parse_args()
     # Change logging level here. 
     loglevel = logging.INFO
@@ -115,7 +131,7 @@ if __name__ == '__main__':
         loglevel = logging.WARNING
     elif args.loglevel == "ERROR":
         loglevel = logging.ERROR
-    client = Client(loglevel, (args.ip, args.port))
+    client = Client(loglevel, (args.ip, args.port), args.codec, args.session)
     try:
         client.connect()
     except KeyboardInterrupt:
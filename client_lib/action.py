@@ -1,27 +1,67 @@
-import json
 from logging import Logger
 import struct
 
+from client_lib.codec import CODECS, JSON
+
+# Length prefix of every frame
+HEADER = struct.Struct('<i')
+
 class Action:
     """ Defines actions which are sent to the server. These
     actions are sent using the application message protocol, and
     define the output of the client-side Clinet/Server API"""
 
-    def __init__(self, logger: Logger) -> None:
+    def __init__(self, logger: Logger, codec_name: str = "json") -> None:
         self.logger = logger
+        # Preferred codec, offered to the server on connect
+        self.codec_name = codec_name
+        # Codec in use. JSON until the server confirms the negotiated codec
+        self.codec = JSON
 
     def serialize(self, msg: dict) -> bytes:
         """Create a byte serialization of the message. message contents
-        are encoded in json and prefixed by a fixed size length integer to
-        encode the total message size"""
-        bjson = bytes(json.dumps(msg), encoding="utf-8")
-        return struct.pack(f'<i{len(bjson)}s', len(bjson), bjson)
+        are encoded with the negotiated codec and prefixed by a fixed size
+        length integer to encode the total message size"""
+        body = self.codec.dumps(msg)
+        return HEADER.pack(len(body)) + body
+
+    def set_codec(self, codec_name: str) -> None:
+        """Switch to the codec confirmed by the server"""
+        codec = CODECS.get(codec_name)
+        if codec is None:
+            self.logger.error("Server selected unknown codec %s, keeping %s", codec_name, self.codec.name)
+            return
+        self.codec = codec
+        self.logger.info("Using %s codec", codec.name)
+
+    def connect(self, session: str|None = None) -> bytes:
+        """ Connection message. Offers the preferred codec, json is
+        always accepted. A session token reclaims the seat of a game
+        this player was disconnected from"""
+        codecs = ["json"]
+        if self.codec_name != "json" and self.codec_name in CODECS:
+            codecs.insert(0, self.codec_name)
+        data = {
+                "action": "connect",
+                "codecs": codecs,
+                }
+        if session is not None:
+            data["session"] = session
+        return self.serialize(data)
 
-    def connect(self) -> bytes:
-        """ Connection message"""
+    def spectate(self, room: int|None = None) -> bytes:
+        """ Connection message for a read-only spectator. Watches the given
+        room, or the server's oldest room when no room is given"""
+        codecs = ["json"]
+        if self.codec_name != "json" and self.codec_name in CODECS:
+            codecs.insert(0, self.codec_name)
         data = {
                 "action": "connect",
+                "role": "spectator",
+                "codecs": codecs,
                 }
+        if room is not None:
+            data["room"] = room
         return self.serialize(data)
 
     def disconnect(self) -> bytes:
@@ -48,3 +88,24 @@ class Action:
                 }
         return self.serialize(data)
 
+    def pong(self, nonce: int) -> bytes:
+        """ Heartbeat response to a ping from the server"""
+        data = {
+                "action": "pong",
+                "nonce": nonce,
+                }
+        return self.serialize(data)
+
+    def hint(self) -> bytes:
+        """ Ask the server for the best move, found in its endgame tablebase"""
+        data = {
+                "action": "hint"
+                }
+        return self.serialize(data)
+
+    def resync(self) -> bytes:
+        """ Request a full game status snapshot after a missed update"""
+        data = {
+                "action": "resync"
+                }
+        return self.serialize(data)
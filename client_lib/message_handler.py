@@ -1,6 +1,7 @@
 from logging import Logger
 from socket import socket
 
+from client_lib.action import Action
 from client_lib.tui import ConnectFour
 from client_lib.users import User, Users
 
@@ -8,14 +9,23 @@ class MessageHandler:
     """Parses received messages, performs actions on the client,
     then gives responses as required"""
 
-    def __init__(self, logger: Logger, ui: ConnectFour, sock: socket) -> None:
+    def __init__(self, logger: Logger, ui: ConnectFour, sock: socket, action: Action) -> None:
         self.logger = logger
         self.ui = ui
         self.sock = sock
+        self.action = action
+        # Local copy of the board, kept up to date by move deltas
+        self.board = {}
+        # Sequence number of the last move applied to the board
+        self.seq = 0
+        # Session token of the current game, used to resume after a disconnect
+        self.session: str|None = None
+        # Round trip time to the server in seconds, measured by the server's heartbeats
+        self.rtt: float|None = None
 
     def handle_message(self, message: dict) -> None:
         """Base message handler that processes all mesasges that the client receives"""
-        self.logger.debug(f'Received {message} from server')
+        self.logger.debug('Received %s from server', message)
         # Single message to this client from server
         result = message.get("result")
         if result is not None:
@@ -39,8 +49,19 @@ class MessageHandler:
         # Response resulting in generic error
         if result == "err":
             return
+        # Best move for this client from the server's endgame tablebase
+        if result == "hint":
+            self.handle_hint(message)
+            return
+        # Session token of the running game
+        if result == "session":
+            self.session = message.get("token")
+            return
         # Connection response message
         if result == "connection":
+            # Every following message uses the negotiated codec
+            if message.get("status") == "connected":
+                self.action.set_codec(message.get("codec", "json"))
             # Exceeds max allowed player count
             if message.get("status") == "refused":
                 reason = message.get("reason")
@@ -53,16 +74,30 @@ class MessageHandler:
             state = message.get("state")
             if state is not None:
                 self.handle_state(state, message)
+        if broadcast == "ping":
+            self.handle_ping(message)
+            return
         if broadcast == "connection_status":
-            self.logger.info(f'new connection to server: host: {message.get("host")}, port {message.get("port")}')
+            self.logger.info('new connection to server: host: %s, port %s', message.get("host"), message.get("port"))
             return
         if broadcast == "game_status":
             self.handle_game_status(message)
+        if broadcast == "move_delta":
+            self.handle_move_delta(message)
         if broadcast == "game_win":
             self.handle_game_win(message)
         if broadcast == "game_draw":
             self.handle_game_draw(message)
 
+    def handle_ping(self, message: dict) -> None:
+        """Heartbeat from the server. Answered at once, as the server closes
+        connections that stay silent"""
+        rtt = message.get("rtt")
+        if rtt is not None:
+            self.rtt = float(rtt)
+            self.logger.debug("Round trip time to server: %.1f ms", self.rtt * 1000)
+        self.sock.sendall(self.action.pong(message.get("nonce")))
+
     def handle_move_accepted(self) -> None:
         """Response from server that move was accepted"""
         self.ui.post_message(self.ui.MoveMessage())
@@ -73,6 +108,11 @@ class MessageHandler:
         err = message["error"]
         self.ui.post_message(self.ui.MoveErrorMessage(err))
 
+    def handle_hint(self, message: dict) -> None:
+        """Response from server with the best move for this client, if the
+        position was in its tablebase. Hand it over to the TUI"""
+        self.ui.post_message(self.ui.HintMessage(message.get("column"), message.get("outcome")))
+
     def handle_game_draw(self, message: dict) -> None:
         """Message from server that the game has ended in a draw."""
         board = self.format_board(message["board"])
@@ -114,27 +154,42 @@ class MessageHandler:
                 users.first = users.local
             else:
                 users.first = users.remote
-            board = self.format_board(message["board"])
-            self.ui.post_message(self.ui.RunMessage(users, board))
+            self.board = self.format_board(message["board"])
+            self.seq = int(message.get("seq", 0))
+            self.ui.post_message(self.ui.RunMessage(users, dict(self.board)))
 
     def handle_game_status(self, message: dict) -> None:
+        """Full snapshot of the game status. Replaces the local board"""
         turn_count = int(message["turn_count"])
         mover_host = message["expected_mover_host"]
         mover_port = int(message["expected_mover_port"])
-        board = self.format_board(message["board"])
-        self.ui.post_message(self.ui.StatusMessage(turn_count,mover_host,mover_port,board))
+        self.board = self.format_board(message["board"])
+        self.seq = int(message.get("seq", self.seq))
+        self.ui.post_message(self.ui.StatusMessage(turn_count,mover_host,mover_port,dict(self.board)))
+
+    def handle_move_delta(self, message: dict) -> None:
+        """A single accepted move. Applied to the local board when it directly
+        follows the last applied move, otherwise a full snapshot is requested"""
+        seq = int(message["seq"])
+        if seq != self.seq + 1:
+            self.logger.info("Missed move update, expected %s got %s. Requesting resync", self.seq + 1, seq)
+            self.sock.sendall(self.action.resync())
+            return
+        self.seq = seq
+        self.board[(int(message["column"]), int(message["row"]))] = int(message["value"])
+        turn_count = int(message["turn_count"])
+        mover_host = message["expected_mover_host"]
+        mover_port = int(message["expected_mover_port"])
+        self.ui.post_message(self.ui.StatusMessage(turn_count,mover_host,mover_port,dict(self.board)))
 
     def format_board(self, board: dict) -> dict:
         """ Format the sent board into a form that is usable by the client.
         This is required because the tuple keys can not be serialized over the std 
         json library"""
-        self.logger.debug("in format_board")
-        self.logger.debug(board)
         new_board = {}
         for loc_str, value in board.items():
             locs = loc_str.split()
             new_board[(int(locs[0]), int(locs[1]))] = int(value)
-        self.logger.debug(new_board)
         return new_board
 
 
@@ -140,7 +140,8 @@ class Game(Screen):
             Binding("left", "navigate(-1)", "Move Left", False),
             Binding("right", "navigate(1)", "Move Right", False),
             Binding("q", "app.quit", "Quit"),
-            Binding("l", "logs", "Open/Close Logs")
+            Binding("l", "logs", "Open/Close Logs"),
+            Binding("h", "app.hint", "Hint")
             ]
 
 
@@ -311,12 +312,20 @@ class ConnectFour(App):
             self.err = err
             super().__init__()
 
+    class HintMessage(Message):
+        """TUI hint message, the best column and the outcome it leads to"""
+        def __init__(self, column: int|None, outcome: str|None) -> None:
+            self.column = column
+            self.outcome = outcome
+            super().__init__()
+
 
-    def __init__(self, sock: socket, logger: logging.Logger) -> None:
+    def __init__(self, sock: socket, logger: logging.Logger, action: Action) -> None:
         super().__init__()
         self.logger = logger
         self.sock = sock
-        self.action = Action(self.logger)
+        # Shared with the client, so the negotiated codec is used for input actions
+        self.action = action
         # Set up logger
         lh = ListHandler(LogModal.logs)
         lh.setLevel(logging.DEBUG)
@@ -466,6 +475,18 @@ class ConnectFour(App):
 
 
 
+    def on_connect_four_hint_message(self, message: HintMessage) -> None:
+        """The server answered a hint request. Show the hinted column in the
+        game status"""
+        try:
+            status = self.query_one(GameStatus)
+        except NoMatches:
+            return
+        if message.column is None:
+            status.err_msg = "No hint for this position"
+        else:
+            status.err_msg = f"Hint: column {message.column} leads to a {message.outcome}"
+
     def on_mount(self) -> None:
         """Start the game in the waiting state"""
         self.switch_mode("waiting")
@@ -474,6 +495,10 @@ class ConnectFour(App):
         """Send a move to the server at the desired location"""
         self.sock.sendall(self.action.move(col, self.turn_count))
 
+    def action_hint(self) -> None:
+        """Ask the server for the best move in the current position"""
+        self.sock.sendall(self.action.hint())
+
     def action_name(self, name: str) -> None:
         """Send the server this user's selected user name"""
         self.sock.sendall(self.action.set_name(name))
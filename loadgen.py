@@ -0,0 +1,365 @@
+import argparse
+import errno
+from collections import deque
+import json
+import logging
+import random
+import selectors
+import socket
+import struct
+import time
+
+from client_lib.action import Action
+
+
+class Player:
+    """A simulated player. Plays whole games over a real socket using the same
+    actions as the interactive client, choosing random or scripted columns"""
+
+    def __init__(self, gen: "LoadGenerator", index: int) -> None:
+        self.gen = gen
+        self.index = index
+        self.action = Action(gen.logger, gen.codec_name)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setblocking(False)
+        self.rbuf = bytearray()
+        self.wbuf = bytearray()
+        self.local = ("", 0)
+        self.connecting = True
+        self.connect_start = 0.0
+        self.heights = [0] * 7
+        self.turn_count = 1
+        self.move_sent = 0.0
+        self.script_pos = 0
+
+    def start(self) -> None:
+        """Open the non-blocking connection to the server"""
+        self.connect_start = time.perf_counter()
+        err = self.sock.connect_ex(self.gen.addr)
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            raise OSError(err, "connect failed")
+        self.gen.sel.register(self.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, self)
+
+    def send(self, data: bytes) -> None:
+        """Queue an encoded action and write as much as the socket accepts"""
+        self.wbuf += data
+        self.flush()
+
+    def flush(self) -> None:
+        """Write queued bytes, keeping write interest while any remain"""
+        if self.wbuf and not self.connecting:
+            try:
+                sent = self.sock.send(self.wbuf)
+                del self.wbuf[:sent]
+            except (BlockingIOError, InterruptedError):
+                pass
+        events = selectors.EVENT_READ
+        if self.wbuf or self.connecting:
+            events |= selectors.EVENT_WRITE
+        if self.gen.sel.get_key(self.sock).events != events:
+            self.gen.sel.modify(self.sock, events, self)
+
+    def on_event(self, mask: int) -> None:
+        """Readiness event from the load generator's selector"""
+        if mask & selectors.EVENT_WRITE:
+            if self.connecting:
+                err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err:
+                    self.gen.failed_connections += 1
+                    self.close()
+                    return
+                self.connecting = False
+                self.local = self.sock.getsockname()[:2]
+                self.on_connected()
+            else:
+                self.flush()
+        if mask & selectors.EVENT_READ:
+            try:
+                data = self.sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                return
+            except ConnectionError:
+                data = b""
+            if not data:
+                self.close()
+                return
+            self.rbuf += data
+            offset = 0
+            while len(self.rbuf) - offset >= 4:
+                msg_len = struct.unpack_from('<i', self.rbuf, offset)[0]
+                end = offset + 4 + msg_len
+                if end > len(self.rbuf):
+                    break
+                msg = self.action.codec.loads(bytes(self.rbuf[offset + 4:end]))
+                offset = end
+                self.handle_message(msg)
+                if self.sock.fileno() < 0:
+                    return
+            del self.rbuf[:offset]
+
+    def on_connected(self) -> None:
+        """Connection established, ask to be seated"""
+        self.send(self.action.connect())
+
+    def handle_message(self, msg: dict) -> None:
+        """React to server messages the way a human player would"""
+        gen = self.gen
+        result = msg.get("result")
+        if result == "connection":
+            if msg.get("status") == "connected":
+                gen.setup_times.append(time.perf_counter() - self.connect_start)
+                self.action.set_codec(msg.get("codec", "json"))
+            else:
+                gen.refused += 1
+                self.close()
+            return
+        if result == "move" and msg.get("move_status") == "rejected":
+            gen.rejected += 1
+            return
+        broadcast = msg.get("broadcast")
+        if broadcast == "ping":
+            self.send(self.action.pong(msg.get("nonce")))
+        elif broadcast == "state":
+            state = msg.get("state")
+            if state == "pregame":
+                self.send(self.action.set_name(f"bot{self.index % 100000}"))
+            elif state == "run":
+                gen.games_started += 1
+                self.heights = [0] * 7
+                self.turn_count = 1
+                self.script_pos = 0
+                if self.is_me(msg["first_player_host"], msg["first_player_port"]):
+                    self.play()
+            elif state == "waiting" and msg.get("disconnect"):
+                # Opponent left mid game, the server pairs this player again
+                self.move_sent = 0.0
+        elif broadcast in ("move_delta", "game_status"):
+            self.record_latency()
+            if broadcast == "move_delta":
+                self.heights[int(msg["column"])] = int(msg["row"]) + 1
+            else:
+                self.heights = [0] * 7
+                for loc, value in msg["board"].items():
+                    if value:
+                        column, row = loc.split()
+                        self.heights[int(column)] = max(self.heights[int(column)], int(row) + 1)
+            self.turn_count = int(msg["turn_count"])
+            if self.is_me(msg["expected_mover_host"], msg["expected_mover_port"]):
+                self.play()
+        elif broadcast in ("game_win", "game_draw"):
+            self.record_latency()
+            gen.game_ends += 1
+            self.restart()
+
+    def is_me(self, host: str, port: int) -> bool:
+        """Is the address this player's own end of the connection"""
+        return host == self.local[0] and int(port) == self.local[1]
+
+    def play(self) -> None:
+        """Send the next move, scripted columns first then random"""
+        columns = [column for column in range(7) if self.heights[column] < 6]
+        if not columns:
+            return
+        column = random.choice(columns)
+        script = self.gen.script
+        if script:
+            scripted = script[self.script_pos % len(script)]
+            self.script_pos += 1
+            if scripted in columns:
+                column = scripted
+        self.move_sent = time.perf_counter()
+        self.gen.moves_sent += 1
+        self.send(self.action.move(column, self.turn_count))
+
+    def record_latency(self) -> None:
+        """Time from this player's move to the server's resulting broadcast"""
+        if self.move_sent:
+            self.gen.latencies.append(time.perf_counter() - self.move_sent)
+            self.gen.moves_done += 1
+            self.move_sent = 0.0
+
+    def close(self) -> None:
+        """Close the connection"""
+        if self.sock.fileno() >= 0:
+            self.gen.sel.unregister(self.sock)
+            self.sock.close()
+            self.gen.active -= 1
+
+    def restart(self) -> None:
+        """Leave the finished game and connect again as a new player"""
+        self.close()
+        if time.monotonic() < self.gen.deadline:
+            self.gen.pending.append(self.index)
+
+
+class Spectator(Player):
+    """A simulated spectator. Watches the server's oldest room and counts the
+    broadcasts it receives. Reconnects when the room it watches closes"""
+
+    def on_connected(self) -> None:
+        """Subscribe as a spectator instead of taking a seat"""
+        self.send(self.action.spectate())
+
+    def handle_message(self, msg: dict) -> None:
+        """Count broadcasts, spectators never play"""
+        gen = self.gen
+        if msg.get("result") == "connection":
+            if msg.get("status") == "connected":
+                gen.setup_times.append(time.perf_counter() - self.connect_start)
+                self.action.set_codec(msg.get("codec", "json"))
+            else:
+                # No game to watch yet, try again
+                self.restart()
+            return
+        if msg.get("broadcast") == "ping":
+            self.send(self.action.pong(msg.get("nonce")))
+        elif msg.get("broadcast") is not None:
+            gen.spectator_frames += 1
+
+    def close(self) -> None:
+        """Close the connection, and watch another room while the load runs"""
+        was_open = self.sock.fileno() >= 0
+        super().close()
+        if was_open and time.monotonic() < self.gen.deadline:
+            self.gen.pending_spectators.append(self.index)
+
+    def restart(self) -> None:
+        """Reconnect as a new spectator"""
+        self.close()
+
+
+class LoadGenerator:
+    """Opens many simulated players over real sockets on one selector loop. The
+    server pairs them into games, and the players play until the duration ends"""
+
+    def __init__(self, logger: logging.Logger, addr: tuple[str, int], players: int, duration: float,
+                 connect_rate: float, codec_name: str, script: list[int], spectators: int = 0) -> None:
+        self.logger = logger
+        self.addr = addr
+        self.players = players
+        self.spectators = spectators
+        self.duration = duration
+        self.connect_rate = connect_rate
+        self.codec_name = codec_name
+        self.script = script
+        self.sel = selectors.DefaultSelector()
+        self.pending: deque[int] = deque()
+        self.pending_spectators: deque[int] = deque()
+        self.active = 0
+        self.deadline = 0.0
+        # Measurements
+        self.setup_times: list[float] = []
+        self.latencies: list[float] = []
+        self.moves_sent = 0
+        self.moves_done = 0
+        self.rejected = 0
+        self.refused = 0
+        self.failed_connections = 0
+        self.spectator_frames = 0
+        # Counted by both players of a game
+        self.games_started = 0
+        self.game_ends = 0
+
+    def run(self) -> dict:
+        """Run the load for the configured duration and return the report"""
+        start = time.monotonic()
+        self.deadline = start + self.duration
+        self.pending.extend(range(self.players))
+        self.pending_spectators.extend(range(self.spectators))
+        next_connect = start
+        while time.monotonic() < self.deadline:
+            now = time.monotonic()
+            # Open new connections, limited to connect_rate per second. Spectators
+            # connect once players are seated, so there is a game to watch
+            while (self.pending or self.pending_spectators) and now >= next_connect:
+                if self.pending:
+                    player = Player(self, self.pending.popleft())
+                else:
+                    player = Spectator(self, self.pending_spectators.popleft())
+                try:
+                    player.start()
+                    self.active += 1
+                except OSError:
+                    self.failed_connections += 1
+                if self.connect_rate > 0:
+                    next_connect += 1.0 / self.connect_rate
+            timeout = min(0.1, max(0.0, self.deadline - now))
+            for key, mask in self.sel.select(timeout):
+                key.data.on_event(mask)
+        elapsed = time.monotonic() - start
+        for key in list(self.sel.get_map().values()):
+            key.fileobj.close()
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> dict:
+        """Throughput and latency summary. Latencies are in milliseconds"""
+        def percentile(values: list[float], pct: float) -> float:
+            if not values:
+                return 0.0
+            ordered = sorted(values)
+            index = min(len(ordered) - 1, int(pct / 100 * len(ordered)))
+            return round(ordered[index] * 1000, 3)
+        return {
+                "elapsed_s": round(elapsed, 3),
+                "connections": len(self.setup_times),
+                "connections_per_s": round(len(self.setup_times) / elapsed, 1),
+                "connect_p50_ms": percentile(self.setup_times, 50),
+                "connect_p99_ms": percentile(self.setup_times, 99),
+                "failed_connections": self.failed_connections,
+                "refused": self.refused,
+                "games_started": self.games_started // 2,
+                "games_finished": self.game_ends // 2,
+                "moves": self.moves_done,
+                "moves_per_s": round(self.moves_done / elapsed, 1),
+                "rejected_moves": self.rejected,
+                "move_p50_ms": percentile(self.latencies, 50),
+                "move_p99_ms": percentile(self.latencies, 99),
+                "move_p999_ms": percentile(self.latencies, 99.9),
+                "spectator_frames": self.spectator_frames,
+                "spectator_frames_per_s": round(self.spectator_frames / elapsed, 1),
+                }
+
+
+def raise_fd_limit(logger: logging.Logger, wanted: int) -> None:
+    """Raise the open file limit so thousands of sockets can be opened"""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < wanted:
+        target = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        if target < wanted:
+            logger.warning(f"Open file limit is {target}, fewer players may connect than requested")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Headless load generator for the ConnectFour server")
+    parser.add_argument("-i", "--ip", required=True, help="The ip address or DNS of the running ConnectFour server")
+    parser.add_argument("-p","--port", required=True, help="Port used by the running ConnectFour server", type=int)
+    parser.add_argument("-n", "--players", help="Number of simulated players: Default 1000", type=int, default=1000)
+    parser.add_argument("-d", "--duration", help="Seconds to run the load: Default 30", type=float, default=30.0)
+    parser.add_argument("--spectators", help="Number of simulated spectators watching games: Default 0", type=int, default=0)
+    parser.add_argument("--connect-rate", help="New connections per second, 0 for no limit: Default 0", type=float, default=0.0)
+    parser.add_argument("--codec", help="Message encoding offered to the server: Default json", choices=["json", "msgpack"], default="json")
+    parser.add_argument("--script", help="Comma separated columns played in order before random moves, e.g. 3,3,2,4")
+    parser.add_argument("--json", help="Print the report as json", action="store_true")
+    parser.add_argument("--loglevel", help="Log verbosity level: Default WARNING", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="WARNING")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger('CONNECT-FOUR LOADGEN')
+    script = [int(column) for column in args.script.split(",")] if args.script else []
+    raise_fd_limit(logger, args.players + args.spectators + 64)
+    gen = LoadGenerator(logger, (args.ip, args.port), args.players, args.duration, args.connect_rate, args.codec, script,
+                        args.spectators)
+    try:
+        report = gen.run()
+    except KeyboardInterrupt:
+        print("Interrupt signal received, shutting down")
+        raise SystemExit(1)
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for name, value in report.items():
+            print(f"{name:>20}: {value}")
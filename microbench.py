@@ -0,0 +1,262 @@
+import argparse
+import json
+import logging
+import struct
+import sys
+import timeit
+from typing import Callable
+
+from client_lib.action import Action as ClientAction
+from server_lib.action import Action
+from server_lib.bitboard import BitBoard
+from server_lib.board import Board
+from server_lib.bot import Engine, position_of
+from server_lib.codec import CODECS, JSON
+from server_lib.connection import Connection
+from server_lib.game import Game
+from server_lib.loopback import LoopbackServer
+from server_lib.users import User, Users
+
+
+# Moves as (column, value) played before the measured check, and the checked location
+WIN_POSITIONS = {
+        "vertical": ([(3, 1), (4, -1), (3, 1), (4, -1), (3, 1), (4, -1), (3, 1)], (3, 3)),
+        "horizontal": ([(0, 1), (0, -1), (1, 1), (1, -1), (2, 1), (2, -1), (3, 1)], (3, 0)),
+        "diagonal": ([(0, 1), (1, -1), (1, 1), (2, -1), (2, 1), (3, -1), (2, 1), (3, -1), (3, 1), (0, -1), (3, 1)], (3, 3)),
+        "no_win": ([(3, 1), (3, -1), (2, 1), (4, -1), (4, 1), (2, -1), (5, 1)], (5, 0)),
+        }
+
+
+def new_logger() -> logging.Logger:
+    """Logger at the default server level, so disabled debug lines cost what they cost in production"""
+    logger = logging.getLogger('CONNECT-FOUR MICROBENCH')
+    logger.setLevel(logging.WARNING)
+    return logger
+
+
+def new_users(logger: logging.Logger) -> Users:
+    """Two named users with values, as in a running game"""
+    users = Users(logger)
+    for port, name in ((5000, "alice"), (5001, "bob")):
+        users.add_user(User(("127.0.0.1", port)))
+        users.set_user_name(("127.0.0.1", port), name)
+    users.set_values()
+    return users
+
+
+def played_board(board_class: type[Board]|type[BitBoard], logger: logging.Logger, moves: list[tuple[int, int]]):
+    """Board with the given (column, value) moves played"""
+    board = board_class(logger)
+    for column, value in moves:
+        row = board.next_row_in_column(column)
+        board.move(column, row, value)
+    return board
+
+
+def win_cases(logger: logging.Logger) -> dict[str, Callable[[], object]]:
+    """Game.check_win_condition for each board engine and line direction"""
+    cases = {}
+    users = new_users(logger)
+    for engine, board_class in (("bitboard", BitBoard), ("dict", Board)):
+        for name, (moves, (column, row)) in WIN_POSITIONS.items():
+            game = Game(logger, played_board(board_class, logger, moves), users)
+            cases[f"check_win_condition.{engine}.{name}"] = lambda game=game, column=column, row=row: game.check_win_condition(column, row)
+    return cases
+
+
+def board_cases(logger: logging.Logger) -> dict[str, Callable[[], object]]:
+    """Board.next_row_in_column, Board.move and Board.clean for each board engine"""
+    cases = {}
+    for engine, board_class in (("bitboard", BitBoard), ("dict", Board)):
+        board = board_class(logger)
+
+        def next_row(board=board):
+            # Column fills after six calls, start over with an empty board
+            row = board.next_row_in_column(3)
+            if row is None:
+                board.clean()
+            return row
+
+        def move(board=board):
+            board.move(3, 2, 1)
+
+        cases[f"board.{engine}.next_row_in_column"] = next_row
+        cases[f"board.{engine}.move"] = move
+        cases[f"board.{engine}.clean"] = board.clean
+    return cases
+
+
+def action_cases(logger: logging.Logger) -> dict[str, Callable[[], object]]:
+    """Every Action builder, encoded as it would be sent, and serialize with each codec"""
+    action = Action(logger)
+    users = new_users(logger)
+    user = users.get_user(("127.0.0.1", 5000))
+    board = played_board(BitBoard, logger, WIN_POSITIONS["diagonal"][0])
+    addr = ("127.0.0.1", 5000)
+    msg = {"broadcast": "game_status", "turn_count": 12, "expected_mover_host": "127.0.0.1",
+           "expected_mover_port": 5000, "seq": 11, "board": board.wire()}
+    cases = {}
+    for name, codec in CODECS.items():
+        cases[f"action.serialize.{name}"] = lambda codec=codec: action.serialize(msg).encode(codec)
+    builders = {
+            "game_status": lambda: action.game_status(12, user, board, 11),
+            "move_delta": lambda: action.move_delta(11, (3, 3, 1), 12, user),
+            "game_win": lambda: action.game_win(board, user),
+            "game_draw": lambda: action.game_draw(board),
+            "connection_start": lambda: action.connection_start(addr),
+            "connection_end": lambda: action.connection_end(addr),
+            "set_waiting": lambda: action.set_waiting(True),
+            "set_pregame": lambda: action.set_pregame(),
+            "set_run": lambda: action.set_run(user, users, board, 0),
+            "move_accepted": lambda: action.move(None),
+            "move_rejected": lambda: action.move("It is not your turn"),
+            "connection_refuse": lambda: action.connection_refuse("Server is full"),
+            "connection": lambda: action.connection(JSON),
+            "ok": lambda: action.ok(),
+            "err": lambda: action.err("Failed to set user name"),
+            }
+    for name, build in builders.items():
+        cases[f"action.{name}"] = lambda build=build: build().encode(JSON)
+    return cases
+
+
+def receive_cases(logger: logging.Logger) -> dict[str, Callable[[], object]]:
+    """Frame parse and decode of the server receive path, one frame and a pipelined batch"""
+    cases = {}
+    for name, codec in CODECS.items():
+        body = codec.dumps({"action": "move", "column": 3, "turn-count": 12})
+        frame = struct.pack('<i', len(body)) + body
+        conn = Connection(None, ("127.0.0.1", 5000))
+        conn.codec = codec
+
+        def parse(conn=conn, data=frame):
+            for payload in conn.feed(data):
+                conn.decode(payload)
+
+        def parse_batch(conn=conn, data=frame * 8):
+            for payload in conn.feed(data):
+                conn.decode(payload)
+
+        cases[f"receive.{name}.frame"] = parse
+        cases[f"receive.{name}.batch8"] = parse_batch
+    return cases
+
+
+def play_game(server: LoopbackServer, client_action: ClientAction) -> int:
+    """Two players connect over loopback and play a game to a vertical win.
+    Returns the number of messages received by the players"""
+    players = [server.connect(), server.connect()]
+    received = 0
+    messages = {}
+    for endpoint in players:
+        endpoint.sendall(client_action.connect())
+    for endpoint in players:
+        endpoint.sendall(client_action.set_name("bench"))
+    for endpoint in players:
+        for frame in endpoint.frames():
+            msg = JSON.loads(frame)
+            received += 1
+            if msg.get("state") == "run":
+                messages["run"] = msg
+    run = messages["run"]
+    first = players[0] if run["first_player_port"] == players[0].addr[1] else players[1]
+    second = players[1] if first is players[0] else players[0]
+    # First player stacks column 0, the second column 1, first wins on turn 7
+    for turn, (endpoint, column) in enumerate([(first, 0), (second, 1)] * 3 + [(first, 0)], start=1):
+        endpoint.sendall(client_action.move(column, turn))
+    for endpoint in players:
+        received += len(endpoint.frames())
+        endpoint.close()
+    return received
+
+
+def game_cases(logger: logging.Logger) -> dict[str, Callable[[], object]]:
+    """A full game between two players over the in-memory loopback transport"""
+    server = LoopbackServer(logging.WARNING)
+    client_action = ClientAction(logger)
+    return {"loopback.game": lambda: play_game(server, client_action)}
+
+
+def bot_cases(logger: logging.Logger) -> dict[str, Callable[[], object]]:
+    """A bot's move search, from the empty board and from a midgame position.
+    Each search starts with an empty transposition table"""
+    cases = {}
+    for position_name, moves in (("empty", []), ("midgame", WIN_POSITIONS["no_win"][0])):
+        position, mask = position_of(played_board(BitBoard, logger, moves), -1)
+        cases[f"bot.search.{position_name}"] = lambda position=position, mask=mask: Engine().best_move(position, mask)
+    return cases
+
+
+def client_cases(logger: logging.Logger) -> dict[str, Callable[[], object]]:
+    """The client's MessageHandler.format_board. Needs the client's dependencies"""
+    try:
+        from client_lib.message_handler import MessageHandler
+    except ImportError as e:
+        logger.warning(f"Skipping client benchmarks: {e}")
+        return {}
+    handler = MessageHandler.__new__(MessageHandler)
+    handler.logger = logger
+    wire = played_board(BitBoard, logger, WIN_POSITIONS["diagonal"][0]).wire()
+    return {"client.format_board": lambda: handler.format_board(wire)}
+
+
+def all_cases(logger: logging.Logger) -> dict[str, Callable[[], object]]:
+    """Every benchmark case by name"""
+    cases = {}
+    for group in (win_cases, board_cases, action_cases, receive_cases, game_cases, bot_cases, client_cases):
+        cases.update(group(logger))
+    return cases
+
+
+def measure(func: Callable[[], object], repeat: int) -> float:
+    """Best time of several runs in nanoseconds per call"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number))
+    return best / number * 1e9
+
+
+def compare(results: dict[str, float], baseline: dict[str, float], threshold: float) -> list[str]:
+    """Cases that are slower than the baseline by more than the threshold fraction"""
+    regressions = []
+    for name, ns in results.items():
+        base = baseline.get(name)
+        if base is not None and base > 0 and ns > base * (1 + threshold):
+            regressions.append(f"{name}: {base:.1f} ns -> {ns:.1f} ns ({(ns / base - 1) * 100:+.1f}%)")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the ConnectFour hot paths")
+    parser.add_argument("-k", "--filter", help="Only run cases whose name contains this text")
+    parser.add_argument("-r", "--repeat", help="Timing runs per case, the best is kept: Default 5", type=int, default=5)
+    parser.add_argument("-o", "--output", help="Write results as json to this file")
+    parser.add_argument("-b", "--baseline", help="Compare against results stored in this json file")
+    parser.add_argument("-t", "--threshold", help="Allowed slowdown against the baseline as a fraction: Default 0.2", type=float, default=0.2)
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logger = new_logger()
+
+    results = {}
+    for name, func in all_cases(logger).items():
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = round(measure(func, args.repeat), 1)
+        print(f"{name:<45} {results[name]:>12.1f} ns", file=sys.stderr)
+
+    report = {"unit": "ns/op", "python": sys.version.split()[0], "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} case(s) regressed by more than {args.threshold * 100:.0f}%:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            sys.exit(1)
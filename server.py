@@ -1,48 +1,95 @@
 import logging
 import selectors
 import socket
-import json
-import struct
 import argparse
+import os
+import time
 
 from server_lib.action import Action
+from server_lib.async_server import AsyncServer
+from server_lib.bitboard import BitBoard
+from server_lib.board import Board
+from server_lib.bot import SEARCH_DEPTH
+from server_lib.connection import DEFAULT_MAX_FRAME_SIZE, SEND_LIMIT, Connection, FrameSizeError
+from server_lib.logs import server_logger
 from server_lib.message_handler import MessageHandler
+from server_lib.metrics import DUMP_INTERVAL, MetricsEndpoint
+from server_lib.workers import Supervisor, listen_socket
 
 class Server:
-    def __init__(self, port: int, log_level) -> None:
+    def __init__(self, port: int, log_level, max_rooms: int|None = None, board_class: type[Board]|type[BitBoard] = BitBoard,
+                 max_frame_size: int = DEFAULT_MAX_FRAME_SIZE, metrics_port: int|None = None, metrics_file: str|None = None,
+                 bot_wait: float|None = None, bot_depth: int = SEARCH_DEPTH, bot_workers: int = 0,
+                 bot_book: str|None = None, tablebase: str|None = None) -> None:
         """Initialize server listening on the given port.
-        Logger is configured as a stdout logger at the given level."""
+        Logger is configured as a stdout logger at the given level.
+        max_rooms limits how many games are hosted at once (None for no limit).
+        board_class selects the board engine used by every room.
+        max_frame_size is the largest frame, in bytes, accepted from a client.
+        metrics_port serves the metrics over HTTP at that port, and metrics_file
+        is rewritten with the metrics every DUMP_INTERVAL seconds.
+        bot_wait is how long a player waits alone before playing a bot (None for
+        no bots), bot_depth is how many plies deep bots search, and bot_workers
+        is the number of processes that run bot searches (0 to search in the
+        event loop). bot_book is an opening book file bots play openings from,
+        and tablebase an endgame tablebase file played by bots and given as hints."""
         
         # Logging
-        ch = logging.StreamHandler()
-        ch.setLevel(log_level)
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        ch.setFormatter(formatter)
-        self.logger = logging.getLogger('CONNECT-FOUR SERVER')
-        self.logger.setLevel(log_level)
-        self.logger.addHandler(ch)
-
-        # Socket selectors
+        self.logger = server_logger(log_level)
+
+        # Socket selector
         self.port = port
-        self.read_sel = selectors.DefaultSelector()
-        self.write_sel = selectors.DefaultSelector()
+        self.max_frame_size = max_frame_size
+        self.sel = selectors.DefaultSelector()
+        # Set by the worker supervisor. An inherited listening socket, or
+        # binding with SO_REUSEPORT to share the port with other workers
+        self.listen_sock = None
+        self.reuse_port = False
+
+        # Periodic stats reports, called with the handler stats every stats_interval seconds
+        self.stats_reporter = None
+        self.stats_interval = 10.0
+
+        # Metrics exposition
+        self.metrics_port = metrics_port
+        self.metrics_file = metrics_file
+        self.metrics_endpoint: MetricsEndpoint|None = None
 
         # Client map
         self.connected_clients = {}
+        # Connections that failed while writing, closed after the current event
+        self.failed_clients = set()
+        # Connections sent frames while handling the current batch of events,
+        # each is written once the batch is done
+        self.deferred_clients: set[Connection] = set()
 
         # Sending actions and receiving handler
         self.action = Action(self.logger)
-        self.handler = MessageHandler(self.logger, self.action, self.write_sel, self.connected_clients)
+        self.handler = MessageHandler(self.logger, self.action, self.connected_clients, max_rooms, board_class, bot_wait, bot_depth,
+                                      bot_workers, bot_book, tablebase)
+        # Written to by the bot search pool's thread to wake the selector when searches finish
+        self.wake_recv: socket.socket|None = None
+        self.wake_send: socket.socket|None = None
 
     def start_server(self) -> None:
         """ Binding to accept connections from any routable address at the 
-        given port. TCP socket."""
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.bind(('', self.port))
-        self.sock.listen()
-        self.logger.info(f'Started Server at port {self.port}')
-        self.read_sel.register(self.sock, selectors.EVENT_READ, self.accept_conn)
+        given port. TCP socket. Workers use the listening socket they inherited, if any."""
+        if self.listen_sock is not None:
+            self.sock = self.listen_sock
+        else:
+            self.sock = listen_socket(self.port, self.reuse_port)
+        self.sock.setblocking(False)
+        self.logger.info('Started Server at port %s', self.port)
+        self.sel.register(self.sock, selectors.EVENT_READ, self.accept_conn)
+        if self.metrics_port is not None:
+            self.metrics_endpoint = MetricsEndpoint(self.logger, self.handler.metrics, self.sel, self.metrics_port)
+            self.metrics_endpoint.start()
+        if self.handler.bot_pool is not None:
+            self.wake_recv, self.wake_send = socket.socketpair()
+            self.wake_recv.setblocking(False)
+            self.wake_send.setblocking(False)
+            self.sel.register(self.wake_recv, selectors.EVENT_READ, self.bot_moves_ready)
+            self.handler.bot_pool.wakeup = self.wake
         
     def shutdown(self) -> None:
         """ Server shutdown. Just closes connections, clients 
@@ -51,95 +98,207 @@ class Server:
         for conn in self.connected_clients.keys():
             conn.close()
         self.sock.close()
+        if self.metrics_endpoint is not None:
+            self.metrics_endpoint.shutdown()
+        if self.handler.bot_pool is not None:
+            self.handler.bot_pool.shutdown()
+        if self.wake_recv is not None:
+            self.wake_recv.close()
+            self.wake_send.close()
+        if self.metrics_file is not None:
+            self.handler.metrics.dump(self.metrics_file)
 
-    def accept_conn(self, sock) -> None:
-        """Accept incoming connections. Connections are refused when there are already
-        two players connected, or the game is in the finished state. The game leaves 
-        the finished state once all players disconnect from the game"""
-        conn, addr = sock.accept()
-        self.logger.info(f'Accepted client connection from host: {addr[0]}, port: {addr[1]}')
-
-        if len(self.connected_clients) == 2:
-            self.logger.warning(f'Too many clients! only two players are allowed. Removing last added client')
-            conn.sendall(self.action.connection_refuse("Too many players"))
-            conn.shutdown(socket.SHUT_RDWR)
-            return
-        if self.handler.game_finished():
-            self.logger.warning(f'Attempted to connect to finished game. Refused')
-            conn.sendall(self.action.connection_refuse("Players still exiting game"))
-            conn.shutdown(socket.SHUT_RDWR)
+    def wake(self) -> None:
+        """Wake the selector from another thread"""
+        try:
+            self.wake_send.send(b"\0")
+        except (BlockingIOError, OSError):
+            # Already woken, or shutting down
+            pass
+
+    def bot_moves_ready(self, sock, mask) -> None:
+        """Bot searches have finished. Their moves are played and sent with the rest of the batch"""
+        try:
+            while sock.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        self.handler.bot_moves_ready()
+
+    def accept_conn(self, sock, mask) -> None:
+        """Accept incoming connections. The client is seated in a room once
+        its connect message has been handled"""
+        try:
+            conn, addr = sock.accept()
+        except (BlockingIOError, InterruptedError):
+            # Another worker sharing the socket accepted it first
             return
+        self.logger.info('Accepted client connection from host: %s, port: %s', addr[0], addr[1])
 
         # Register client information
-        self.connected_clients[conn] = addr
-        self.read_sel.register(conn, selectors.EVENT_READ, self.receive)
-        self.write_sel.register(conn, selectors.EVENT_WRITE)
-        self.handler.new_player_connected(addr)
+        self.handler.metrics.connections_accepted.inc()
+        conn.setblocking(False)
+        self.connected_clients[conn] = Connection(conn, addr, self.max_frame_size, self.update_interest, self.deferred_clients)
+        self.sel.register(conn, selectors.EVENT_READ, self.client_event)
+        self.handler.new_connection(conn)
+
+    def client_event(self, sock, mask) -> None:
+        """Readiness event on a client socket. Queued output is flushed
+        when writable, and input is read when readable"""
+        conn = self.connected_clients.get(sock)
+        if conn is None:
+            return
+        if mask & selectors.EVENT_WRITE:
+            conn.flush()
+        if mask & selectors.EVENT_READ and not conn.paused:
+            self.receive(sock)
+
+    def update_interest(self, conn: Connection) -> None:
+        """Called by a connection when its outbound queue changes. Write interest
+        is only registered while data is queued, and read interest is dropped
+        while the connection is paused by backpressure"""
+        if conn.failed:
+            self.failed_clients.add(conn.sock)
+            return
+        events = selectors.EVENT_READ
+        if conn.paused:
+            events = selectors.EVENT_WRITE
+        elif conn.wants_write():
+            events |= selectors.EVENT_WRITE
+        try:
+            key = self.sel.get_key(conn.sock)
+        except KeyError:
+            return
+        if key.events != events:
+            self.sel.modify(conn.sock, events, key.data)
 
     def receive(self, sock) -> None:
-        """Receive loop for the server.
-        Managed by selector"""
-        bmsg_len = b""
-        chunk = sock.recv(4)
+        """Receive handler for the server. Managed by selector.
+        Reads whatever is available without blocking, then dispatches every
+        complete frame in the connection's receive buffer in order. A client
+        that pipelines several frames has them all handled in one wake-up, and
+        the responses are written together at the end of the batch. Bytes are
+        read straight into the connection's buffer and frames are decoded from
+        views of it"""
+        conn = self.connected_clients[sock]
+        try:
+            size = sock.recv_into(conn.read_buffer())
+        except (BlockingIOError, InterruptedError):
+            return
+        except ConnectionError:
+            size = 0
         # Client has closed a connection
-        if not chunk:
+        if not size:
             self.closed_connection(sock)
             return
 
-        bmsg_len += chunk
-        # Ensure all 4 bytes have been read
-        while (len(bmsg_len) != 4):
-            chunk = sock.recv(4-len(bmsg_len))
-            if not chunk:
-                self.closed_connection(sock)
-                return
-            bmsg_len += chunk
-
-        msg_len = struct.unpack('<i', bmsg_len)[0]
-        msg = ""
-        chunk = sock.recv(msg_len).decode("utf-8")
-        # Client has closed a connection
-        if not chunk:
+        self.handler.metrics.bytes_received.inc(size)
+        try:
+            frames = conn.received(size)
+        except FrameSizeError as e:
+            self.logger.warning('Invalid frame length %s from client at %s. Closing connection', e.args[0], conn.addr)
             self.closed_connection(sock)
             return
+        self.handler.metrics.frames_received.inc(len(frames))
 
-        msg += chunk
-        # Ensure the full message has been received
-        while (len(msg) != msg_len):
-            chunk = sock.recv(msg_len-len(msg)).decode("utf-8")
-            if not chunk:
-                self.closed_connection(sock)
-                return
-            msg += chunk
-
-        json_msg = json.loads(msg)
-        self.logger.debug(f'Received {json_msg} from client at {self.connected_clients.get(sock)}')
-        self.handler.handle_message(json_msg, sock)
+        for frame in frames:
+            # A message that fails to decode or to be handled is dropped, the
+            # other clients keep being served
+            try:
+                msg = conn.decode(frame)
+                if msg is None:
+                    self.logger.warning('Malformed message from client at %s. Dropped', conn.addr)
+                    continue
+                self.logger.debug('Received %s from client at %s', msg, conn.addr)
+                self.handler.handle_message(msg, sock)
+            except Exception:
+                self.logger.exception('Failed to handle message from client at %s. Dropped', conn.addr)
 
     def closed_connection(self, sock) -> None:
         """When an empty message was read on a ready socket.
         The client has closed the connection, and it should be removed
         from server"""
-        self.logger.info(f'Client at {self.connected_clients.get(sock)} closed connection')
-        addr = self.connected_clients.pop(sock)
-        self.read_sel.unregister(sock)
-        self.write_sel.unregister(sock)
-        self.handler.remove_player(addr)
+        conn = self.connected_clients.pop(sock, None)
+        if conn is None:
+            return
+        self.logger.info('Client at %s closed connection', conn.addr)
+        self.sel.unregister(sock)
+        self.handler.remove_player(sock, conn.addr)
+        sock.close()
+
+    def close_failed(self) -> None:
+        """Close connections that failed while being written to, either
+        by a socket error or by exceeding the outbound queue limit, and
+        finished connections that have sent everything they had queued"""
+        while self.failed_clients:
+            sock = self.failed_clients.pop()
+            conn = self.connected_clients.get(sock)
+            if conn is not None and conn.wbuf_size > SEND_LIMIT:
+                self.logger.warning('Client at %s is not reading its messages. Closing connection', conn.addr)
+            self.closed_connection(sock)
+            # Frames sent to other clients when this one left
+            self.flush_deferred()
+
+    def flush_deferred(self) -> None:
+        """Write the frames queued while handling the last batch of events,
+        with a single write per connection"""
+        while self.deferred_clients:
+            conn = self.deferred_clients.pop()
+            if conn.sock in self.connected_clients:
+                conn.flush()
 
 
     def run(self) -> None:
         """Main loop for server. Manages selectors"""
         self.start_server()
         self.logger.info("Server is initialized")
+        next_report = time.monotonic() + self.stats_interval
+        next_dump = time.monotonic() + DUMP_INTERVAL
         while True:
-            for key, _ in self.read_sel.select():
+            timeout = None
+            if self.stats_reporter is not None:
+                timeout = max(0.0, next_report - time.monotonic())
+            if self.metrics_file is not None:
+                dump_timeout = max(0.0, next_dump - time.monotonic())
+                timeout = dump_timeout if timeout is None else min(timeout, dump_timeout)
+            # Wake up for the next tick of the timer wheel
+            deadline = self.handler.timers.next_deadline()
+            if deadline is not None:
+                timer_timeout = max(0.0, deadline - time.monotonic())
+                timeout = timer_timeout if timeout is None else min(timeout, timer_timeout)
+            for key, mask in self.sel.select(timeout):
                 sock, cb = key.fileobj, key.data
-                cb(sock)
+                cb(sock, mask)
+            if deadline is not None:
+                self.handler.timers.advance(time.monotonic())
+            self.flush_deferred()
+            if self.failed_clients:
+                self.close_failed()
+            if self.stats_reporter is not None and time.monotonic() >= next_report:
+                self.stats_reporter(self.handler.stats())
+                next_report = time.monotonic() + self.stats_interval
+            if self.metrics_file is not None and time.monotonic() >= next_dump:
+                self.handler.metrics.dump(self.metrics_file)
+                next_dump = time.monotonic() + DUMP_INTERVAL
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("-p","--port", required=True, help="Port used to run the ConnectFour server", type=int)
     parser.add_argument("--loglevel", help="Log verbosity level: Default INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    parser.add_argument("--max-rooms", help="Maximum number of games hosted at once: Default unlimited", type=int)
+    parser.add_argument("--board", help="Board engine: Default bitboard", choices=["bitboard", "dict"], default="bitboard")
+    parser.add_argument("--max-frame-size", help=f"Largest frame in bytes accepted from a client: Default {DEFAULT_MAX_FRAME_SIZE}", type=int, default=DEFAULT_MAX_FRAME_SIZE)
+    parser.add_argument("--engine", help="Event loop engine: Default selectors", choices=["selectors", "asyncio"], default="selectors")
+    parser.add_argument("--uvloop", help="Run the asyncio engine on uvloop, if installed", action="store_true")
+    parser.add_argument("--workers", help="Number of worker processes sharing the port: Default 0, a single process", type=int, default=0)
+    parser.add_argument("--metrics-port", help="Serve metrics in the Prometheus text format over HTTP at this port", type=int)
+    parser.add_argument("--metrics-file", help="Write metrics in the Prometheus text format to this file every 10 seconds")
+    parser.add_argument("--bot-wait", help="Seconds a player waits alone for an opponent before playing a server bot: Default no bots", type=float)
+    parser.add_argument("--bot-depth", help=f"Plies searched by server bots: Default {SEARCH_DEPTH}", type=int, default=SEARCH_DEPTH)
+    parser.add_argument("--bot-workers", help="Processes that run bot searches in each server process, 0 searches in the event loop: "
+                        "Default the number of CPUs divided by --workers, at least 1", type=int)
+    parser.add_argument("--bot-book", help="Opening book file server bots play openings from, generated with book.py")
+    parser.add_argument("--tablebase", help="Endgame tablebase file played by server bots and given to players as hints, generated with tablebase.py")
     args = parser.parse_args()
     loglevel = logging.INFO
     if args.loglevel == "DEBUG":
@@ -148,7 +307,24 @@ if __name__ == '__main__':
         loglevel = logging.WARNING
     elif args.loglevel == "ERROR":
         loglevel = logging.ERROR
-    server = Server(args.port, loglevel)
+    # Every worker process runs its own search pool, together they use each CPU once
+    if args.bot_workers is None:
+        args.bot_workers = max(1, (os.cpu_count() or 1) // max(1, args.workers))
+    board_class = BitBoard
+    if args.board == "dict":
+        board_class = Board
+    def make_server():
+        if args.engine == "asyncio":
+            return AsyncServer(args.port, loglevel, args.max_rooms, board_class, args.max_frame_size, args.uvloop,
+                               args.metrics_port, args.metrics_file, args.bot_wait, args.bot_depth, args.bot_workers,
+                               args.bot_book, args.tablebase)
+        return Server(args.port, loglevel, args.max_rooms, board_class, args.max_frame_size, args.metrics_port, args.metrics_file,
+                      args.bot_wait, args.bot_depth, args.bot_workers, args.bot_book,
+                      args.tablebase)
+    if args.workers > 0:
+        server = Supervisor(server_logger(loglevel), args.port, args.workers, make_server)
+    else:
+        server = make_server()
     try:
         server.run()
     except KeyboardInterrupt:
@@ -1,13 +1,35 @@
-import json
 from logging import Logger
-import struct
 
 from typing import TypeAlias
 
 from server_lib.board import Board
+from server_lib.codec import JSON, Codec
+from server_lib.connection import HEADER
 from server_lib.users import User, Users
 
 
+class Frame:
+    """A message ready to be sent to clients. The message is encoded at most
+    once per codec, so every client of a broadcast that uses the same codec
+    receives the same bytes"""
+
+    def __init__(self, msg: dict) -> None:
+        self.msg = msg
+        self.encoded: dict[str, tuple[bytes, bytes]] = {}
+
+    def encode(self, codec: Codec = JSON) -> tuple[bytes, bytes]:
+        """Create a byte serialization of the message with the given codec, and
+        the fixed size length integer that prefixes it on the wire. They are kept
+        apart and written with scatter-gather I/O, so the body is never copied
+        to prepend the length"""
+        data = self.encoded.get(codec.name)
+        if data is None:
+            body = codec.dumps(self.msg)
+            data = (HEADER.pack(len(body)), body)
+            self.encoded[codec.name] = data
+        return data
+
+
 class Action:
     """ Defines actions which are sent to the client(s). These
     actions are sent using the application message protocol, and define the
@@ -17,57 +39,87 @@ class Action:
 
     def __init__(self, logger: Logger) -> None:
         self.logger = logger
+        # Frames that never change are built once and reused. Each keeps its
+        # encoded bytes per codec, so sending them costs no encoding at all.
+        self.ok_frame = self.serialize({"result": "ok"})
+        self.pregame_frame = self.serialize({"broadcast": "state", "state": "pregame"})
+        self.waiting_frames = {
+                disconnect: self.serialize({"broadcast": "state", "state": "waiting", "disconnect": int(disconnect)})
+                for disconnect in (False, True)
+                }
+        self.move_accepted_frame = self.serialize({"result": "move", "move_status": "accepted"})
+        # Error and refusal frames, keyed by their fixed reason strings
+        self.move_rejected_frames: dict[str, Frame] = {}
+        self.refuse_frames: dict[str, Frame] = {}
+        self.err_frames: dict[str, Frame] = {}
+        for frame in (self.ok_frame, self.pregame_frame, self.move_accepted_frame, *self.waiting_frames.values()):
+            frame.encode(JSON)
+
+    def serialize(self, msg: dict) -> Frame:
+        """Create a frame for the message. The frame is encoded with the
+        codec of each connection it is sent to"""
+        return Frame(msg)
 
-    def serialize(self, msg: dict) -> bytes:
-        """Create a byte serialization of the message. message contents
-        are encoded in json and prefixed by a fixed size length integer to
-        encode the total message size"""
-        bjson = bytes(json.dumps(msg), encoding="utf-8")
-        return struct.pack(f'<i{len(bjson)}s', len(bjson), bjson)
+    def cached(self, cache: dict[str, Frame], key: str, msg: dict) -> Frame:
+        """Reuse the frame stored under key, creating it from msg on first use"""
+        frame = cache.get(key)
+        if frame is None:
+            frame = self.serialize(msg)
+            cache[key] = frame
+        return frame
 
-    def game_status(self, turn_count: int, expected_mover: User, board: Board) -> bytes:
+    def game_status(self, turn_count: int, expected_mover: User, board: Board, seq: int) -> Frame:
         """Sends the current gameplay status to the clients.
         Any movements made by a player other than expected or by 
-        a client with a different turn count will be rejected."""
+        a client with a different turn count will be rejected.
+        This is a full snapshot of the board, used to resynchronize clients."""
         data = {
                 "broadcast": "game_status",
                 "turn_count": turn_count,
                 "expected_mover_host": expected_mover.host,
                 "expected_mover_port": expected_mover.port,
+                "seq": seq,
+                }
+        data["board"] = board.wire()
+        return self.serialize(data)
+
+    def move_delta(self, seq: int, last_move: tuple[int, int, int], turn_count: int, expected_mover: User) -> Frame:
+        """Sends a single accepted move to the clients. Clients apply the move
+        to their own board. A client that sees a gap in the sequence number
+        has missed an update and requests a full snapshot with resync."""
+        data = {
+                "broadcast": "move_delta",
+                "seq": seq,
+                "column": last_move[0],
+                "row": last_move[1],
+                "value": last_move[2],
+                "turn_count": turn_count,
+                "expected_mover_host": expected_mover.host,
+                "expected_mover_port": expected_mover.port,
                 }
-        data_board = {}
-        for loc, value in board.items():
-            data_board[f"{loc[0]} {loc[1]}"] = value
-        data["board"] = data_board
         return self.serialize(data)
 
-    def game_win(self, board: Board, winner: User) -> bytes:
+    def game_win(self, board: Board, winner: User) -> Frame:
         """Sends the game winner message to the clients"""
         data = {
                 "broadcast": "game_win",
                 "winner_host": winner.host,
                 "winner_port": winner.port,
                 }
-        data_board = {}
-        for loc, value in board.items():
-            data_board[f"{loc[0]} {loc[1]}"] = value
-        data["board"] = data_board
+        data["board"] = board.wire()
         return self.serialize(data)
 
-    def game_draw(self, board: Board) -> bytes:
+    def game_draw(self, board: Board) -> Frame:
         """Sends the game draw message to the clients"""
         data = {
                 "broadcast": "game_draw",
                 "board": {}
                 }
-        data_board = {}
-        for loc, value in board.items():
-            data_board[f"{loc[0]} {loc[1]}"] = value
-        data["board"] = data_board
+        data["board"] = board.wire()
         return self.serialize(data)
 
 
-    def connection_start(self, addr: Address) -> bytes:
+    def connection_start(self, addr: Address) -> Frame:
         """Sends notification that a new client has connected"""
         data = {
                 "broadcast": "connection_status",
@@ -77,7 +129,7 @@ class Action:
                 }
         return self.serialize(data)
 
-    def connection_end(self, addr: Address) -> bytes:
+    def connection_end(self, addr: Address) -> Frame:
         """Sends notification that a client has disconnected."""
         data = {
                 "broadcast": "connection_status",
@@ -87,27 +139,16 @@ class Action:
                 }
         return self.serialize(data)
 
-    def set_waiting(self, disconnect: bool) -> bytes:
+    def set_waiting(self, disconnect: bool) -> Frame:
         """Sets the game state to waiting. If this was caused by a disconnection
         the disconnect field will be 1. otherwise it is 0"""
-        data = {
-                "broadcast": "state",
-                "state": "waiting",
-                "disconnect": 0
-                }
-        if disconnect:
-            data["disconnect"] = 1
-        return self.serialize(data)
+        return self.waiting_frames[bool(disconnect)]
 
-    def set_pregame(self) -> bytes:
+    def set_pregame(self) -> Frame:
         """Sets the game state to pregame"""
-        data = {
-                "broadcast": "state",
-                "state": "pregame"
-                }
-        return self.serialize(data)
+        return self.pregame_frame
 
-    def set_run(self, first_player: User, users: Users, board: Board) -> bytes:
+    def set_run(self, first_player: User, users: Users, board: Board, seq: int) -> Frame:
         """Sets the game state to run. gives first player expected information and
         all connected users information."""
         data = {
@@ -115,6 +156,7 @@ class Action:
                 "state": "run",
                 "first_player_host": first_player.host,
                 "first_player_port": first_player.port,
+                "seq": seq,
                 "board": {},
                 }
         for index, (_, user) in enumerate(users.connected_users.items()):
@@ -124,60 +166,104 @@ class Action:
                     "name": user.name,
                     "value": user.value
                     }
-        data_board = {}
-        for loc, value in board.items():
-            data_board[f"{loc[0]} {loc[1]}"] = value
-        data["board"] = data_board
+        data["board"] = board.wire()
         return self.serialize(data)
 
-    def move(self, err: str|None) -> bytes:
+    def move(self, err: str|None) -> Frame:
         """The response to a client for making a move.
         The rejected move message is used to pass error information to
         the client to indicate the reason for failed move."""
         if err is None:
-            data = {
-                    "result": "move",
-                    "move_status": "accepted"
-                    }
-        else:
-            data = {
-                    "result": "move",
-                    "move_status": "rejected",
-                    "error": err
-                    }
-        return self.serialize(data)
+            return self.move_accepted_frame
+        data = {
+                "result": "move",
+                "move_status": "rejected",
+                "error": err
+                }
+        return self.cached(self.move_rejected_frames, err, data)
 
-    def connection_refuse(self, reason: str) -> bytes:
+    def connection_refuse(self, reason: str) -> Frame:
         """Connection refused response and reason for refusal"""
         data = {
                 "result": "connection",
                 "status": "refused",
                 "reason": reason
                 }
-        return self.serialize(data)
+        return self.cached(self.refuse_frames, reason, data)
 
-    def connection(self) -> bytes:
-        """Connection connected sucessfully response"""
+    def connection(self, codec: Codec) -> Frame:
+        """Connection connected sucessfully response. Gives the codec used
+        for all following messages"""
         data = {
                 "result": "connection",
                 "status": "connected",
+                "codec": codec.name,
                 }
         return self.serialize(data)
 
-    def ok(self) -> bytes:
-        """Generic Ok response message"""
+    def spectating(self, room_id: int) -> Frame:
+        """Spectator subscribed to a room. A snapshot of the room's game
+        follows, then every broadcast in the room"""
+        data = {
+                "result": "spectate",
+                "status": "watching",
+                "room": room_id,
+                }
+        return self.serialize(data)
+
+    def session(self, token: str, status: str, grace: float) -> Frame:
+        """Session token of the player's seat. status is issued when the game
+        starts and resumed when the seat is reclaimed. A player that reconnects
+        within grace seconds with the token gets their seat back"""
+        data = {
+                "result": "session",
+                "status": status,
+                "token": token,
+                "grace": grace,
+                }
+        return self.serialize(data)
+
+    def ping(self, nonce: int, rtt: float|None) -> Frame:
+        """Heartbeat sent to the client, which answers with a pong carrying the
+        same nonce. rtt is the round trip time measured by the last heartbeat,
+        in seconds, or None before the first one completes"""
+        data = {
+                "broadcast": "ping",
+                "nonce": nonce,
+                "rtt": rtt,
+                }
+        return self.serialize(data)
+
+    def pong(self, nonce: int) -> Frame:
+        """Response to a ping sent by the client"""
+        data = {
+                "result": "pong",
+                "nonce": nonce,
+                }
+        return self.serialize(data)
+
+    def hint(self, column: int|None, outcome: str|None) -> Frame:
+        """Best column for the player to move from the endgame tablebase, and
+        the outcome it leads to with best play: win, loss or draw. Both are
+        None when the position is not in the tablebase"""
         data = {
-                "result": "ok"
+                "result": "hint",
+                "column": column,
+                "outcome": outcome,
                 }
         return self.serialize(data)
 
-    def err(self, err: str) -> bytes:
+    def ok(self) -> Frame:
+        """Generic Ok response message"""
+        return self.ok_frame
+
+    def err(self, err: str) -> Frame:
         """Generic Error response message"""
         data = {
                 "result": "err",
                 "error": err
                 }
-        return self.serialize(data)
+        return self.cached(self.err_frames, err, data)
 
 
 
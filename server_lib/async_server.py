@@ -0,0 +1,308 @@
+import asyncio
+import time
+from typing import TypeAlias
+
+from server_lib.action import Action
+from server_lib.bitboard import BitBoard
+from server_lib.board import Board
+from server_lib.bot import SEARCH_DEPTH
+from server_lib.connection import DEFAULT_MAX_FRAME_SIZE, SEND_HIGH_WATER, SEND_LIMIT, SEND_LOW_WATER, Connection, FrameSizeError
+from server_lib.logs import server_logger
+from server_lib.message_handler import MessageHandler
+from server_lib.metrics import DUMP_INTERVAL, Metrics
+
+
+class AsyncConnection(Connection):
+    """A client connection served by the asyncio engine. The transport reads
+    straight into the same receive buffer as the selector engine, while outbound data is handed to
+    the asyncio transport, which does its own buffering. With a deferred set,
+    the frames sent while handling a batch are handed over together"""
+
+    Address: TypeAlias = tuple[str, int]
+
+    def __init__(self, transport: asyncio.Transport, addr: Address, max_frame_size: int = DEFAULT_MAX_FRAME_SIZE,
+                 deferred: set[Connection]|None = None) -> None:
+        super().__init__(transport.get_extra_info('socket'), addr, max_frame_size, None, deferred)
+        self.transport = transport
+
+    def send(self, header: bytes, body: bytes) -> None:
+        """Write a frame to the transport, or queue it until the end of the
+        batch when writes are deferred"""
+        if self.failed or self.transport.is_closing():
+            return
+        if self.deferred is None:
+            self.transport.writelines((header, body))
+            self.check_limit()
+            return
+        if not self.wbuf:
+            self.deferred.add(self)
+        self.wbuf.append(header)
+        self.wbuf.append(body)
+
+    def flush(self) -> None:
+        """Hand the queued frames to the transport in one write"""
+        if not self.wbuf:
+            return
+        if not self.transport.is_closing():
+            self.transport.writelines(self.wbuf)
+        self.wbuf.clear()
+        self.check_limit()
+
+    def check_limit(self) -> None:
+        """A client that lets more than the send limit queue up is not
+        reading at all, and is disconnected"""
+        if self.transport.get_write_buffer_size() > SEND_LIMIT:
+            self.failed = True
+            self.transport.abort()
+
+    def finish(self) -> None:
+        """Close the connection once everything queued has been sent"""
+        self.closing = True
+        self.flush()
+        self.transport.close()
+
+    def abort(self) -> None:
+        """Close the connection without sending what is still buffered"""
+        self.closing = True
+        self.failed = True
+        self.transport.abort()
+
+    def wants_write(self) -> bool:
+        """Is there data in the transport waiting to be written"""
+        return bool(self.wbuf) or self.transport.get_write_buffer_size() > 0
+
+
+class ClientProtocol(asyncio.BufferedProtocol):
+    """asyncio protocol for a single client. The transport reads into the
+    connection's receive buffer, and incoming frames are dispatched to the
+    server's MessageHandler, with the protocol object used as the key that
+    identifies the client"""
+
+    def __init__(self, server: "AsyncServer") -> None:
+        self.server = server
+        self.conn: AsyncConnection|None = None
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        """New client. Backpressure water marks are handed to the transport"""
+        addr = transport.get_extra_info('peername')[:2]
+        transport.set_write_buffer_limits(SEND_HIGH_WATER, SEND_LOW_WATER)
+        self.conn = AsyncConnection(transport, addr, self.server.max_frame_size, self.server.deferred_clients)
+        self.server.accept_conn(self, self.conn)
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        """Free space of the connection's receive buffer for the transport to read into"""
+        return self.conn.read_buffer()
+
+    def buffer_updated(self, nbytes: int) -> None:
+        """Dispatch every complete frame in the connection's receive buffer in
+        order, then write the responses of the whole batch"""
+        conn = self.conn
+        if conn is None:
+            return
+        self.server.handler.metrics.bytes_received.inc(nbytes)
+        try:
+            frames = conn.received(nbytes)
+        except FrameSizeError as e:
+            self.server.logger.warning('Invalid frame length %s from client at %s. Closing connection', e.args[0], conn.addr)
+            conn.transport.abort()
+            return
+        self.server.handler.metrics.frames_received.inc(len(frames))
+        for frame in frames:
+            # A message that fails to decode or to be handled is dropped, the
+            # other clients keep being served
+            try:
+                msg = conn.decode(frame)
+                if msg is None:
+                    self.server.logger.warning('Malformed message from client at %s. Dropped', conn.addr)
+                    continue
+                self.server.logger.debug('Received %s from client at %s', msg, conn.addr)
+                self.server.handler.handle_message(msg, self)
+            except Exception:
+                self.server.logger.exception('Failed to handle message from client at %s. Dropped', conn.addr)
+        self.server.flush_deferred()
+
+    def connection_lost(self, exc: Exception|None) -> None:
+        """Client has closed the connection, or it was aborted"""
+        self.server.closed_connection(self)
+
+    def pause_writing(self) -> None:
+        """Transport buffer is above the high-water mark, stop reading from this client"""
+        if self.conn is not None:
+            self.conn.paused = True
+            self.conn.transport.pause_reading()
+
+    def resume_writing(self) -> None:
+        """Transport buffer drained to the low-water mark, resume reading"""
+        if self.conn is not None:
+            self.conn.paused = False
+            if not self.conn.transport.is_closing():
+                self.conn.transport.resume_reading()
+
+
+class MetricsProtocol(asyncio.Protocol):
+    """Plain HTTP endpoint serving the metrics. Every request, whatever its
+    path, is answered with the rendered metrics and the connection is closed"""
+
+    def __init__(self, metrics: Metrics) -> None:
+        self.metrics = metrics
+        self.transport: asyncio.Transport|None = None
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
+
+    def data_received(self, data: bytes) -> None:
+        """Answer the request with the metrics"""
+        if self.transport is None or self.transport.is_closing():
+            return
+        self.transport.write(self.metrics.http_response())
+        self.transport.close()
+
+
+class AsyncServer:
+    """Server engine built on asyncio. Uses the same MessageHandler, rooms, games
+    and actions as the selector engine. Timers, timeouts and background tasks can
+    be scheduled on its event loop, and a uvloop event loop can be used in place
+    of the default one."""
+
+    def __init__(self, port: int, log_level, max_rooms: int|None = None, board_class: type[Board]|type[BitBoard] = BitBoard,
+                 max_frame_size: int = DEFAULT_MAX_FRAME_SIZE, use_uvloop: bool = False, metrics_port: int|None = None,
+                 metrics_file: str|None = None, bot_wait: float|None = None, bot_depth: int = SEARCH_DEPTH,
+                 bot_workers: int = 0, bot_book: str|None = None, tablebase: str|None = None) -> None:
+        """Initialize server listening on the given port. Options are the same as the
+        selector server. use_uvloop runs the server on a uvloop event loop if uvloop is installed."""
+        # Logging
+        self.logger = server_logger(log_level)
+
+        self.port = port
+        self.max_frame_size = max_frame_size
+        self.use_uvloop = use_uvloop
+        self.loop: asyncio.AbstractEventLoop|None = None
+        self.server: asyncio.AbstractServer|None = None
+        # Set by the worker supervisor. An inherited listening socket, or
+        # binding with SO_REUSEPORT to share the port with other workers
+        self.listen_sock = None
+        self.reuse_port = False
+
+        # Periodic stats reports, called with the handler stats every stats_interval seconds
+        self.stats_reporter = None
+        self.stats_interval = 10.0
+
+        # Metrics exposition
+        self.metrics_port = metrics_port
+        self.metrics_file = metrics_file
+        self.metrics_server: asyncio.AbstractServer|None = None
+
+        # Client map
+        self.connected_clients: dict[ClientProtocol, AsyncConnection] = {}
+        # Connections sent frames while handling the current event, each is
+        # written once the event is handled
+        self.deferred_clients: set[Connection] = set()
+
+        # Sending actions and receiving handler
+        self.action = Action(self.logger)
+        self.handler = MessageHandler(self.logger, self.action, self.connected_clients, max_rooms, board_class, bot_wait, bot_depth,
+                                      bot_workers, bot_book, tablebase)
+
+    def accept_conn(self, protocol: ClientProtocol, conn: AsyncConnection) -> None:
+        """Register a new client. The client is seated in a room once its
+        connect message has been handled"""
+        self.logger.info('Accepted client connection from host: %s, port: %s', conn.addr[0], conn.addr[1])
+        self.handler.metrics.connections_accepted.inc()
+        self.connected_clients[protocol] = conn
+        self.handler.new_connection(protocol)
+
+    def closed_connection(self, protocol: ClientProtocol) -> None:
+        """The client's connection is gone, remove it from the server"""
+        conn = self.connected_clients.pop(protocol, None)
+        if conn is None:
+            return
+        self.logger.info('Client at %s closed connection', conn.addr)
+        self.handler.remove_player(protocol, conn.addr)
+        self.flush_deferred()
+
+    def flush_deferred(self) -> None:
+        """Write the frames queued while handling the last event, with a single
+        write per connection"""
+        while self.deferred_clients:
+            self.deferred_clients.pop().flush()
+
+    async def serve(self) -> None:
+        """Bind to accept connections from any routable address at the given
+        port, then serve until cancelled"""
+        self.loop = asyncio.get_running_loop()
+        if self.listen_sock is not None:
+            self.server = await self.loop.create_server(lambda: ClientProtocol(self), sock=self.listen_sock)
+        else:
+            self.server = await self.loop.create_server(lambda: ClientProtocol(self), port=self.port, reuse_address=True,
+                                                        reuse_port=self.reuse_port or None)
+        self.logger.info('Started Server at port %s', self.port)
+        if self.metrics_port is not None:
+            self.metrics_server = await self.loop.create_server(lambda: MetricsProtocol(self.handler.metrics),
+                                                                port=self.metrics_port, reuse_address=True)
+            self.logger.info("Serving metrics at port %s", self.metrics_port)
+        self.logger.info("Server is initialized")
+        if self.stats_reporter is not None:
+            self.loop.call_later(self.stats_interval, self.report_stats)
+        if self.metrics_file is not None:
+            self.loop.call_later(DUMP_INTERVAL, self.dump_metrics)
+        self.loop.call_later(self.handler.timers.tick, self.advance_timers)
+        if self.handler.bot_pool is not None:
+            self.handler.bot_pool.wakeup = self.wake
+        async with self.server:
+            await self.server.serve_forever()
+
+    def report_stats(self) -> None:
+        """Report the handler stats, then schedule the next report"""
+        if self.stats_reporter is not None and self.loop is not None:
+            self.stats_reporter(self.handler.stats())
+            self.loop.call_later(self.stats_interval, self.report_stats)
+
+    def advance_timers(self) -> None:
+        """Fire the handler's due timers, then schedule the next tick of the timer wheel"""
+        if self.loop is not None:
+            self.handler.timers.advance(time.monotonic())
+            self.flush_deferred()
+            self.loop.call_later(self.handler.timers.tick, self.advance_timers)
+
+    def wake(self) -> None:
+        """Called by the bot search pool's thread when searches finish, the
+        moves are played on the event loop"""
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.bot_moves_ready)
+
+    def bot_moves_ready(self) -> None:
+        """Play the moves of finished bot searches, then write them"""
+        self.handler.bot_moves_ready()
+        self.flush_deferred()
+
+    def dump_metrics(self) -> None:
+        """Write the metrics file, then schedule the next dump"""
+        if self.metrics_file is not None and self.loop is not None:
+            self.handler.metrics.dump(self.metrics_file)
+            self.loop.call_later(DUMP_INTERVAL, self.dump_metrics)
+
+    def run(self) -> None:
+        """Main entry for the asyncio engine. Blocks until the server stops"""
+        if self.use_uvloop:
+            try:
+                import uvloop
+                asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+                self.logger.info("Using uvloop event loop")
+            except ImportError:
+                self.logger.warning("uvloop is not installed, using the default asyncio event loop")
+        asyncio.run(self.serve())
+
+    def shutdown(self) -> None:
+        """ Server shutdown. Just closes connections, clients
+        are left to handle this. """
+        self.logger.info("Shutting down server")
+        for conn in list(self.connected_clients.values()):
+            conn.transport.close()
+        if self.server is not None:
+            self.server.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        if self.handler.bot_pool is not None:
+            self.handler.bot_pool.shutdown()
+        if self.metrics_file is not None:
+            self.handler.metrics.dump(self.metrics_file)
@@ -0,0 +1,126 @@
+from logging import Logger
+
+from server_lib.board import CELL_KEYS, new_wire_board
+from server_lib.zobrist import MIRROR_KEYS, MIRROR_SWAP_KEYS, SWAP_KEYS, ZOBRIST_KEYS, canonical
+
+
+# Each column uses 7 bits, the 6 playable rows and one empty sentinel bit
+# on top. The sentinel keeps shifted runs from wrapping into the next column.
+COLUMNS = 7
+ROWS = 6
+COLUMN_BITS = ROWS + 1
+
+# Shift distances for vertical, horizontal and both diagonal directions
+DIRECTIONS = (1, COLUMN_BITS, COLUMN_BITS - 1, COLUMN_BITS + 1)
+
+
+class BitBoard:
+    """Server-side representation of the game-play board stored as two
+    64-bit integer bitboards, one per player value, and a small array of
+    column heights. Provides the same public interface as Board."""
+
+    def __init__(self, logger: Logger) -> None:
+        self.logger = logger
+        self.clean_state()
+
+    @property
+    def canonical_hash(self) -> int:
+        """Zobrist hash shared by the position and its mirror image"""
+        return canonical(self.zobrist_hash, self.mirror_hash)
+
+    @property
+    def mirrored(self) -> bool:
+        """Whether canonical_hash is the hash of the mirror image, in which case
+        columns stored under it are mirrored"""
+        return self.mirror_hash < self.zobrist_hash
+
+    def next_row_in_column(self, column: int) -> int|None:
+        """Gives the next row to be played in the given column.
+        Once the last row for the column has been played, returns None"""
+        ret_row = self.heights[column]
+        # Above the board height
+        if ret_row == ROWS:
+            return None
+        self.heights[column] = ret_row + 1
+        return ret_row
+
+    def move(self, column: int, row: int, value: int) -> None:
+        """Assigns the user's value to the given location on the board"""
+        self.logger.debug("Making move at (%s, %s) => %s", column, row, value)
+        bit = 1 << (column * COLUMN_BITS + row)
+        if value == 1:
+            self.player_one |= bit
+        else:
+            self.player_two |= bit
+        cell = (column, row)
+        self.wire_board[CELL_KEYS[cell]] = value
+        self.stones += 1
+        # The stone is placed with the key of the player to move, then every
+        # stone changes side, as the other player is to move
+        self.swap_hash ^= SWAP_KEYS[cell]
+        self.mirror_swap_hash ^= MIRROR_SWAP_KEYS[cell]
+        self.zobrist_hash ^= ZOBRIST_KEYS[1][cell] ^ self.swap_hash
+        self.mirror_hash ^= MIRROR_KEYS[1][cell] ^ self.mirror_swap_hash
+
+    def get_value(self, column: int, row: int) -> int:
+        """Retrieve the current value at the input position"""
+        if not 0 <= column < COLUMNS or not 0 <= row < ROWS:
+            raise KeyError((column, row))
+        bit = 1 << (column * COLUMN_BITS + row)
+        if self.player_one & bit:
+            return 1
+        if self.player_two & bit:
+            return -1
+        return 0
+
+    def check_win(self, column: int, row: int) -> bool:
+        """Checks if the piece at the given location completes four in a row.
+        Pairs of adjacent pieces are found with one shift-and-AND per direction,
+        and a second shift finds two adjacent pairs."""
+        if self.get_value(column, row) == 1:
+            position = self.player_one
+        else:
+            position = self.player_two
+        for shift in DIRECTIONS:
+            pairs = position & (position >> shift)
+            if pairs & (pairs >> (2 * shift)):
+                return True
+        return False
+
+    def clean(self) -> None:
+        """Wipe the board of all values != 0"""
+        self.clean_state()
+        self.logger.info("Cleaned board")
+
+    def items(self):
+        """Iterate the board as ((column, row), value) pairs, in the same
+        column-major order as the dictionary board"""
+        for column in range(COLUMNS):
+            for row in range(ROWS):
+                bit = 1 << (column * COLUMN_BITS + row)
+                if self.player_one & bit:
+                    value = 1
+                elif self.player_two & bit:
+                    value = -1
+                else:
+                    value = 0
+                yield (column, row), value
+
+    def wire(self) -> dict[str, int]:
+        """Copy of the board keyed by "column row" strings, as sent to clients"""
+        return dict(self.wire_board)
+
+    def clean_state(self) -> None:
+        """Reset bitboards, column heights, stone count and hashes to an empty board"""
+        self.player_one = 0
+        self.player_two = 0
+        self.heights = bytearray(COLUMNS)
+        # The board in the form sent to clients, kept up to date by move
+        self.wire_board = new_wire_board()
+        self.stones = 0
+        # Zobrist hashes of the position and of its mirror image, keyed by the
+        # side to move, and the swap keys of the occupied cells. Kept up to date by move
+        self.zobrist_hash = 0
+        self.mirror_hash = 0
+        self.swap_hash = 0
+        self.mirror_swap_hash = 0
@@ -1,5 +1,17 @@
+import logging
 from logging import Logger
 
+from server_lib.zobrist import MIRROR_KEYS, MIRROR_SWAP_KEYS, SWAP_KEYS, ZOBRIST_KEYS, canonical
+
+
+# "column row" keys used for the board in messages to clients, precomputed for every cell
+CELL_KEYS = {(column, row): f"{column} {row}" for column in range(7) for row in range(6)}
+
+
+def new_wire_board() -> dict[str, int]:
+    """Create new message form board initialized to 0's"""
+    return dict.fromkeys(CELL_KEYS.values(), 0)
+
 
 class Board:
     """Server-side representation of the game-play board"""
@@ -7,8 +19,22 @@ class Board:
     def __init__(self, logger: Logger) -> None:
         self.column_tracker = self.new_column_tracker()
         self.board = self.new_board()
+        # The board in the form sent to clients, kept up to date by move
+        self.wire_board = new_wire_board()
+        self.clean_hashes()
         self.logger = logger
 
+    @property
+    def canonical_hash(self) -> int:
+        """Zobrist hash shared by the position and its mirror image"""
+        return canonical(self.zobrist_hash, self.mirror_hash)
+
+    @property
+    def mirrored(self) -> bool:
+        """Whether canonical_hash is the hash of the mirror image, in which case
+        columns stored under it are mirrored"""
+        return self.mirror_hash < self.zobrist_hash
+
     def next_row_in_column(self, column: int) -> int|None:
         """Gives the next row to be played in the given column.
         Once the last row for the column has been played, returns None"""
@@ -21,23 +47,148 @@ class Board:
 
     def move(self, column: int, row: int, value: int) -> None:
         """Assigns the user's value to the given location on the board"""
-        self.logger.info(f"Making move at ({column}, {row}) => {value}")
-        self.board[(column, row)] = value
+        self.logger.debug("Making move at (%s, %s) => %s", column, row, value)
+        cell = (column, row)
+        self.board[cell] = value
+        self.wire_board[CELL_KEYS[cell]] = value
+        self.stones += 1
+        # The stone is placed with the key of the player to move, then every
+        # stone changes side, as the other player is to move
+        self.swap_hash ^= SWAP_KEYS[cell]
+        self.mirror_swap_hash ^= MIRROR_SWAP_KEYS[cell]
+        self.zobrist_hash ^= ZOBRIST_KEYS[1][cell] ^ self.swap_hash
+        self.mirror_hash ^= MIRROR_KEYS[1][cell] ^ self.mirror_swap_hash
 
     def get_value(self, column: int, row: int) -> int:
         """Retrieve the current value at the input position"""
         return self.board[(column, row)]
 
+    def check_win(self, column: int, row: int) -> bool:
+        """Checks if the piece at the given location completes four in a row,
+        walking outwards from it in each direction"""
+        # Which player value are we checking
+        value = self.get_value(column, row)
+        # Checked once, so the per-direction debug lines cost nothing when disabled
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            self.logger.debug("value this turn %s", value)
+        # Only have to check diagnals and vertical if this piece placed on fouth row or higher
+        if row >= 3:
+            # check down
+            score = 1
+            rp = row - 1
+            while(rp >= 0):
+                if self.get_value(column, rp) == value:
+                    score = score + 1
+                    rp = rp - 1
+                else:
+                    break
+            if debug:
+                self.logger.debug("down check score: %s", score)
+            if score >= 4:
+                return True
+
+        # Check left diagnal
+        score = 1
+        cp = column - 1
+        rp = row - 1
+        while(rp >= 0 and cp >= 0):
+            if self.get_value(cp, rp) == value:
+                score = score + 1
+                rp = rp - 1
+                cp = cp - 1
+            else:
+                break
+        cp = column + 1
+        rp = row + 1
+        while(rp <= 5 and cp <= 6):
+            if self.get_value(cp, rp) == value:
+                score = score + 1
+                rp = rp + 1
+                cp = cp + 1
+            else:
+                break
+        
+        if debug:
+            self.logger.debug("left diag check score: %s", score)
+        if score >= 4:
+            return True
+
+        # Check right diagnal
+        score = 1
+        cp = column + 1
+        rp = row - 1
+        while(rp >= 0 and cp <= 6):
+            if self.get_value(cp, rp) == value:
+                score = score + 1
+                rp = rp - 1
+                cp = cp + 1
+            else:
+                break
+        cp = column - 1
+        rp = row + 1
+        while(rp <= 5 and cp >= 0):
+            if self.get_value(cp, rp) == value:
+                score = score + 1
+                rp = rp + 1
+                cp = cp - 1
+            else:
+                break
+        if debug:
+            self.logger.debug("right diag check score: %s", score)
+        if score >= 4:
+            return True
+
+        # Always have to check the horizontal condition
+        score = 1
+        # check left
+        cp = column - 1
+        while(cp >= 0):
+            if self.get_value(cp, row) == value:
+                score = score + 1
+                cp = cp - 1
+            else:
+                break
+        # check right
+        cp = column + 1
+        while(cp <= 6):
+            if self.get_value(cp, row) == value:
+                score = score + 1
+                cp = cp + 1
+            else:
+                break
+        if debug:
+            self.logger.debug("horizontal check score: %s", score)
+        if score >= 4:
+            return True
+        return False
+
     def clean(self) -> None:
         """Wipe the board of all values != 0"""
         self.column_tracker = self.new_column_tracker()
         self.board = self.new_board()
+        self.wire_board = new_wire_board()
+        self.clean_hashes()
         self.logger.info("Cleaned board")
 
+    def clean_hashes(self) -> None:
+        """Reset the stone count and hashes to an empty board"""
+        self.stones = 0
+        # Zobrist hashes of the position and of its mirror image, keyed by the
+        # side to move, and the swap keys of the occupied cells. Kept up to date by move
+        self.zobrist_hash = 0
+        self.mirror_hash = 0
+        self.swap_hash = 0
+        self.mirror_swap_hash = 0
+
     def items(self):
         """Wrapper over underlying dictionary method"""
         return self.board.items()
 
+    def wire(self) -> dict[str, int]:
+        """Copy of the board keyed by "column row" strings, as sent to clients"""
+        return dict(self.wire_board)
+
     def new_column_tracker(self) -> dict:
         """Create column tracker used to determine which
         row is currently being played, or determine out of bounds 
@@ -0,0 +1,125 @@
+import mmap
+import os
+import struct
+from typing import Iterator
+
+from server_lib.bitboard import COLUMN_BITS, COLUMNS, BitBoard
+from server_lib.board import Board
+from server_lib.zobrist import MIRROR_KEYS, ZOBRIST_KEYS, canonical
+
+# Identifies an opening book file and the version of its layout
+BOOK_MAGIC = b"C4BOOK01"
+
+# File header: magic, number of records, and the limit on the positions in
+# the file. The most stones of any position in an opening book
+BOOK_HEADER = struct.Struct('<8sIB')
+
+# One record per position, sorted by key: canonical position hash, best column and its score
+BOOK_RECORD = struct.Struct('<QBh')
+
+
+def position_key(position: int, mask: int) -> tuple[int, bool]:
+    """Canonical Zobrist hash of a position given as bitboards of the player to
+    move and of both players, and whether it is the hash of the mirror image.
+    The same key a board keeps incrementally as canonical_hash and mirrored,
+    built from the stones for generators that search bitboards"""
+    position_hash = 0
+    mirror_hash = 0
+    stones = mask
+    while stones:
+        bit = stones & -stones
+        index = bit.bit_length() - 1
+        cell = (index // COLUMN_BITS, index % COLUMN_BITS)
+        value = 1 if position & bit else -1
+        position_hash ^= ZOBRIST_KEYS[value][cell]
+        mirror_hash ^= MIRROR_KEYS[value][cell]
+        stones ^= bit
+    key = canonical(position_hash, mirror_hash)
+    return key, key != position_hash
+
+
+class PositionTable:
+    """Precomputed best moves of positions, read from a file through mmap. The
+    file is a header and records sorted by position key, found by binary
+    search, so opening a table costs nothing and every process that opens the
+    same file shares one copy in the page cache. Positions are stored once for
+    a position and its mirror image. Each kind of table has its own magic."""
+
+    magic = BOOK_MAGIC
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.data) < BOOK_HEADER.size:
+            raise BookFormatError(path)
+        magic, self.count, self.limit = BOOK_HEADER.unpack_from(self.data)
+        if magic != self.magic or len(self.data) != BOOK_HEADER.size + self.count * BOOK_RECORD.size:
+            raise BookFormatError(path)
+
+    def lookup(self, key: int) -> tuple[int, int]|None:
+        """Column and score stored for the position key"""
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            record = BOOK_RECORD.unpack_from(self.data, BOOK_HEADER.size + middle * BOOK_RECORD.size)
+            if record[0] < key:
+                low = middle + 1
+            elif record[0] > key:
+                high = middle
+            else:
+                return record[1], record[2]
+        return None
+
+    def find(self, board: Board|BitBoard) -> tuple[int, int]|None:
+        """Column for the player to move and its score, or None if the position
+        is not in the table. Looked up by the board's incremental hash"""
+        entry = self.lookup(board.canonical_hash)
+        if entry is None:
+            return None
+        if board.mirrored:
+            return COLUMNS - 1 - entry[0], entry[1]
+        return entry
+
+    def entries(self) -> Iterator[tuple[int, int, int]]:
+        """Every (key, column, score) record in key order"""
+        for index in range(self.count):
+            yield BOOK_RECORD.unpack_from(self.data, BOOK_HEADER.size + index * BOOK_RECORD.size)
+
+    def close(self) -> None:
+        """Unmap the book file"""
+        self.data.close()
+
+
+class OpeningBook(PositionTable):
+    """Best moves of the positions a bot can reach in its first plies. The
+    limit of the book is the most stones of its positions"""
+
+    magic = BOOK_MAGIC
+
+    def probe(self, board: Board|BitBoard) -> int|None:
+        """Book column for the player to move, or None if the position is not in the book"""
+        if board.stones > self.limit:
+            return None
+        entry = self.find(board)
+        if entry is None:
+            return None
+        return entry[0]
+
+
+def write_table(path: str, magic: bytes, entries: dict[int, tuple[int, int]], limit: int) -> None:
+    """Write a table file of (column, score) entries by position key. The file
+    is replaced in one step, so servers opening it never see a partial table"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(BOOK_HEADER.pack(magic, len(entries), limit))
+        for key in sorted(entries):
+            column, score = entries[key]
+            f.write(BOOK_RECORD.pack(key, column, score))
+    os.replace(tmp_path, path)
+
+
+class BookFormatError(Exception):
+    """Raised when a file is not a valid opening book or tablebase"""
+    pass
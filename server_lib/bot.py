@@ -0,0 +1,299 @@
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, TypeAlias
+
+from server_lib.bitboard import BitBoard, COLUMN_BITS, COLUMNS, ROWS
+from server_lib.board import Board
+
+# Default search depth in plies. Deep enough to see most tactics while
+# answering in milliseconds
+SEARCH_DEPTH = 6
+
+# Number of entries in the transposition table. Entries share slots by
+# position key modulo the size, and a newer entry replaces an older one
+TABLE_SIZE = 1 << 16
+
+# Score of a won position. Wins are scored higher the fewer stones have been
+# played, so the bot goes for the quickest win and the slowest loss
+WIN_SCORE = 1000
+
+# Columns searched center first, center columns take part in the most lines
+MOVE_ORDER = (3, 2, 4, 1, 5, 0, 6)
+
+# Bottom cell of every column, and every playable cell, in the BitBoard layout
+BOTTOM_MASK = sum(1 << (column * COLUMN_BITS) for column in range(COLUMNS))
+BOARD_MASK = BOTTOM_MASK * ((1 << ROWS) - 1)
+COLUMN_MASKS = tuple(((1 << ROWS) - 1) << (column * COLUMN_BITS) for column in range(COLUMNS))
+
+# Column order to search when a column is known to be best, that column first
+FIRST_ORDERS = tuple((first,) + tuple(c for c in MOVE_ORDER if c != first) for first in range(COLUMNS))
+
+# Positions searched between checks of the search deadline
+DEADLINE_CHECK = 1024
+
+# Transposition table entry bounds
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+
+def winning_cells(position: int, mask: int) -> int:
+    """Empty cells that would complete four in a row for the stones of position"""
+    # Vertical, only three stones below can complete it
+    cells = (position << 1) & (position << 2) & (position << 3)
+    # Horizontal and both diagonals, the empty cell can be at any of the four places
+    for shift in (COLUMN_BITS, COLUMN_BITS - 1, COLUMN_BITS + 1):
+        pair = (position << shift) & (position << (2 * shift))
+        cells |= pair & (position << (3 * shift))
+        cells |= pair & (position >> shift)
+        pair = (position >> shift) & (position >> (2 * shift))
+        cells |= pair & (position << shift)
+        cells |= pair & (position >> (3 * shift))
+    return cells & (BOARD_MASK ^ mask)
+
+
+def position_of(board: Board|BitBoard, value: int) -> tuple[int, int]:
+    """Stones of the player with the given value and of both players, as
+    bitboards in the BitBoard layout"""
+    if isinstance(board, BitBoard):
+        mask = board.player_one | board.player_two
+        return (board.player_one if value == 1 else board.player_two), mask
+    position = 0
+    mask = 0
+    for (column, row), cell in board.items():
+        if cell != 0:
+            bit = 1 << (column * COLUMN_BITS + row)
+            mask |= bit
+            if cell == value:
+                position |= bit
+    return position, mask
+
+
+class Engine:
+    """Connect four search. Negamax with alpha-beta pruning, searched to a fixed
+    depth with iterative deepening. Moves are ordered center first, after the
+    best move found for the position by an earlier search. Positions are kept in
+    a bounded transposition table keyed by the position, shared by every search
+    the engine runs. Positions are the stones of the player to move and the
+    stones of both players."""
+
+    def __init__(self, depth: int = SEARCH_DEPTH, table_size: int = TABLE_SIZE) -> None:
+        self.depth = depth
+        self.table_size = table_size
+        # Entries are (key, depth, bound, score, column)
+        self.table: list[tuple[int, int, int, int, int]|None] = [None] * table_size
+        # Positions visited by the last search
+        self.nodes = 0
+        # Monotonic time the running search must stop by, None for no limit
+        self.deadline: float|None = None
+
+    def best_move(self, position: int, mask: int, deadline: float|None = None) -> int:
+        """Column the player to move should play. The position must not be
+        finished and must have a playable column"""
+        return self.search(position, mask, deadline)[0]
+
+    def search(self, position: int, mask: int, deadline: float|None = None) -> tuple[int, int]:
+        """Best column for the player to move and its score. With a deadline, in
+        time.monotonic() time, the search stops deepening once the deadline
+        has passed and the best column of the deepest finished depth is played.
+        The first depth is always finished"""
+        self.nodes = 0
+        self.deadline = None
+        possible = (mask + BOTTOM_MASK) & BOARD_MASK
+        wins = winning_cells(position, mask) & possible
+        if wins:
+            return next(c for c in MOVE_ORDER if wins & COLUMN_MASKS[c]), WIN_SCORE - mask.bit_count() - 1
+        column = next(c for c in MOVE_ORDER if possible & COLUMN_MASKS[c])
+        result = 0
+        for depth in range(1, self.depth + 1):
+            try:
+                score, best = self.root(position, mask, depth)
+            except SearchTimeout:
+                break
+            if best is not None:
+                column = best
+                result = score
+            # A forced result does not change with more depth
+            if abs(score) >= WIN_SCORE - 42:
+                break
+            if deadline is not None:
+                if time.monotonic() >= deadline:
+                    break
+                self.deadline = deadline
+        return column, result
+
+    def root(self, position: int, mask: int, depth: int) -> tuple[int, int|None]:
+        """Score of the position searched to depth, and the column that reaches it.
+        The player to move has no immediate win"""
+        alpha = -WIN_SCORE
+        best = None
+        possible = (mask + BOTTOM_MASK) & BOARD_MASK
+        key = position + mask
+        entry = self.table[key % self.table_size]
+        order = MOVE_ORDER
+        if entry is not None and entry[0] == key and entry[4] >= 0:
+            order = FIRST_ORDERS[entry[4]]
+        for column in order:
+            move = possible & COLUMN_MASKS[column]
+            if not move:
+                continue
+            score = -self.negamax(position ^ mask, mask | move, depth - 1, -WIN_SCORE, -alpha)
+            if best is None or score > alpha:
+                alpha = score
+                best = column
+        return alpha, best
+
+    def negamax(self, position: int, mask: int, depth: int, alpha: int, beta: int) -> int:
+        """Score of the position for the player to move, exact when it lies
+        between alpha and beta, otherwise a bound on the side it fell. The
+        previous move did not win, every caller checks for an immediate win
+        before searching a move. Below the search depth the score is the
+        difference in the number of cells each player could win at"""
+        self.nodes += 1
+        if self.deadline is not None and self.nodes % DEADLINE_CHECK == 0 and time.monotonic() >= self.deadline:
+            raise SearchTimeout
+        moves = mask.bit_count()
+        possible = (mask + BOTTOM_MASK) & BOARD_MASK
+        own = winning_cells(position, mask)
+        # Win on this move
+        if own & possible:
+            return WIN_SCORE - moves - 1
+        # The last cell is played without winning
+        if moves >= 41:
+            return 0
+        opponent = position ^ mask
+        threats = winning_cells(opponent, mask)
+        forced = threats & possible
+        if forced:
+            # Two immediate threats cannot both be blocked
+            if forced & (forced - 1):
+                return -(WIN_SCORE - moves - 2)
+            possible = forced
+        if depth == 0:
+            return own.bit_count() - threats.bit_count()
+
+        key = position + mask
+        slot = key % self.table_size
+        entry = self.table[slot]
+        order = MOVE_ORDER
+        if entry is not None and entry[0] == key:
+            if entry[4] >= 0:
+                order = FIRST_ORDERS[entry[4]]
+            if entry[1] >= depth:
+                score = entry[3]
+                if entry[2] == EXACT:
+                    return score
+                if entry[2] == LOWER:
+                    alpha = max(alpha, score)
+                else:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    return score
+
+        original_alpha = alpha
+        best_score = -WIN_SCORE
+        best_column = -1
+        for column in order:
+            move = possible & COLUMN_MASKS[column]
+            if not move:
+                continue
+            score = -self.negamax(opponent, mask | move, depth - 1, -beta, -alpha)
+            if score > best_score:
+                best_score = score
+                best_column = column
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+        if best_score <= original_alpha:
+            bound = UPPER
+        elif best_score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.table[slot] = (key, depth, bound, best_score, best_column)
+        return best_score
+
+
+class Bot:
+    """A player run by the server. A bot is seated in a room in place of a
+    client's socket and has a user like any other player, so the game cannot
+    tell it apart from a remote client. Its moves are searched by the server's
+    engine or search pool."""
+
+    Address: TypeAlias = tuple[str, int]
+
+    def __init__(self, addr: Address, name: str = "Bot") -> None:
+        self.addr = addr
+        self.name = name
+
+
+# Engine of a search worker process, created when the worker starts
+worker_engine: Engine|None = None
+
+
+def start_worker(depth: int) -> None:
+    """Create the engine of a search worker process. Its transposition table
+    is kept for every search the worker runs"""
+    global worker_engine
+    worker_engine = Engine(depth)
+
+
+def search(position: int, mask: int, deadline: float|None) -> int:
+    """Column chosen by the worker's engine. Run in a search worker process"""
+    if worker_engine is None:
+        start_worker(SEARCH_DEPTH)
+    return worker_engine.best_move(position, mask, deadline)
+
+
+class BotPool:
+    """Pool of worker processes that run bot searches, so a search never blocks
+    the server's event loop and many bot games search on all cores at once.
+    Finished searches are queued by the pool's result thread, which calls wakeup
+    to tell the event loop to collect them with completed. The workers are
+    started with the first search."""
+
+    def __init__(self, workers: int, depth: int = SEARCH_DEPTH, wakeup: Callable[[], None]|None = None) -> None:
+        self.workers = workers
+        self.depth = depth
+        self.wakeup = wakeup
+        self.executor: ProcessPoolExecutor|None = None
+        # Searches that are done, were cancelled or failed, in the order they finished
+        self.done: deque[Future] = deque()
+
+    def submit(self, position: int, mask: int, deadline: float|None) -> Future:
+        """Start searching the position. The future's result is the chosen column"""
+        if self.executor is None:
+            # Spawned workers do not inherit the server's sockets
+            self.executor = ProcessPoolExecutor(self.workers, multiprocessing.get_context("spawn"),
+                                                start_worker, (self.depth,))
+        future = self.executor.submit(search, position, mask, deadline)
+        future.add_done_callback(self.finished)
+        return future
+
+    def finished(self, future: Future) -> None:
+        """Queue a finished search. Called by the pool's result thread, or by
+        the event loop when the search is cancelled"""
+        self.done.append(future)
+        if self.wakeup is not None:
+            self.wakeup()
+
+    def completed(self) -> list[Future]:
+        """Take the searches that finished since the last call"""
+        futures = []
+        while self.done:
+            futures.append(self.done.popleft())
+        return futures
+
+    def shutdown(self) -> None:
+        """Stop the workers without waiting for running searches"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+class SearchTimeout(Exception):
+    """Raised inside a search when its deadline has passed"""
+    pass
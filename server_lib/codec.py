@@ -0,0 +1,46 @@
+import json
+from typing import Any, Callable
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Codec:
+    """Encodes message payloads to bytes and decodes them back. The codec
+    used by a connection is negotiated by the client's connect message."""
+
+    def __init__(self, name: str, dumps: Callable[[Any], bytes], loads: Callable[[bytes|bytearray|memoryview], Any]) -> None:
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+
+def json_dumps(msg: Any) -> bytes:
+    """Encode a message as utf-8 json"""
+    return json.dumps(msg).encode("utf-8")
+
+
+def json_loads(data: bytes|bytearray|memoryview) -> Any:
+    """Decode a utf-8 json message. Views of a receive buffer are decoded
+    without first copying them to bytes"""
+    return json.loads(str(data, "utf-8"))
+
+
+JSON = Codec("json", json_dumps, json_loads)
+
+# Codecs available on this server, by name. JSON is always available
+CODECS: dict[str, Codec] = {JSON.name: JSON}
+if msgpack is not None:
+    CODECS["msgpack"] = Codec("msgpack", msgpack.packb, msgpack.unpackb)
+
+
+def negotiate(requested: Any) -> Codec:
+    """Pick the first codec in the client's preference list that is available.
+    Falls back to JSON, which every client understands"""
+    if isinstance(requested, list):
+        for name in requested:
+            if isinstance(name, str) and name in CODECS:
+                return CODECS[name]
+    return JSON
@@ -0,0 +1,227 @@
+import struct
+import time
+from collections import deque
+from itertools import islice
+from socket import socket
+from typing import Callable, TypeAlias
+
+from server_lib.codec import JSON
+
+# Frames larger than this are rejected unless the server is configured otherwise
+DEFAULT_MAX_FRAME_SIZE = 64 * 1024
+
+# Outbound queue sizes in bytes. Reading from a client pauses above the high-water
+# mark and resumes at the low-water mark. A client that lets its queue grow past
+# the limit is not reading at all, and is disconnected.
+SEND_HIGH_WATER = 256 * 1024
+SEND_LOW_WATER = 64 * 1024
+SEND_LIMIT = 4 * 1024 * 1024
+
+# Most buffers handed to a single sendmsg call, a frame is a header and a body buffer
+SEND_BATCH = 128
+
+# Initial size of each connection's receive buffer. It only grows for frames larger than it
+RECV_BUFFER = 8 * 1024
+
+# Length prefix of every frame
+HEADER = struct.Struct('<i')
+
+
+class Connection:
+    """A single client connection to the server. Bytes read from the socket
+    are collected in a receive buffer, and complete length-prefixed frames are
+    parsed from it incrementally, so a partial frame never blocks the server.
+    The receive buffer is allocated once and read into directly, and frames are
+    handed out as views of it, so a received frame is never copied before it
+    is decoded.
+
+    Outbound frames are queued and written as the socket accepts them. The
+    on_change callback is called whenever the queue becomes empty or non-empty,
+    crosses a water mark or fails, so the owner can update its selector interest.
+
+    When the owner passes a deferred set, frames are not written as they are
+    sent. The connection adds itself to the set instead, and the owner flushes
+    every connection in it once it has handled a whole batch of events, so all
+    the frames a connection is sent in one batch go out in a single write."""
+
+    Address: TypeAlias = tuple[str, int]
+
+    def __init__(self, sock: socket, addr: Address, max_frame_size: int = DEFAULT_MAX_FRAME_SIZE,
+                 on_change: Callable[["Connection"], None]|None = None, deferred: set["Connection"]|None = None) -> None:
+        self.sock = sock
+        self.addr = addr
+        self.max_frame_size = max_frame_size
+        self.on_change = on_change
+        self.deferred = deferred
+        # Codec used to encode and decode frames, negotiated on connect
+        self.codec = JSON
+        # Receive buffer. Bytes from rstart to rend have been received but not parsed
+        self.rbuf = bytearray(RECV_BUFFER)
+        self.rview = memoryview(self.rbuf)
+        self.rstart = 0
+        self.rend = 0
+        # Outbound queue, offset is the number of bytes already sent from the first buffer
+        self.wbuf: deque[bytes] = deque()
+        self.wbuf_size = 0
+        self.woffset = 0
+        # Reading is paused by backpressure
+        self.paused = False
+        # The connection can no longer be written to and must be closed
+        self.failed = False
+        # Close the connection once the queue has been sent
+        self.closing = False
+        # Monotonic time of the last frame received, used by the idle timeout
+        self.last_seen = time.monotonic()
+        # Outstanding heartbeat ping, and the last round trip time measured in seconds
+        self.ping_nonce = 0
+        self.ping_sent = 0.0
+        self.rtt: float|None = None
+
+    def send(self, header: bytes, body: bytes) -> None:
+        """Queue a frame to be sent. The header and body are queued as they are,
+        and written together with scatter-gather I/O. If nothing else is queued
+        the frame is written immediately, or at the end of the batch when writes
+        are deferred. Whatever the socket does not accept is kept until it is
+        writable again"""
+        if self.failed:
+            return
+        was_empty = not self.wbuf
+        self.wbuf.append(header)
+        self.wbuf.append(body)
+        self.wbuf_size += len(header) + len(body)
+        if was_empty:
+            if self.deferred is not None:
+                self.deferred.add(self)
+            else:
+                self.flush()
+        elif self.wbuf_size > SEND_LIMIT:
+            self.failed = True
+            self.notify()
+        elif self.wbuf_size > SEND_HIGH_WATER and not self.paused:
+            self.paused = True
+            self.notify()
+
+    def flush(self) -> None:
+        """Write queued bytes until the queue is empty or the socket
+        would block. Queued frames are gathered into one sendmsg call"""
+        had_data = bool(self.wbuf)
+        while self.wbuf:
+            view = memoryview(self.wbuf[0])[self.woffset:]
+            try:
+                if len(self.wbuf) == 1:
+                    sent = self.sock.send(view)
+                else:
+                    sent = self.sock.sendmsg([view, *islice(self.wbuf, 1, SEND_BATCH)])
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                self.failed = True
+                break
+            self.wbuf_size -= sent
+            # Drop the buffers that were written in full
+            sent += self.woffset
+            while self.wbuf and sent >= len(self.wbuf[0]):
+                sent -= len(self.wbuf.popleft())
+            self.woffset = sent
+            if self.wbuf and sent:
+                break
+        if self.closing and not self.wbuf:
+            self.failed = True
+        if self.paused and self.wbuf_size <= SEND_LOW_WATER:
+            self.paused = False
+        if self.wbuf_size > SEND_HIGH_WATER:
+            self.paused = True
+        if self.wbuf or had_data or self.failed:
+            self.notify()
+
+    def finish(self) -> None:
+        """Close the connection once everything queued has been sent"""
+        self.closing = True
+        self.flush()
+
+    def abort(self) -> None:
+        """Close the connection without sending what is still queued"""
+        self.closing = True
+        self.failed = True
+        self.wbuf.clear()
+        self.wbuf_size = 0
+        self.woffset = 0
+        self.notify()
+
+    def wants_write(self) -> bool:
+        """Is there queued data waiting for the socket to become writable"""
+        return bool(self.wbuf)
+
+    def notify(self) -> None:
+        """Report a change in the queue or connection state to the owner"""
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def read_buffer(self, size: int = 0) -> memoryview:
+        """Writable view of the free space at the end of the receive buffer, to
+        read into with recv_into. Unparsed bytes are first moved to the front,
+        and the buffer is replaced by a larger one when it cannot hold size more
+        bytes or the whole frame being received. Views of frames returned by
+        earlier reads are invalid once this is called"""
+        pending = self.rend - self.rstart
+        if self.rstart:
+            self.rview[:pending] = self.rview[self.rstart:self.rend]
+            self.rstart = 0
+            self.rend = pending
+        needed = pending + max(size, 1)
+        if pending >= 4:
+            needed = max(needed, 4 + HEADER.unpack_from(self.rbuf)[0])
+        if needed > len(self.rbuf):
+            rbuf = bytearray(max(needed, 2 * len(self.rbuf)))
+            rbuf[:pending] = self.rview[:pending]
+            self.rbuf = rbuf
+            self.rview = memoryview(rbuf)
+        return self.rview[self.rend:]
+
+    def received(self, size: int) -> list[memoryview]:
+        """Account for size bytes read into the read buffer and return a view of
+        the payload of every complete frame. Bytes of an incomplete frame stay
+        buffered until the rest arrives. Raises FrameSizeError on an invalid
+        length prefix"""
+        self.rend += size
+        frames = []
+        start = self.rstart
+        end = self.rend
+        while end - start >= 4:
+            msg_len = HEADER.unpack_from(self.rbuf, start)[0]
+            if msg_len < 0 or msg_len > self.max_frame_size:
+                raise FrameSizeError(msg_len)
+            stop = start + 4 + msg_len
+            if stop > end:
+                break
+            frames.append(self.rview[start + 4:stop])
+            start = stop
+        if start == end:
+            start = end = 0
+        self.rstart = start
+        self.rend = end
+        return frames
+
+    def feed(self, data: bytes) -> list[memoryview]:
+        """Add bytes received by other means to the receive buffer and return
+        the payload of every complete frame, as received does"""
+        self.read_buffer(len(data))[:len(data)] = data
+        return self.received(len(data))
+
+    def decode(self, frame: bytes|memoryview) -> dict|None:
+        """Decode a frame payload with the connection's codec. Returns None
+        if the payload is not a valid message. Payloads nested too deeply for
+        the decoder are invalid too, not an error of the server"""
+        try:
+            msg = self.codec.loads(frame)
+        except (ValueError, RecursionError):
+            return None
+        if not isinstance(msg, dict):
+            return None
+        return msg
+
+
+class FrameSizeError(Exception):
+    """Raised when a frame's length prefix is negative or larger
+    than the maximum frame size"""
+    pass
@@ -21,6 +21,10 @@ class Game:
         self.first_player = None
         # Player who won the game
         self.winner = None
+        # Sequence number of the last accepted move, used by clients to detect missed updates
+        self.seq = 0
+        # Last accepted move as (column, row, value)
+        self.last_move = None
 
     def get_turn_count(self) -> int:
         return self.turn_count
@@ -41,6 +45,8 @@ class Game:
         self.board.clean()
         self.turn_count = 1
         self.winner = None
+        self.seq = 0
+        self.last_move = None
         self.users.clean_connected()
         self.logger.info("State change: waiting")
 
@@ -50,7 +56,7 @@ class Game:
             self.logger.info("State change: pregame")
             self.state = "pregame"
         else:
-            self.logger.error(f"Invalid state change to pregame curr state: {self.state}, number of users: {self.users.num_players()}")
+            self.logger.error("Invalid state change to pregame curr state: %s, number of users: %s", self.state, self.users.num_players())
             raise InvalidStateTransferError
             
     def setRun(self) -> None:
@@ -61,13 +67,13 @@ class Game:
             self.state = "run"
             try:
                 self.first_player = self.users.first_user()
-                self.logger.debug(f"First player set as {self.first_player.host}, {self.first_player.port}")
+                self.logger.debug("First player set as %s, %s", self.first_player.host, self.first_player.port)
                 self.whos_move = self.first_player
             except NotEnoughUsersError:
-                self.logger.error(f"Invalid state change to run")
+                self.logger.error("Invalid state change to run")
                 raise InvalidStateTransferError
         else:
-            self.logger.error(f"Invalid state change to run curr state: {self.state}")
+            self.logger.error("Invalid state change to run curr state: %s", self.state)
             raise InvalidStateTransferError
 
     def setFinished(self, winner: User|None) -> None:
@@ -77,7 +83,7 @@ class Game:
             self.state = "finished"
             self.winner = winner
         else:
-            self.logger.error(f"Invalid state change to finished curr state: {self.state}")
+            self.logger.error("Invalid state change to finished curr state: %s", self.state)
 
     def isFinished(self) -> bool:
         """Get if the game is in the finished state"""
@@ -86,96 +92,9 @@ class Game:
         return False
 
     def check_win_condition(self, column: int, row: int) -> bool:
-        """Checks the last play to see if the game was won on this turn"""
-        # Which player value are we checking
-        value = self.board.get_value(column, row)
-        self.logger.debug(f"value this turn {value}")
-        # Only have to check diagnals and vertical if this piece placed on fouth row or higher
-        if row >= 3:
-            # check down
-            score = 1
-            rp = row - 1
-            while(rp >= 0):
-                if self.board.get_value(column, rp) == value:
-                    score = score + 1
-                    rp = rp - 1
-                else:
-                    break
-            self.logger.debug(f"down check score: {score}")
-            if score == 4:
-                return True
-
-        # Check left diagnal
-        score = 1
-        cp = column - 1
-        rp = row - 1
-        while(rp >= 0 and cp >= 0):
-            if self.board.get_value(cp, rp) == value:
-                score = score + 1
-                rp = rp - 1
-                cp = cp - 1
-            else:
-                break
-        cp = column + 1
-        rp = row + 1
-        while(rp <= 5 and cp <= 6):
-            if self.board.get_value(cp, rp) == value:
-                score = score + 1
-                rp = rp + 1
-                cp = cp + 1
-            else:
-                break
-        
-        self.logger.debug(f"left diag check score: {score}")
-        if score == 4:
-            return True
-
-        # Check right diagnal
-        score = 1
-        cp = column + 1
-        rp = row - 1
-        while(rp >= 0 and cp <= 6):
-            if self.board.get_value(cp, rp) == value:
-                score = score + 1
-                rp = rp - 1
-                cp = cp + 1
-            else:
-                break
-        cp = column - 1
-        rp = row + 1
-        while(rp <= 5 and cp >= 0):
-            if self.board.get_value(cp, rp) == value:
-                score = score + 1
-                rp = rp + 1
-                cp = cp - 1
-            else:
-                break
-        self.logger.debug(f"right diag check score: {score}")
-        if score == 4:
-            return True
-
-        # Always have to check the horizontal condition
-        score = 1
-        # check left
-        cp = column - 1
-        while(cp >= 0):
-            if self.board.get_value(cp, row) == value:
-                score = score + 1
-                cp = cp - 1
-            else:
-                break
-        # check right
-        cp = column + 1
-        while(cp <= 6):
-            if self.board.get_value(cp, row) == value:
-                score = score + 1
-                cp = cp + 1
-            else:
-                break
-        self.logger.debug(f"horizontal check score: {score}")
-        if score == 4:
-            return True
-        return False
+        """Checks the last play to see if the game was won on this turn.
+        The check is done by the board engine in use"""
+        return self.board.check_win(column, row)
 
     def move(self, addr: Address, column: int, turn_count: int) -> None:
         """Makes a move at the given column. Raises exceptions on error conditions related 
@@ -184,7 +103,7 @@ class Game:
         try: 
             user = self.users.get_user(addr)
             if self.whos_move is not None:
-                self.logger.debug(f"Who's move: {self.whos_move.host}, {self.whos_move.port}")
+                self.logger.debug("Who's move: %s, %s", self.whos_move.host, self.whos_move.port)
         except UserNotFoundError:
             raise UserNotFoundError
         if user != self.whos_move:
@@ -193,11 +112,11 @@ class Game:
             raise InvalidOrderError
         if turn_count != self.turn_count:
             # This move uses an invalid game state
-            self.logger.error(f"Invalid game state used, got {turn_count}, expected {self.turn_count}")
+            self.logger.error("Invalid game state used, got %s, expected %s", turn_count, self.turn_count)
             raise OutOfDateError
         if column > 6 or column < 0:
             # Outside of board range
-            self.logger.error(f"Invalid column: {column}")
+            self.logger.error("Invalid column: %s", column)
             raise InvalidColumnError
         row = self.board.next_row_in_column(column)
         if row is None:
@@ -205,6 +124,8 @@ class Game:
             self.logger.error("Invalid row")
             raise InvalidRowError
         self.board.move(column, row, user.value)
+        self.seq += 1
+        self.last_move = (column, row, user.value)
         # Check if game won
         self.game_won = self.check_win_condition(column, row)
         if self.game_won:
@@ -218,7 +139,7 @@ class Game:
         else:
             self.turn_count += 1
             self.whos_move = self.users.next_turn(user)
-            self.logger.info(f"expecting host: {self.whos_move.host}, port: {self.whos_move.port} to play next")
+            self.logger.debug("expecting host: %s, port: %s to play next", self.whos_move.host, self.whos_move.port)
 
 
 class InvalidStateTransferError(Exception):
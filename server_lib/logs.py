@@ -0,0 +1,102 @@
+import atexit
+import logging
+import os
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# Records with the same message template and level allowed per RATE_INTERVAL seconds.
+# Records beyond that are dropped and counted.
+RATE_BURST = 20
+RATE_INTERVAL = 10.0
+
+# Listener writing queued records, and the process it was started in
+_listener: QueueListener|None = None
+_listener_pid = 0
+
+
+class RateLimitFilter(logging.Filter):
+    """Limits how often records with the same message template and level are
+    logged. Up to burst records pass per interval, later ones are dropped until
+    the interval ends. The first record to pass afterwards reports how many
+    were dropped. Critical records and records carrying an exception always pass.
+    Templates are only stable for %-style messages, which is one more reason to
+    log with arguments instead of f-strings."""
+
+    def __init__(self, burst: int = RATE_BURST, interval: float = RATE_INTERVAL) -> None:
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        # (template, level) => [interval start, records passed, records dropped]
+        self.windows: dict[tuple[str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.CRITICAL or record.exc_info:
+            return True
+        key = (str(record.msg), record.levelno)
+        now = time.monotonic()
+        window = self.windows.get(key)
+        if window is None or now - window[0] >= self.interval:
+            dropped = window[2] if window is not None else 0
+            if len(self.windows) > 10000:
+                self.windows.clear()
+            self.windows[key] = [now, 1, 0]
+            if dropped and isinstance(record.args, tuple):
+                record.msg = f"{record.msg} (%d similar messages suppressed)"
+                record.args = record.args + (dropped,)
+            return True
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Queue handler that leaves all formatting to the listener thread. The
+    stock handler interpolates the message and formats the record, exception
+    included, before queueing it. Here the record is queued as it is, with its
+    arguments, and the listener's handler formats it. The queue never leaves
+    the process, so nothing has to be made picklable."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def server_logger(log_level) -> logging.Logger:
+    """Configure the server logger at the given level. Records are put on a
+    queue by the event loop, and formatted and written to stdout by a background
+    listener thread, so slow terminals or pipes never stall the server. Repeated
+    records are rate limited. Forked worker processes call this again to start
+    their own listener, as threads do not survive a fork."""
+    global _listener, _listener_pid
+    logger = logging.getLogger('CONNECT-FOUR SERVER')
+    logger.setLevel(log_level)
+    if _listener is not None and _listener_pid == os.getpid():
+        return logger
+    # Drop the queue handler inherited from the parent process, its listener is not running here
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    ch = logging.StreamHandler()
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    qh = DeferredQueueHandler(records)
+    qh.addFilter(RateLimitFilter())
+    logger.addHandler(qh)
+    _listener = QueueListener(records, ch)
+    _listener.start()
+    _listener_pid = os.getpid()
+    return logger
+
+
+def stop_logging() -> None:
+    """Write out every queued record and stop the listener thread. Called at
+    exit, and by worker processes before they exit"""
+    global _listener
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
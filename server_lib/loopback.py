@@ -0,0 +1,211 @@
+import struct
+from typing import Callable, TypeAlias
+
+from server_lib.action import Action
+from server_lib.bitboard import BitBoard
+from server_lib.board import Board
+from server_lib.bot import SEARCH_DEPTH
+from server_lib.connection import DEFAULT_MAX_FRAME_SIZE, Connection, FrameSizeError
+from server_lib.logs import server_logger
+from server_lib.message_handler import MessageHandler
+
+
+class LoopbackConnection(Connection):
+    """Server side of an in-memory connection. Frames sent to the client are
+    appended straight to the client endpoint's receive buffer"""
+
+    Address: TypeAlias = tuple[str, int]
+
+    def __init__(self, endpoint: "LoopbackEndpoint", addr: Address, max_frame_size: int = DEFAULT_MAX_FRAME_SIZE,
+                 on_change: Callable[[Connection], None]|None = None) -> None:
+        super().__init__(None, addr, max_frame_size, on_change)
+        self.endpoint = endpoint
+
+    def send(self, header: bytes, body: bytes) -> None:
+        """Deliver a frame to the client endpoint"""
+        if self.failed or self.endpoint.closed:
+            return
+        self.endpoint.rbuf += header
+        self.endpoint.rbuf += body
+
+    def flush(self) -> None:
+        """Frames are delivered as they are sent"""
+        pass
+
+    def finish(self) -> None:
+        """Close the connection. Everything sent has already been delivered,
+        the server closes it once the current frames are handled"""
+        self.closing = True
+        self.notify()
+
+    def wants_write(self) -> bool:
+        """Nothing is ever left waiting to be written"""
+        return False
+
+
+class LoopbackEndpoint:
+    """Client side of an in-memory connection. Offers the parts of the socket
+    interface used by the client, so client code and simulated players can talk
+    to a LoopbackServer without any kernel round-trips. Like a non-blocking
+    socket, recv raises BlockingIOError when nothing has been received"""
+
+    Address: TypeAlias = tuple[str, int]
+
+    def __init__(self, server: "LoopbackServer", addr: Address) -> None:
+        self.server = server
+        self.addr = addr
+        self.rbuf = bytearray()
+        self.closed = False
+
+    def sendall(self, data: bytes) -> None:
+        """Deliver bytes to the server, which handles every complete frame
+        before returning"""
+        if self.closed:
+            raise BrokenPipeError("Loopback connection is closed")
+        self.server.deliver(self, data)
+
+    def send(self, data: bytes) -> int:
+        """Same as sendall, the whole buffer is always accepted"""
+        self.sendall(data)
+        return len(data)
+
+    def recv(self, bufsize: int) -> bytes:
+        """Take up to bufsize received bytes. Returns b"" once the connection
+        is closed and everything received has been read"""
+        if not self.rbuf:
+            if self.closed:
+                return b""
+            raise BlockingIOError("No data received")
+        data = bytes(self.rbuf[:bufsize])
+        del self.rbuf[:bufsize]
+        return data
+
+    def frames(self) -> list[bytes]:
+        """Take the payload of every complete frame received so far"""
+        frames = []
+        offset = 0
+        buffered = len(self.rbuf)
+        while buffered - offset >= 4:
+            msg_len = struct.unpack_from('<i', self.rbuf, offset)[0]
+            end = offset + 4 + msg_len
+            if end > buffered:
+                break
+            frames.append(bytes(self.rbuf[offset + 4:end]))
+            offset = end
+        if offset:
+            del self.rbuf[:offset]
+        return frames
+
+    def getsockname(self) -> Address:
+        """The address the server knows this client by"""
+        return self.addr
+
+    def close(self) -> None:
+        """Close the connection, the server removes the player"""
+        if not self.closed:
+            self.closed = True
+            self.server.closed_connection(self)
+
+
+class LoopbackServer:
+    """Server engine without sockets. Hosts the same MessageHandler, rooms, games
+    and actions as the network engines, while clients connect through in-memory
+    endpoints. Everything runs synchronously in the calling thread, which makes
+    it suitable for simulation, fuzzing and benchmarking full games."""
+
+    def __init__(self, log_level, max_rooms: int|None = None, board_class: type[Board]|type[BitBoard] = BitBoard,
+                 max_frame_size: int = DEFAULT_MAX_FRAME_SIZE, bot_wait: float|None = None, bot_depth: int = SEARCH_DEPTH,
+                 bot_book: str|None = None, tablebase: str|None = None) -> None:
+        """Options are the same as the network servers, without a port"""
+        # Logging
+        self.logger = server_logger(log_level)
+
+        self.max_frame_size = max_frame_size
+        self.next_port = 1
+
+        # Client map
+        self.connected_clients: dict[LoopbackEndpoint, LoopbackConnection] = {}
+        # Connections finished by the handler, closed once it returns
+        self.finished_clients: list[LoopbackEndpoint] = []
+        self.closing_finished = False
+
+        # Sending actions and receiving handler
+        self.action = Action(self.logger)
+        self.handler = MessageHandler(self.logger, self.action, self.connected_clients, max_rooms, board_class, bot_wait, bot_depth, 0, bot_book,
+                                      tablebase)
+
+    def connect(self) -> LoopbackEndpoint:
+        """Open a new client connection. Each client gets a unique address.
+        The client is seated once it has sent its connect message"""
+        addr = ("loopback", self.next_port)
+        self.next_port += 1
+        endpoint = LoopbackEndpoint(self, addr)
+        self.connected_clients[endpoint] = LoopbackConnection(endpoint, addr, self.max_frame_size, self.finished)
+        self.handler.metrics.connections_accepted.inc()
+        self.logger.info('Accepted client connection from host: %s, port: %s', addr[0], addr[1])
+        self.handler.new_connection(endpoint)
+        return endpoint
+
+    def advance(self, now: float|None = None) -> None:
+        """Fire the handler's timers that are due by now, the current time by
+        default. The loopback server has no event loop, so its heartbeats and
+        timeouts only fire when the caller advances them"""
+        self.handler.timers.advance(now)
+        self.close_finished()
+
+    def deliver(self, endpoint: LoopbackEndpoint, data: bytes) -> None:
+        """Bytes sent by a client. Every complete frame is handled in order"""
+        conn = self.connected_clients.get(endpoint)
+        if conn is None:
+            return
+        self.handler.metrics.bytes_received.inc(len(data))
+        try:
+            frames = conn.feed(data)
+        except FrameSizeError as e:
+            self.logger.warning('Invalid frame length %s from client at %s. Closing connection', e.args[0], conn.addr)
+            endpoint.close()
+            return
+        self.handler.metrics.frames_received.inc(len(frames))
+        for frame in frames:
+            # A message that fails to decode or to be handled is dropped, the
+            # other clients keep being served
+            try:
+                msg = conn.decode(frame)
+                if msg is None:
+                    self.logger.warning('Malformed message from client at %s. Dropped', conn.addr)
+                    continue
+                self.logger.debug('Received %s from client at %s', msg, conn.addr)
+                self.handler.handle_message(msg, endpoint)
+            except Exception:
+                self.logger.exception('Failed to handle message from client at %s. Dropped', conn.addr)
+        self.close_finished()
+
+    def finished(self, conn: Connection) -> None:
+        """Called by a connection the handler has finished"""
+        if conn.closing and isinstance(conn, LoopbackConnection):
+            self.finished_clients.append(conn.endpoint)
+
+    def close_finished(self) -> None:
+        """Close the connections finished while handling messages. Closing a
+        connection can finish others, they are closed by the same loop"""
+        if self.closing_finished:
+            return
+        self.closing_finished = True
+        while self.finished_clients:
+            self.finished_clients.pop().close()
+        self.closing_finished = False
+
+    def closed_connection(self, endpoint: LoopbackEndpoint) -> None:
+        """The client's connection is gone, remove it from the server"""
+        endpoint.closed = True
+        conn = self.connected_clients.pop(endpoint, None)
+        if conn is None:
+            return
+        self.logger.info('Client at %s closed connection', conn.addr)
+        self.handler.remove_player(endpoint, conn.addr)
+        self.close_finished()
+
+    def shutdown(self) -> None:
+        """Close every client connection"""
+        for endpoint in list(self.connected_clients):
+            endpoint.close()
@@ -0,0 +1,93 @@
+import time
+from collections import deque
+from socket import socket
+from typing import TypeAlias
+
+
+class QueuedPlayer:
+    """A named player waiting to be paired into a game"""
+
+    Address: TypeAlias = tuple[str, int]
+
+    def __init__(self, sock: socket, addr: Address, name: str) -> None:
+        self.sock = sock
+        self.addr = addr
+        self.name = name
+        self.queued_at = time.monotonic()
+        # Cleared when the player leaves the queue before being paired
+        self.waiting = True
+
+    def wait_time(self) -> float:
+        """Seconds spent in the queue so far"""
+        return time.monotonic() - self.queued_at
+
+
+class Matchmaker:
+    """First-in first-out queue of named players waiting for an opponent.
+    Players are paired in the order they joined. Leaving the queue only marks
+    the entry, which is skipped when it reaches the front, so joining, leaving
+    and pairing are all O(1)."""
+
+    def __init__(self) -> None:
+        self.queue: deque[QueuedPlayer] = deque()
+        # Players still waiting, by socket
+        self.players: dict[socket, QueuedPlayer] = {}
+
+    def depth(self) -> int:
+        """Number of players waiting"""
+        return len(self.players)
+
+    def is_queued(self, sock: socket) -> bool:
+        """Is the socket waiting in the queue"""
+        return sock in self.players
+
+    def oldest_wait(self) -> float:
+        """Seconds the longest waiting player has been in the queue"""
+        self.skip_left()
+        if not self.queue:
+            return 0.0
+        return self.queue[0].wait_time()
+
+    def enqueue(self, sock: socket, addr: QueuedPlayer.Address, name: str, front: bool = False) -> QueuedPlayer:
+        """Add a named player to the back of the queue, or to the front for a
+        player whose opponent left mid game"""
+        player = QueuedPlayer(sock, addr, name)
+        if front:
+            self.queue.appendleft(player)
+        else:
+            self.queue.append(player)
+        self.players[sock] = player
+        return player
+
+    def remove(self, sock: socket) -> QueuedPlayer|None:
+        """Take the socket's player out of the queue"""
+        player = self.players.pop(sock, None)
+        if player is not None:
+            player.waiting = False
+        return player
+
+    def pop_pair(self) -> tuple[QueuedPlayer, QueuedPlayer]|None:
+        """The two longest waiting players, or None while fewer than two wait"""
+        if len(self.players) < 2:
+            return None
+        self.skip_left()
+        first = self.queue.popleft()
+        self.skip_left()
+        second = self.queue.popleft()
+        del self.players[first.sock]
+        del self.players[second.sock]
+        return first, second
+
+    def pop_oldest(self) -> QueuedPlayer|None:
+        """The longest waiting player, or None if no one is waiting"""
+        if not self.players:
+            return None
+        self.skip_left()
+        player = self.queue.popleft()
+        del self.players[player.sock]
+        return player
+
+    def skip_left(self) -> None:
+        """Drop players that left the queue from its front"""
+        while self.queue and not self.queue[0].waiting:
+            self.queue.popleft()
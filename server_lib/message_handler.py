@@ -1,12 +1,42 @@
+from concurrent.futures import Future
 from logging import Logger
+import time
 from typing import TypeAlias
-from selectors import DefaultSelector
 from socket import socket
-from server_lib.action import Action
+from server_lib.action import Action, Frame
+from server_lib.codec import negotiate
 from server_lib.users import *
 from server_lib.users import User
-from server_lib.board import Board
 from server_lib.game import *
+from server_lib.bitboard import BitBoard
+from server_lib.board import Board
+from server_lib.book import OpeningBook
+from server_lib.bot import SEARCH_DEPTH, Bot, BotPool, Engine, position_of
+from server_lib.connection import Connection
+from server_lib.matchmaking import Matchmaker
+from server_lib.metrics import ACTIONS, Metrics
+from server_lib.room import SESSION_GRACE, Room, Rooms
+from server_lib.tablebase import Tablebase, outcome
+from server_lib.timers import Timer, TimerWheel
+
+# Seconds between heartbeat pings to each client
+PING_INTERVAL = 10.0
+
+# Connections that send nothing, not even a pong, for this many seconds are closed
+IDLE_TIMEOUT = 30.0
+
+# Seconds a player has to make their move before forfeiting the game
+TURN_TIMEOUT = 60.0
+
+# Seconds a bot searches for its move
+BOT_MOVE_TIME = 1.0
+
+# Seconds past its deadline before a search that has not returned, because every
+# search worker is busy, is cancelled and replaced by a quick search
+BOT_GRACE = 1.0
+
+# Seconds the quick search of a bot whose search missed its deadline may take
+QUICK_SEARCH_TIME = 0.05
 
 class MessageHandler:
     """Parses received messages, performs actions on game,
@@ -14,142 +44,642 @@ class MessageHandler:
 
     Address: TypeAlias = tuple[str, int]
 
-    def __init__(self, logger: Logger, action: Action, write_sel: DefaultSelector, clients: dict[socket, Address]) -> None:
+    def __init__(self, logger: Logger, action: Action, clients: dict[socket, Connection], max_rooms: int|None = None, board_class: type[Board]|type[BitBoard] = BitBoard,
+                 bot_wait: float|None = None, bot_depth: int = SEARCH_DEPTH, bot_workers: int = 0, bot_book: str|None = None,
+                 tablebase: str|None = None) -> None:
         self.logger = logger
-        self.board = Board(self.logger)
-        self.users = Users(self.logger)
-        self.game = Game(self.logger, self.board, self.users)
+        self.rooms = Rooms(self.logger, max_rooms, board_class)
         self.action = action
-        self.write_sel = write_sel
         self.clients = clients
+        # Players that connected but have not set a name yet
+        self.lobby: dict[socket, MessageHandler.Address] = {}
+        # Named players waiting for an opponent
+        self.matchmaker = Matchmaker()
+        # Heartbeats, idle, turn and session timeouts. Advanced by the server's event loop
+        self.timers = TimerWheel()
+        self.heartbeats: dict[socket, Timer] = {}
+        # Seconds a player waits alone in the queue before playing a bot, None for no bots
+        self.bot_wait = bot_wait
+        self.bot_timer: Timer|None = None
+        # Opening moves played by bots, and exact endgame results played by bots
+        # and given to players as hints. Looked up by the board's incremental hash
+        self.book = OpeningBook(bot_book) if bot_book is not None else None
+        self.tablebase = Tablebase(tablebase) if tablebase is not None else None
+        # Search engine shared by every bot, so they share its transposition table.
+        # With search workers it only runs quick searches, the pool runs the rest
+        self.engine = Engine(bot_depth)
+        self.next_bot = 1
+        self.bot_pool: BotPool|None = None
+        if bot_wait is not None and bot_workers > 0:
+            self.bot_pool = BotPool(bot_workers, bot_depth)
+        # Searches running in the pool, with the room, bot and game seq they
+        # were started for and the time they were started
+        self.bot_searches: dict[Future, tuple[Room, Bot, int, float]] = {}
+        self.metrics = Metrics(self.stats)
 
     def handle_message(self, message: dict, sock: socket) -> None:
-        """Base message handler that processes all messages that the server receives"""
+        """Base message handler that processes all messages that the server receives.
+        The time taken is recorded per action type"""
+        start = time.perf_counter()
+        conn = self.clients.get(sock)
+        if conn is not None:
+            conn.last_seen = time.monotonic()
+        self.dispatch(message, sock)
+        action = message.get("action")
+        if action not in ACTIONS:
+            action = "other"
+        self.metrics.handler_latency.observe(time.perf_counter() - start, action)
+
+    def dispatch(self, message: dict, sock: socket) -> None:
+        """Perform the message's action. Messages are routed to the room that
+        the sending socket is seated in"""
         action = message.get("action")
+        # Connection handshake, the player names themselves once the codec is agreed
+        if action == "connect":
+            self.connect(message, sock)
+            return
+        # Heartbeats are answered whatever state the client is in
+        if action == "pong":
+            self.pong(message, sock)
+            return
+        if action == "ping":
+            self.respond(self.action.pong(message.get("nonce")), sock)
+            return
+        room = self.rooms.get_room(sock)
+        if room is None:
+            # Unseated players name themselves to join the matchmaking queue
+            if action == "set_name" and sock in self.lobby:
+                self.respond(self.queue_player(message, sock), sock)
+                return
+            # Spectators are read-only, they can only ask for a fresh snapshot
+            watched = self.rooms.watched_room(sock)
+            if watched is not None and action == "resync":
+                for frame in self.spectator_snapshot(watched):
+                    self.respond(frame, sock)
+            return
         if action is not None:
             if action == "move":
-                addr = self.clients.get(sock)
-                if addr is not None:
-                    res = self.move(message, addr)
-                    # Move was successfull.
-                    if res is None:
-                        self.broadcast(self.action.move(None))
-                    # Move caused an error that should be returned to client
-                    else:
-                        self.respond(res, sock)
-                    # Game reachec an end-state
-                    if self.game.isFinished():
-                        winning_user = self.game.winner
-                        # Must be a draw
-                        if winning_user is None:
-                            self.logger.debug("HIT draw")
-                            self.broadcast(self.action.game_draw(self.board))
-                        # There is a winner
-                        else:
-                            self.broadcast(self.action.game_win(self.board, winning_user))
-                    # Play continues, ensure clients have up to date status
-                    else:
-                        if self.game.whos_move is not None:
-                            self.broadcast(self.action.game_status(self.game.turn_count, self.game.whos_move, self.board))
-            # Pregame, name setting
+                conn = self.clients.get(sock)
+                if conn is not None:
+                    self.play(room, message, sock, conn.addr)
+            # Best move from the endgame tablebase, for the player whose turn it is
+            if action == "hint":
+                conn = self.clients.get(sock)
+                if conn is not None:
+                    self.respond(self.hint(room, conn.addr), sock)
+            # Client missed a move delta and needs a full snapshot
+            if action == "resync":
+                if not room.game.isFinished() and room.game.whos_move is not None:
+                    self.respond(self.game_status(room), sock)
+            # Names are set before a player is seated
             if action == "set_name":
-                addr = self.clients.get(sock)
-                if addr is not None:
-                    res = self.set_name(message, addr)
-                    self.respond(res, sock)
+                self.respond(self.action.err("Name already set"), sock)
 
 
-    def new_player_connected(self, addr: Address) -> None:
-        """Add a new user to the users pool. Max connections
-        is already validated by the server accept_conn.
+    def play(self, room: Room, message: dict, sock: socket, addr: Address) -> None:
+        """Make the move of the player seated at addr, and send the outcome to
+        the room. Moves of the room's bot follow a human player's move"""
+        res = self.move(room, message, addr)
+        # Move was successfull.
+        if res is None:
+            self.metrics.moves_accepted.inc()
+            self.broadcast(room, self.action.move(None))
+        # Move caused an error that should be returned to client
+        else:
+            self.respond(res, sock)
+        # Game reachec an end-state
+        if room.game.isFinished():
+            self.timers.cancel(room.turn_timer)
+            winning_user = room.game.winner
+            # Must be a draw
+            if winning_user is None:
+                self.logger.debug("HIT draw")
+                self.metrics.games_drawn.inc()
+                self.broadcast(room, self.action.game_draw(room.board))
+            # There is a winner
+            else:
+                self.metrics.games_won.inc()
+                self.broadcast(room, self.action.game_win(room.board, winning_user))
+        # Play continues, ensure clients have up to date status
+        elif room.game.whos_move is not None:
+            # Accepted moves are sent as a delta
+            if res is None and room.game.last_move is not None:
+                self.start_turn(room)
+                self.broadcast(room, self.action.move_delta(room.game.seq, room.game.last_move, room.game.turn_count, room.game.whos_move))
+            # Rejected moves resynchronize the sender with a full snapshot
+            else:
+                self.respond(self.game_status(room), sock)
+        self.bot_turn(room)
 
-        CALLED DIRECTLY BY SERVER
-        """
+    def connect(self, msg: dict, sock: socket) -> None:
+        """Connect message received from a new client. The codec is negotiated from
+        the client's preference list and confirmed in the connection response, which
+        is still encoded with the old codec. Every later message uses the new codec.
+        Players are never refused, they are asked for a name and then wait in the
+        matchmaking queue until an opponent and a room are available. A player
+        that sends the session token of a held seat is seated in it instead"""
+        conn = self.clients.get(sock)
+        if conn is None or sock in self.lobby or self.matchmaker.is_queued(sock):
+            return
+        if self.rooms.get_room(sock) is not None or self.rooms.watched_room(sock) is not None:
+            return
+        if msg.get("role") == "spectator":
+            self.spectate(msg, sock, conn)
+            return
+        codec = negotiate(msg.get("codecs"))
+        self.respond(self.action.connection(codec), sock)
+        conn.codec = codec
+        self.logger.info("host: %s, port: %s connected using %s", conn.addr[0], conn.addr[1], codec.name)
+        token = msg.get("session")
+        if isinstance(token, str) and self.resume(token, sock, conn.addr):
+            return
+        self.lobby[sock] = conn.addr
+        self.respond(self.action.set_pregame(), sock)
 
-        self.users.add_user(User(addr))
-        self.broadcast(self.action.connection_start(addr))
-        if self.users.num_players() == 2:
-            try:
-                self.game.setPregame()
-                self.broadcast(self.action.set_pregame())
-            except InvalidStateTransferError:
-                pass
-
-    def game_finished(self) -> bool:
-        """Is the current game finished, yet.
-        Convenience wrapper"""
-        if self.game.isFinished():
-            return True
-        return False
-
-    def remove_player(self, addr: Address) -> None:
-        """Removes the player on disconnection. If the disconnection
-        was unexpected (during a game) then set_waiting is called with True
-        to signal the early disconnect.
+    def spectate(self, msg: dict, sock: socket, conn: Connection) -> None:
+        """Connect message from a spectator. The spectator watches the requested
+        room, or the oldest room if none is given, and is sent a snapshot of the
+        room's game. Spectators do not take a seat, so they are not limited by max_rooms"""
+        room_id = msg.get("room")
+        try:
+            room = self.rooms.watch(sock, conn.addr, None if room_id is None else int(room_id))
+        except (TypeError, ValueError):
+            room = None
+        if room is None:
+            self.metrics.connections_refused.inc()
+            self.respond(self.action.connection_refuse("No such game to spectate"), sock)
+            conn.finish()
+            return
+        codec = negotiate(msg.get("codecs"))
+        self.respond(self.action.connection(codec), sock)
+        conn.codec = codec
+        self.logger.info("host: %s, port: %s spectating room %s using %s", conn.addr[0], conn.addr[1], room.room_id, codec.name)
+        self.respond(self.action.spectating(room.room_id), sock)
+        for frame in self.spectator_snapshot(room):
+            self.respond(frame, sock)
 
-        CALLED DIRECTLY BY SERVER"""
-        self.users.remove_user(addr)
-        self.broadcast(self.action.connection_end(addr))
-        if not self.game.isFinished():
-            self.game.setWaiting()
-            self.broadcast(self.action.set_waiting(True))
+    def spectator_snapshot(self, room: Room) -> list[Frame]:
+        """Frames that bring a spectator up to date with the room's game, the
+        same frames the players received for the current state. They are only
+        rebuilt when the game changes, so many spectators joining at once share
+        the same encoded bytes"""
+        game = room.game
+        key = (game.state, game.seq)
+        if room.snapshot_key == key:
+            return room.snapshot
+        frames = []
+        if game.state == "pregame":
+            frames.append(self.action.set_pregame())
+        elif game.state == "run" and game.first_player is not None and game.whos_move is not None:
+            frames.append(self.action.set_run(game.first_player, room.users, room.board, game.seq))
+            frames.append(self.game_status(room))
+        elif game.state == "finished":
+            if game.winner is None:
+                frames.append(self.action.game_draw(room.board))
+            else:
+                frames.append(self.action.game_win(room.board, game.winner))
         else:
-            if self.users.num_players() == 0:
-                self.game.setWaiting()
-                self.broadcast(self.action.set_waiting(False))
+            frames.append(self.action.set_waiting(False))
+        room.snapshot_key = key
+        room.snapshot = frames
+        return frames
 
-    
-    def set_name(self, msg: dict, addr: Address) -> bytes:
-        """Called when a player sets their name, once
-        both users complete this the game is immediately started"""
+    def queue_player(self, msg: dict, sock: socket) -> Frame:
+        """Name received from a player in the lobby. The player is moved to the
+        matchmaking queue and paired as soon as an opponent is waiting"""
         name = msg.get("name")
-        try:
-            if name is not None:
-                self.users.set_user_name(addr, name)
-                res = self.action.ok()
+        addr = self.lobby[sock]
+        if not isinstance(name, str) or name == "":
+            return self.action.err("Failed to set user name")
+        del self.lobby[sock]
+        self.logger.info("set host: %s post: %s name: %s", addr[0], addr[1], name)
+        self.respond(self.action.ok(), sock)
+        self.matchmaker.enqueue(sock, addr, name)
+        self.logger.info("Queued host: %s, port: %s, %s players waiting", addr[0], addr[1], self.matchmaker.depth())
+        self.match()
+        # Unpaired players wait for an opponent
+        if self.matchmaker.is_queued(sock):
+            return self.action.set_waiting(False)
+        return None
+
+    def match(self) -> None:
+        """Pair the longest waiting players into fresh rooms while rooms can
+        be opened. A player left waiting alone is paired with a bot once they
+        have waited bot_wait seconds"""
+        while self.rooms.can_open():
+            pair = self.matchmaker.pop_pair()
+            if pair is None:
+                self.match_bot()
+                return
+            for player in pair:
+                self.metrics.queue_wait.observe(player.wait_time())
+            self.start_game([(player.sock, player.addr, player.name) for player in pair])
+
+    def match_bot(self) -> None:
+        """Seat the only waiting player against a bot if they have waited
+        long enough, otherwise check again once they have"""
+        self.timers.cancel(self.bot_timer)
+        self.bot_timer = None
+        if self.bot_wait is None or self.matchmaker.depth() != 1:
+            return
+        waited = self.matchmaker.oldest_wait()
+        if waited < self.bot_wait:
+            self.bot_timer = self.timers.schedule(self.bot_wait - waited, self.match)
+            return
+        player = self.matchmaker.pop_oldest()
+        if player is None:
+            return
+        self.metrics.queue_wait.observe(player.wait_time())
+        bot = Bot(("bot", self.next_bot))
+        self.next_bot += 1
+        self.metrics.bot_games.inc()
+        self.start_game([(player.sock, player.addr, player.name), (bot, bot.addr, bot.name)])
+
+    def start_game(self, players: list[tuple[socket|Bot, Address, str]]) -> None:
+        """Seat two named players in a new room and start their game at once.
+        The human players are issued session tokens"""
+        room = self.rooms.seat_pair([(sock, addr) for sock, addr, _ in players])
+        for _, addr, name in players:
+            user = User(addr)
+            user.set_name(name)
+            room.users.add_user(user)
+            self.logger.info("Seated host: %s, port: %s in room %s", addr[0], addr[1], room.room_id)
+        room.game.setPregame()
+        room.users.set_values()
+        room.game.setRun()
+        if room.game.first_player is not None:
+            self.metrics.games_started.inc()
+            self.start_turn(room)
+            self.broadcast(room, self.action.set_run(room.game.first_player, room.users, room.board, room.game.seq))
+        for sock, addr, _ in players:
+            if not isinstance(sock, Bot):
+                token = self.rooms.issue(room, addr)
+                self.respond(self.action.session(token, "issued", SESSION_GRACE), sock)
+        self.bot_turn(room)
+
+    def bot_turn(self, room: Room) -> None:
+        """Start the move of the room's bot if it is the bot's turn. Positions in
+        the opening book or tablebase are played at once. Otherwise the search
+        runs in the search pool, and the bot moves once the server collects the
+        result. Without a pool the bot searches and moves at once"""
+        game = room.game
+        if game.state != "run" or game.whos_move is None or room.bot_search is not None:
+            return
+        for sock in room.socks:
+            if isinstance(sock, Bot) and sock.addr == game.whos_move.addr:
+                start = time.perf_counter()
+                column = self.table_move(room)
+                if column is not None:
+                    self.metrics.bot_search.observe(time.perf_counter() - start)
+                    self.bot_move(room, sock, game.seq, column)
+                    return
+                position, mask = position_of(room.board, game.whos_move.value)
+                deadline = time.monotonic() + BOT_MOVE_TIME
+                if self.bot_pool is None:
+                    column = self.engine.best_move(position, mask, deadline)
+                    self.metrics.bot_search.observe(time.perf_counter() - start)
+                    self.bot_move(room, sock, game.seq, column)
+                    return
+                future = self.bot_pool.submit(position, mask, deadline)
+                self.bot_searches[future] = (room, sock, game.seq, start)
+                room.bot_search = future
+                room.bot_timer = self.timers.schedule(BOT_MOVE_TIME + BOT_GRACE, self.bot_overdue, room, future)
+                return
+
+    def table_move(self, room: Room) -> int|None:
+        """Column of the room's position in the opening book or the tablebase,
+        None if it is in neither"""
+        if self.book is not None:
+            column = self.book.probe(room.board)
+            if column is not None:
+                return column
+        if self.tablebase is not None:
+            entry = self.tablebase.probe(room.board)
+            if entry is not None:
+                return entry[0]
+        return None
+
+    def bot_moves_ready(self) -> None:
+        """Play the moves of the bot searches that finished. Results of
+        searches that were cancelled, or whose game moved on, are dropped.
+
+        CALLED DIRECTLY BY SERVER"""
+        if self.bot_pool is None:
+            return
+        for future in self.bot_pool.completed():
+            search = self.bot_searches.pop(future, None)
+            if search is None or future.cancelled():
+                continue
+            room, bot, seq, start = search
+            if room.bot_search is not future:
+                continue
+            self.cancel_bot_search(room)
+            try:
+                column = future.result()
+            except Exception as e:
+                self.logger.error("Bot search in room %s failed: %s", room.room_id, e)
+                column = self.quick_search(room)
+            self.metrics.bot_search.observe(time.perf_counter() - start)
+            self.bot_move(room, bot, seq, column)
+
+    def bot_overdue(self, room: Room, future: Future) -> None:
+        """The bot's search did not return in time. It is cancelled and the
+        bot plays the result of a quick search instead"""
+        search = self.bot_searches.get(future)
+        if room.bot_search is not future or search is None:
+            return
+        _, bot, seq, start = search
+        self.cancel_bot_search(room)
+        self.logger.warning("Bot search in room %s missed its deadline, playing a quick search", room.room_id)
+        self.metrics.bot_timeouts.inc()
+        column = self.quick_search(room)
+        self.metrics.bot_search.observe(time.perf_counter() - start)
+        self.bot_move(room, bot, seq, column)
+
+    def quick_search(self, room: Room) -> int:
+        """Column for the current mover found by a search cut short after QUICK_SEARCH_TIME"""
+        position, mask = position_of(room.board, room.game.whos_move.value)
+        return self.engine.best_move(position, mask, time.monotonic() + QUICK_SEARCH_TIME)
+
+    def cancel_bot_search(self, room: Room) -> None:
+        """Stop waiting for the room's bot search. A search that has not
+        started is cancelled, the result of a running one is dropped"""
+        future = room.bot_search
+        if future is None:
+            return
+        room.bot_search = None
+        self.timers.cancel(room.bot_timer)
+        room.bot_timer = None
+        future.cancel()
+
+    def bot_move(self, room: Room, bot: Bot, seq: int, column: int) -> None:
+        """Play the column chosen by the bot, if its game is still at the move
+        the search was started for"""
+        game = room.game
+        if room.room_id not in self.rooms.rooms or bot not in room.socks or game.state != "run" or game.seq != seq:
+            return
+        self.play(room, {"action": "move", "column": column, "turn-count": game.turn_count}, bot, bot.addr)
+
+    def resume(self, token: str, sock: socket, addr: Address) -> bool:
+        """Seat a reconnected player in the seat held for their session token.
+        The room is sent the run state with the player's new address, then a
+        snapshot of the game, so the player skips naming and the matchmaking
+        queue. Returns False if no seat is held for the token"""
+        resumed = self.rooms.resume(token, sock, addr)
+        if resumed is None:
+            return False
+        room, old_addr = resumed
+        room.users.readdress(old_addr, addr)
+        # Spectator snapshots carry the old address
+        room.snapshot_key = None
+        self.logger.info("host: %s, port: %s resumed the seat of %s, %s in room %s", addr[0], addr[1], old_addr[0], old_addr[1], room.room_id)
+        self.respond(self.action.session(token, "resumed", SESSION_GRACE), sock)
+        self.broadcast(room, self.action.connection_start(addr))
+        game = room.game
+        if game.first_player is not None:
+            self.broadcast(room, self.action.set_run(game.first_player, room.users, room.board, game.seq))
+        if game.isFinished():
+            if game.winner is None:
+                self.broadcast(room, self.action.game_draw(room.board))
             else:
-                res = self.action.err("Failed to set user name")
-        except UserNotFoundError:
-            res = self.action.err("User with this address was not found")
-        self.logger.info(f"set host: {addr[0]} post: {addr[1]} name: {name}")
-        if self.users.are_names_set():
-            self.users.set_values()
-            self.game.setRun()
-            if self.game.first_player is not None:
-                self.broadcast(self.action.set_run(self.game.first_player, self.users, self.board))
-        return res
+                self.broadcast(room, self.action.game_win(room.board, game.winner))
+        elif game.whos_move is not None:
+            self.broadcast(room, self.game_status(room))
+        return True
+
+    def expire_sessions(self) -> None:
+        """Release the seats of players that did not reconnect within the
+        grace period. Their games end as if they had just disconnected"""
+        for room, addr in self.rooms.expired():
+            if room.room_id in self.rooms.rooms:
+                self.logger.info("Session of host: %s, port: %s in room %s expired", addr[0], addr[1], room.room_id)
+                self.leave(room, addr)
+
+    def remove_player(self, sock: socket, addr: Address) -> None:
+        """Removes the player on disconnection. A player that drops out of a
+        running game keeps their seat for the session grace period, so they can
+        reconnect and resume. Otherwise the player leaves the room.
+
+        CALLED DIRECTLY BY SERVER"""
+        self.timers.cancel(self.heartbeats.pop(sock, None))
+        if self.rooms.unwatch(sock) is not None:
+            return
+        if self.lobby.pop(sock, None) is not None or self.matchmaker.remove(sock) is not None:
+            return
+        room = self.rooms.unseat(sock)
+        if room is None:
+            return
+        self.broadcast(room, self.action.connection_end(addr))
+        if room.game.state == "run" and room.room_id in self.rooms.rooms:
+            token = self.rooms.token_of(room, addr)
+            if token is not None:
+                self.rooms.hold(token)
+                self.timers.schedule(SESSION_GRACE, self.expire_sessions)
+                self.logger.info("Holding the seat of host: %s, port: %s in room %s", addr[0], addr[1], room.room_id)
+                return
+        self.leave(room, addr)
 
-    def move(self, msg: dict, addr: Address) -> bytes|None:
+    def leave(self, room: Room, addr: Address) -> None:
+        """Remove the player's user from the room. If the game was still
+        going then set_waiting is called with True to signal the early
+        disconnect, and the remaining player goes back to the front of the
+        matchmaking queue. A bot leaves along with the last player. Spectators are disconnected once the room closes"""
+        room.users.remove_user(addr)
+        self.timers.cancel(room.turn_timer)
+        self.cancel_bot_search(room)
+        if not room.game.isFinished():
+            # The opponent keeps their name and is paired again without reconnecting
+            opponents = [(other, other_addr, room.users.get_user(other_addr).name) for other, other_addr in room.socks.items()
+                         if not isinstance(other, Bot)]
+            room.game.setWaiting()
+            self.broadcast(room, self.action.set_waiting(True))
+            for other, other_addr, name in opponents:
+                self.rooms.unseat(other)
+                self.matchmaker.enqueue(other, other_addr, name, front=True)
+        # Bots leave with the last human player
+        if all(isinstance(other, Bot) for other in room.socks):
+            for bot in list(room.socks):
+                self.rooms.unseat(bot)
+        # The room closed with its last player, spectators have nothing left to watch
+        if room.room_id not in self.rooms.rooms:
+            for spectator in list(room.spectators):
+                self.rooms.unwatch(spectator)
+                conn = self.clients.get(spectator)
+                if conn is not None:
+                    conn.finish()
+            # A room was freed for the players still waiting
+            self.match()
+
+    
+    def new_connection(self, sock: socket) -> None:
+        """Start the heartbeat of a newly accepted connection.
+
+        CALLED DIRECTLY BY SERVER"""
+        self.heartbeats[sock] = self.timers.schedule(PING_INTERVAL, self.heartbeat, sock)
+
+    def heartbeat(self, sock: socket) -> None:
+        """Close the connection if it has been idle for too long, otherwise
+        ping it and schedule the next heartbeat. A pong received since the last
+        heartbeat counts as activity, so live clients are never idle"""
+        conn = self.clients.get(sock)
+        if conn is None:
+            self.heartbeats.pop(sock, None)
+            return
+        now = time.monotonic()
+        if now - conn.last_seen > IDLE_TIMEOUT:
+            self.logger.warning("Client at %s sent nothing for %s seconds. Closing connection", conn.addr, IDLE_TIMEOUT)
+            self.metrics.idle_timeouts.inc()
+            self.heartbeats.pop(sock, None)
+            conn.abort()
+            return
+        conn.ping_nonce += 1
+        conn.ping_sent = now
+        self.respond(self.action.ping(conn.ping_nonce, conn.rtt), sock)
+        self.heartbeats[sock] = self.timers.schedule(PING_INTERVAL, self.heartbeat, sock)
+
+    def pong(self, msg: dict, sock: socket) -> None:
+        """Pong received for a heartbeat ping. Records the connection's round trip time"""
+        conn = self.clients.get(sock)
+        if conn is None or conn.ping_sent == 0.0 or msg.get("nonce") != conn.ping_nonce:
+            return
+        conn.rtt = time.monotonic() - conn.ping_sent
+        conn.ping_sent = 0.0
+        self.metrics.rtt.observe(conn.rtt)
+
+    def start_turn(self, room: Room) -> None:
+        """Restart the room's turn timeout for the current mover"""
+        self.timers.cancel(room.turn_timer)
+        room.turn_timer = self.timers.schedule(TURN_TIMEOUT, self.turn_expired, room, room.game.seq)
+
+    def turn_expired(self, room: Room, seq: int) -> None:
+        """The mover did not move within the turn timeout and forfeits the game"""
+        game = room.game
+        if room.room_id not in self.rooms.rooms or game.state != "run" or game.seq != seq:
+            return
+        winner = None
+        for user in room.users.connected_users.values():
+            if user is not game.whos_move:
+                winner = user
+        if winner is None:
+            return
+        self.logger.info("Turn timeout in room %s, host: %s, port: %s forfeits", room.room_id, game.whos_move.host, game.whos_move.port)
+        game.setFinished(winner)
+        self.cancel_bot_search(room)
+        self.metrics.turn_timeouts.inc()
+        self.metrics.games_won.inc()
+        self.broadcast(room, self.action.game_win(room.board, winner))
+
+    def game_status(self, room: Room) -> Frame:
+        """Full snapshot of the room's running game"""
+        return self.action.game_status(room.game.turn_count, room.game.whos_move, room.board, room.game.seq)
+
+    def hint(self, room: Room, addr: Address) -> Frame:
+        """Hint message received from client. Look up the player's position in
+        the endgame tablebase, only on their turn"""
+        game = room.game
+        if game.state != "run" or game.whos_move is None or game.whos_move.addr != addr:
+            return self.action.err("It is not your turn")
+        entry = None
+        if self.tablebase is not None:
+            entry = self.tablebase.probe(room.board)
+        if entry is None:
+            self.metrics.hints.inc(1, "missing")
+            return self.action.hint(None, None)
+        self.metrics.hints.inc(1, "found")
+        return self.action.hint(entry[0], outcome(entry[1]))
+
+    def move(self, room: Room, msg: dict, addr: Address) -> Frame|None:
         """Move message received from client. Make the move on the game, and report any errors to 
         the client"""
         column = msg.get("column")
         turn_count = msg.get("turn-count")
         try:
             if column is not None and turn_count is not None:
-                self.game.move(addr, int(column), int(turn_count))
-            res = None
+                # Booleans are ints to Python, but never a column or turn
+                if isinstance(column, bool) or isinstance(turn_count, bool):
+                    raise ValueError(column)
+                room.game.move(addr, int(column), int(turn_count))
+            return None
         except UserNotFoundError:
+            reason = "user_not_found"
             res = self.action.move("User with this address was not found")
         except InvalidOrderError:
+            reason = "not_your_turn"
             res = self.action.move("It is not your turn")
         except OutOfDateError:
+            reason = "stale_turn"
             res = self.action.move("Stale data used for turn, try again.")
         except InvalidColumnError:
+            reason = "column_out_of_range"
             res = self.action.move("Column out of range")
         except InvalidRowError:
+            reason = "column_full"
             res = self.action.move("Column is full")
-        except ValueError:
+        # Any other type, such as a list or an infinite float, cannot be a column
+        except (ValueError, TypeError, OverflowError):
+            reason = "invalid_value"
             res = self.action.move("Invalid value passed")
+        self.metrics.moves_rejected.inc(1, reason)
         return res
 
-    def respond(self, msg: bytes, sock: socket) -> None:
-        """Respond to client who sent the message"""
+    def stats(self) -> dict[str, int]:
+        """Current connection and game counts, reported by worker processes"""
+        running = 0
+        for room in self.rooms.rooms.values():
+            if room.game.state == "run":
+                running += 1
+        return {
+                "connections": len(self.clients),
+                "rooms": self.rooms.num_rooms(),
+                "games_running": running,
+                "spectators": self.rooms.num_spectators(),
+                "queued": self.matchmaker.depth(),
+                "seats_held": len(self.rooms.held),
+                "rtt_avg_ms": self.average_rtt_ms(),
+                "rtt_measured": sum(1 for conn in self.clients.values() if conn.rtt is not None),
+                "bot_searches": len(self.bot_searches),
+                }
+
+    def average_rtt_ms(self) -> int:
+        """Mean round trip time of the connections measured so far, in milliseconds"""
+        total = 0.0
+        measured = 0
+        for conn in self.clients.values():
+            if conn.rtt is not None:
+                total += conn.rtt
+                measured += 1
+        if measured == 0:
+            return 0
+        return round(total / measured * 1000)
+
+    def respond(self, msg: Frame|None, sock: socket) -> None:
+        """Respond to client who sent the message. The message is encoded with
+        the client's codec, then queued on the client's connection and sent as
+        the socket becomes writable"""
         if msg is not None:
-            sock.sendall(msg)
+            conn = self.clients.get(sock)
+            if conn is not None:
+                header, body = msg.encode(conn.codec)
+                self.metrics.frames_sent.inc()
+                self.metrics.bytes_sent.inc(len(header) + len(body))
+                conn.send(header, body)
 
-    def broadcast(self, msg: bytes) -> None:
-        """Broadcast message to all clients"""
-        for key, _ in self.write_sel.select(0):
-            key.fileobj.send(msg)
+    def broadcast(self, room: Room, msg: Frame) -> None:
+        """Broadcast message to all clients seated in or watching the room.
+        The frame is encoded once per codec, and the same bytes object is
+        queued on every connection, so a broadcast to thousands of spectators
+        costs no more encoding than one to the two players"""
+        sent = 0
+        size = 0
+        for clients in (room.socks, room.spectators):
+            for sock in clients:
+                conn = self.clients.get(sock)
+                if conn is not None:
+                    header, body = msg.encode(conn.codec)
+                    sent += 1
+                    size += len(header) + len(body)
+                    conn.send(header, body)
+        self.metrics.frames_sent.inc(sent)
+        self.metrics.bytes_sent.inc(size)
 
 
@@ -0,0 +1,229 @@
+import os
+import selectors
+import socket
+from bisect import bisect_left
+from logging import Logger
+from typing import Callable
+
+# Upper bounds in seconds of the handler latency histogram buckets
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+# Upper bounds in seconds of the matchmaking queue wait histogram buckets
+QUEUE_WAIT_BUCKETS = (0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# Upper bounds in seconds of the heartbeat round trip time histogram buckets
+RTT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Upper bounds in seconds of the bot move search time histogram buckets
+BOT_SEARCH_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# Seconds between metrics file dumps
+DUMP_INTERVAL = 10.0
+
+# Action types tracked by the latency histogram, anything else is counted as "other"
+ACTIONS = ("connect", "hint", "move", "ping", "pong", "resync", "set_name")
+
+
+class Counter:
+    """Monotonic counter, optionally split by the value of a single label"""
+
+    def __init__(self, name: str, help: str, label: str|None = None) -> None:
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values: dict[str, int] = {}
+
+    def inc(self, amount: int = 1, label_value: str = "") -> None:
+        """Add to the counter, or to the count of the given label value"""
+        self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def render(self) -> list[str]:
+        """Lines of the counter in the Prometheus text format"""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        if self.label is None:
+            lines.append(f"{self.name} {self.values.get('', 0)}")
+        for label_value, value in sorted(self.values.items()):
+            if self.label is not None:
+                lines.append(f'{self.name}{{{self.label}="{label_value}"}} {value}')
+        return lines
+
+
+class Histogram:
+    """Histogram with fixed bucket bounds, optionally split by the value of a single label"""
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...], label: str|None = None) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.label = label
+        # Per label value: count per bucket, with a last bucket for values above every bound, and the sum
+        self.counts: dict[str, list[int]] = {}
+        self.sums: dict[str, float] = {}
+
+    def observe(self, value: float, label_value: str = "") -> None:
+        """Record a single value"""
+        counts = self.counts.get(label_value)
+        if counts is None:
+            counts = self.counts[label_value] = [0] * (len(self.buckets) + 1)
+            self.sums[label_value] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self.sums[label_value] += value
+
+    def render(self) -> list[str]:
+        """Lines of the histogram in the Prometheus text format. Bucket counts are cumulative"""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_value, counts in sorted(self.counts.items()):
+            prefix = f'{self.label}="{label_value}",' if self.label is not None else ""
+            labels = f"{{{prefix[:-1]}}}" if prefix else ""
+            total = 0
+            for bound, count in zip(self.buckets, counts):
+                total += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {total}')
+            total += counts[-1]
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {total}')
+            lines.append(f"{self.name}_sum{labels} {self.sums[label_value]}")
+            lines.append(f"{self.name}_count{labels} {total}")
+        return lines
+
+
+class Metrics:
+    """Counters and histograms of a single server process. Updated by the server
+    engine and the message handler, and rendered in the Prometheus text
+    exposition format. The gauges callable gives current values, such as the
+    handler stats, that are rendered as gauges."""
+
+    def __init__(self, gauges: Callable[[], dict[str, int]]|None = None) -> None:
+        self.gauges = gauges
+        self.connections_accepted = Counter("connect4_connections_accepted_total", "Client connections accepted")
+        self.connections_refused = Counter("connect4_connections_refused_total", "Client connections refused")
+        self.frames_received = Counter("connect4_frames_received_total", "Frames received from clients")
+        self.frames_sent = Counter("connect4_frames_sent_total", "Frames queued to clients")
+        self.bytes_received = Counter("connect4_bytes_received_total", "Bytes received from clients")
+        self.bytes_sent = Counter("connect4_bytes_sent_total", "Bytes queued to clients")
+        self.moves_accepted = Counter("connect4_moves_accepted_total", "Moves accepted")
+        self.moves_rejected = Counter("connect4_moves_rejected_total", "Moves rejected, by reason", "reason")
+        self.games_started = Counter("connect4_games_started_total", "Games started")
+        self.games_won = Counter("connect4_games_won_total", "Games finished with a winner")
+        self.games_drawn = Counter("connect4_games_drawn_total", "Games finished in a draw")
+        self.handler_latency = Histogram("connect4_handler_latency_seconds", "Time to handle a client message, by action",
+                                         LATENCY_BUCKETS, "action")
+        self.queue_wait = Histogram("connect4_queue_wait_seconds", "Time a named player waited in the matchmaking queue for an opponent",
+                                    QUEUE_WAIT_BUCKETS)
+        self.rtt = Histogram("connect4_rtt_seconds", "Round trip time of heartbeat pings to clients", RTT_BUCKETS)
+        self.idle_timeouts = Counter("connect4_idle_timeouts_total", "Connections closed for not sending anything within the idle timeout")
+        self.turn_timeouts = Counter("connect4_turn_timeouts_total", "Games forfeited by a player who did not move within the turn timeout")
+        self.bot_games = Counter("connect4_bot_games_total", "Games started between a waiting player and a bot")
+        self.bot_search = Histogram("connect4_bot_search_seconds", "Time from a bot's turn starting until its move was chosen", BOT_SEARCH_BUCKETS)
+        self.bot_timeouts = Counter("connect4_bot_timeouts_total", "Bot searches that missed their deadline and were replaced by a quick search")
+        self.hints = Counter("connect4_hints_total", "Hints requested, by whether the tablebase had the position", "result")
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in (self.connections_accepted, self.connections_refused, self.frames_received, self.frames_sent,
+                       self.bytes_received, self.bytes_sent, self.moves_accepted, self.moves_rejected,
+                       self.games_started, self.games_won, self.games_drawn, self.handler_latency, self.queue_wait,
+                       self.rtt, self.idle_timeouts, self.turn_timeouts, self.bot_games, self.bot_search,
+                       self.bot_timeouts, self.hints):
+            lines.extend(metric.render())
+        if self.gauges is not None:
+            for name, value in self.gauges().items():
+                lines.append(f"# TYPE connect4_{name} gauge")
+                lines.append(f"connect4_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def http_response(self) -> bytes:
+        """Complete HTTP response carrying the rendered metrics, answered to
+        every request of the metrics endpoint before the connection is closed"""
+        body = self.render().encode("utf-8")
+        header = ("HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                  f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode("ascii")
+        return header + body
+
+    def dump(self, path: str) -> None:
+        """Write the rendered metrics to a file. The file is replaced in one
+        step, so readers never see a partial dump"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+class MetricsEndpoint:
+    """Plain HTTP endpoint serving the metrics on a selector. Every request,
+    whatever its path, is answered with the rendered metrics and the connection
+    is closed. Requests are handled without blocking the server's event loop."""
+
+    def __init__(self, logger: Logger, metrics: Metrics, sel: selectors.BaseSelector, port: int) -> None:
+        self.logger = logger
+        self.metrics = metrics
+        self.sel = sel
+        self.port = port
+        self.sock: socket.socket|None = None
+        # Response bytes left to send, per scraper connection
+        self.pending: dict[socket.socket, bytes] = {}
+
+    def start(self) -> None:
+        """Listen on the metrics port and register with the selector"""
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('', self.port))
+        self.sock.listen()
+        self.sock.setblocking(False)
+        self.sel.register(self.sock, selectors.EVENT_READ, self.accept)
+        self.logger.info("Serving metrics at port %s", self.port)
+
+    def accept(self, sock: socket.socket, mask: int) -> None:
+        """New scraper connection, wait for its request"""
+        try:
+            conn, _ = sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        conn.setblocking(False)
+        self.sel.register(conn, selectors.EVENT_READ, self.request)
+
+    def request(self, conn: socket.socket, mask: int) -> None:
+        """Read the request and start sending the metrics"""
+        try:
+            data = conn.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.close(conn)
+            return
+        self.pending[conn] = self.metrics.http_response()
+        self.sel.modify(conn, selectors.EVENT_WRITE, self.respond)
+        self.respond(conn, selectors.EVENT_WRITE)
+
+    def respond(self, conn: socket.socket, mask: int) -> None:
+        """Send as much of the response as the socket accepts, close once done"""
+        data = self.pending.get(conn)
+        if data is None:
+            return
+        try:
+            sent = conn.send(data)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self.close(conn)
+            return
+        if sent < len(data):
+            self.pending[conn] = data[sent:]
+        else:
+            self.close(conn)
+
+    def close(self, conn: socket.socket) -> None:
+        """Close a scraper connection"""
+        self.pending.pop(conn, None)
+        self.sel.unregister(conn)
+        conn.close()
+
+    def shutdown(self) -> None:
+        """Stop serving metrics"""
+        for conn in list(self.pending):
+            self.close(conn)
+        if self.sock is not None:
+            self.sel.unregister(self.sock)
+            self.sock.close()
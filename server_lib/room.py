@@ -0,0 +1,198 @@
+from concurrent.futures import Future
+from logging import Logger
+import secrets
+import time
+from socket import socket
+from typing import TypeAlias
+
+from server_lib.bitboard import BitBoard
+from server_lib.board import Board
+from server_lib.game import Game
+from server_lib.timers import Timer
+from server_lib.users import Users
+
+# Seconds a disconnected player's seat is held for them to resume the game
+SESSION_GRACE = 30.0
+
+
+class Room:
+    """A single game hosted by the server. Each room owns its own
+    board, users and game, along with the sockets of the players seated in it
+    and of the spectators watching it."""
+
+    Address: TypeAlias = tuple[str, int]
+
+    def __init__(self, logger: Logger, room_id: int, board_class: type[Board]|type[BitBoard] = BitBoard) -> None:
+        self.logger = logger
+        self.room_id = room_id
+        self.board = board_class(self.logger)
+        self.users = Users(self.logger)
+        self.game = Game(self.logger, self.board, self.users)
+        # Sockets seated in this room, used for room-wide broadcasts
+        self.socks: dict[socket, Address] = {}
+        # Read-only sockets watching this room, they receive every broadcast
+        self.spectators: dict[socket, Address] = {}
+        # Snapshot frames sent to spectators joining late, and the (state, seq) they were built for
+        self.snapshot_key: tuple[str, int]|None = None
+        self.snapshot: list = []
+        # Session tokens of the players, and the address each was last seated with
+        self.sessions: dict[str, Address] = {}
+        # Timer that forfeits the game if the current mover does not move in time
+        self.turn_timer: Timer|None = None
+        # Search of the room's bot for its next move, and the timer that gives up on it
+        self.bot_search: Future|None = None
+        self.bot_timer: Timer|None = None
+
+    def num_players(self) -> int:
+        """Number of sockets currently seated in the room"""
+        return len(self.socks)
+
+
+class Rooms:
+    """Registry of all rooms hosted by the server. Sockets are routed
+    to their room in O(1) through the socket map. Each room is opened for
+    a pair of players matched by the matchmaker."""
+
+    Address: TypeAlias = tuple[str, int]
+
+    def __init__(self, logger: Logger, max_rooms: int|None = None, board_class: type[Board]|type[BitBoard] = BitBoard) -> None:
+        self.logger = logger
+        self.max_rooms = max_rooms
+        self.board_class = board_class
+        self.rooms: dict[int, Room] = {}
+        self.sock_rooms: dict[socket, Room] = {}
+        # Spectator sockets and the room each is watching
+        self.watching: dict[socket, Room] = {}
+        # Session tokens of every room, and the seats held for disconnected players
+        # with the time the hold expires. Holds all last SESSION_GRACE, so they
+        # expire in insertion order
+        self.sessions: dict[str, Room] = {}
+        self.held: dict[str, float] = {}
+        self.next_id = 1
+
+    def num_rooms(self) -> int:
+        """Number of rooms currently hosted"""
+        return len(self.rooms)
+
+    def get_room(self, sock: socket) -> Room|None:
+        """Room that the socket is seated in"""
+        return self.sock_rooms.get(sock)
+
+    def watched_room(self, sock: socket) -> Room|None:
+        """Room that the spectator socket is watching"""
+        return self.watching.get(sock)
+
+    def num_spectators(self) -> int:
+        """Number of spectators watching any room"""
+        return len(self.watching)
+
+    def can_open(self) -> bool:
+        """Can another room be opened without exceeding max_rooms"""
+        return self.max_rooms is None or len(self.rooms) < self.max_rooms
+
+    def seat_pair(self, players: list[tuple[socket, Address]]) -> Room:
+        """Open a new room and seat the given sockets in it. Raises
+        RoomsFullError if max_rooms is reached"""
+        room = self.new_room()
+        for sock, addr in players:
+            room.socks[sock] = addr
+            self.sock_rooms[sock] = room
+        return room
+
+    def unseat(self, sock: socket) -> Room|None:
+        """Remove the socket from its room. Empty rooms are deleted
+        along with their session tokens"""
+        room = self.sock_rooms.pop(sock, None)
+        if room is None:
+            return None
+        room.socks.pop(sock, None)
+        if room.num_players() == 0:
+            self.rooms.pop(room.room_id, None)
+            for token in room.sessions:
+                self.sessions.pop(token, None)
+                self.held.pop(token, None)
+            room.sessions.clear()
+            self.logger.info("Closed room %s", room.room_id)
+        return room
+
+    def issue(self, room: Room, addr: Address) -> str:
+        """Create the session token that lets the player at addr reclaim
+        their seat in the room after a disconnect"""
+        token = secrets.token_urlsafe(16)
+        room.sessions[token] = addr
+        self.sessions[token] = room
+        return token
+
+    def token_of(self, room: Room, addr: Address) -> str|None:
+        """Session token of the player at addr"""
+        for token, seat_addr in room.sessions.items():
+            if seat_addr == addr:
+                return token
+        return None
+
+    def hold(self, token: str) -> None:
+        """Keep the token's seat for SESSION_GRACE seconds"""
+        self.held[token] = time.monotonic() + SESSION_GRACE
+
+    def resume(self, token: str, sock: socket, addr: Address) -> tuple[Room, Address]|None:
+        """Seat the socket in the held seat of the token. Returns the room and
+        the address the seat was held for, or None if there is no such hold"""
+        if self.held.pop(token, None) is None:
+            return None
+        room = self.sessions[token]
+        old_addr = room.sessions[token]
+        room.sessions[token] = addr
+        room.socks[sock] = addr
+        self.sock_rooms[sock] = room
+        return room, old_addr
+
+    def expired(self) -> list[tuple[Room, Address]]:
+        """Release the held seats whose grace period is over. Returns the room
+        and address of each released seat"""
+        released = []
+        now = time.monotonic()
+        while self.held:
+            token, deadline = next(iter(self.held.items()))
+            if deadline > now:
+                break
+            del self.held[token]
+            room = self.sessions.pop(token)
+            released.append((room, room.sessions.pop(token)))
+        return released
+
+    def watch(self, sock: socket, addr: Address, room_id: int|None = None) -> Room|None:
+        """Add the socket as a spectator of the given room, or of the oldest
+        room when no room is given. Returns None if there is no such room"""
+        if room_id is None:
+            room = next(iter(self.rooms.values()), None)
+        else:
+            room = self.rooms.get(room_id)
+        if room is None:
+            return None
+        room.spectators[sock] = addr
+        self.watching[sock] = room
+        return room
+
+    def unwatch(self, sock: socket) -> Room|None:
+        """Stop the socket spectating its room"""
+        room = self.watching.pop(sock, None)
+        if room is not None:
+            room.spectators.pop(sock, None)
+        return room
+
+    def new_room(self) -> Room:
+        """Create and register a new empty room"""
+        if self.max_rooms is not None and len(self.rooms) >= self.max_rooms:
+            self.logger.warning("Room limit of %s reached", self.max_rooms)
+            raise RoomsFullError
+        room = Room(self.logger, self.next_id, self.board_class)
+        self.next_id += 1
+        self.rooms[room.room_id] = room
+        self.logger.info("Opened room %s", room.room_id)
+        return room
+
+
+class RoomsFullError(Exception):
+    """Raised when a new room is needed but the server
+    is already hosting the maximum number of rooms"""
+    pass
@@ -0,0 +1,34 @@
+from server_lib.bitboard import COLUMNS, ROWS, BitBoard
+from server_lib.board import Board
+from server_lib.book import PositionTable
+
+# Identifies an endgame tablebase file and the version of its layout
+TABLEBASE_MAGIC = b"C4TBASE1"
+
+# Cells of a full board
+BOARD_CELLS = COLUMNS * ROWS
+
+
+class Tablebase(PositionTable):
+    """Exact results of endgame positions. Scores are exact, positive when the
+    player to move wins, negative when they lose and 0 for a draw. The limit of
+    a tablebase is the most empty cells of its positions, positions with more
+    empty cells are never looked up"""
+
+    magic = TABLEBASE_MAGIC
+
+    def probe(self, board: Board|BitBoard) -> tuple[int, int]|None:
+        """Best column for the player to move and its exact score, or None if
+        the position is not in the tablebase"""
+        if BOARD_CELLS - board.stones > self.limit:
+            return None
+        return self.find(board)
+
+
+def outcome(score: int) -> str:
+    """Result of a tablebase score for the player to move"""
+    if score > 0:
+        return "win"
+    if score < 0:
+        return "loss"
+    return "draw"
@@ -0,0 +1,102 @@
+import math
+import time
+from typing import Any, Callable
+
+# Resolution of the timer wheel in seconds, timers fire within one tick of their delay
+TICK = 0.1
+
+# Number of slots in the wheel. Timers further away than one revolution stay in
+# their slot and are skipped until the revolution in which they are due
+SLOTS = 1024
+
+
+class Timer:
+    """A callback scheduled on the timer wheel"""
+
+    def __init__(self, tick: int, callback: Callable[..., Any], args: tuple) -> None:
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        # Set once the timer has fired or was cancelled
+        self.done = False
+
+
+class TimerWheel:
+    """Hashed timer wheel. A timer is placed in the slot of the tick it is due
+    in, modulo the number of slots, so scheduling and cancelling are O(1) however
+    many timers are pending. Advancing the wheel only visits the slots of the ticks
+    that have passed. Cancelled timers are dropped when their slot is visited."""
+
+    def __init__(self, tick: float = TICK, slots: int = SLOTS) -> None:
+        self.tick = tick
+        self.slots = slots
+        self.wheel: list[list[Timer]] = [[] for _ in range(slots)]
+        # Last tick that was processed
+        self.current = int(time.monotonic() / tick)
+        # Number of timers that are neither fired nor cancelled
+        self.pending = 0
+
+    def schedule(self, delay: float, callback: Callable[..., Any], *args: Any) -> Timer:
+        """Call callback with args once delay seconds have passed. The delay is
+        counted from now, or from the time the wheel was advanced to if that is
+        later, so timers scheduled by a callback are relative to it. Timers never
+        fire before their delay has passed"""
+        start = max(self.current, time.monotonic() / self.tick)
+        tick = max(self.current + 1, math.ceil(start + delay / self.tick))
+        timer = Timer(tick, callback, args)
+        self.wheel[tick % self.slots].append(timer)
+        self.pending += 1
+        return timer
+
+    def cancel(self, timer: Timer|None) -> None:
+        """Stop the timer from firing"""
+        if timer is not None and not timer.done:
+            timer.done = True
+            self.pending -= 1
+
+    def next_deadline(self) -> float|None:
+        """Monotonic time at which the wheel must next be advanced, or None
+        if no timer is pending"""
+        if self.pending == 0:
+            return None
+        return (self.current + 1) * self.tick
+
+    def advance(self, now: float|None = None) -> None:
+        """Fire every timer due at or before now"""
+        if now is None:
+            now = time.monotonic()
+        target = int(now / self.tick)
+        if self.pending == 0:
+            self.current = max(self.current, target)
+            return
+        # After a long gap every slot is visited once
+        if target - self.current >= self.slots:
+            self.current = target
+            for index in range(self.slots):
+                self.expire(index, target)
+            return
+        while self.current < target:
+            self.current += 1
+            self.expire(self.current % self.slots, self.current)
+
+    def expire(self, index: int, tick: int) -> None:
+        """Fire the timers of a slot that are due by the given tick"""
+        slot = self.wheel[index]
+        if not slot:
+            return
+        due = []
+        kept = []
+        for timer in slot:
+            if timer.done:
+                continue
+            if timer.tick <= tick:
+                due.append(timer)
+            else:
+                kept.append(timer)
+        self.wheel[index] = kept
+        for timer in due:
+            # A callback may have cancelled a timer that was due with it
+            if not timer.done:
+                timer.done = True
+                self.pending -= 1
+                timer.callback(*timer.args)
@@ -54,7 +54,7 @@ class Users:
         """Return the user found at this address"""
         user = self.connected_users.get(addr)
         if user is None:
-            self.logger.error(f"Did not find user with host: {addr[0]}, port: {addr[1]}")
+            self.logger.error("Did not find user with host: %s, port: %s", addr[0], addr[1])
             raise UserNotFoundError
         return user
 
@@ -75,29 +75,42 @@ class Users:
     def add_user(self, user: User) -> None:
         """Add the user to connected Users. Does not allow more than two users"""
         if len(self.connected_users) == 2:
-            self.logger.error(f"Attempted to add too many users!")
+            self.logger.error("Attempted to add too many users!")
             raise TooManyUsersError
         self.connected_users[user.addr] = user
-        self.logger.info(f"Added user host: {user.host}, port: {user.port}")
+        self.logger.info("Added user host: %s, port: %s", user.host, user.port)
 
     def remove_user(self, addr: Address) -> None:
         """Remove the user from the connected users list."""
         user = self.connected_users.pop(addr)
         if user is not None:
-            self.logger.info(f"Removed user host: {user.host}, port: {user.port}")
+            self.logger.info("Removed user host: %s, port: %s", user.host, user.port)
+
+    def readdress(self, old_addr: Address, new_addr: Address) -> User:
+        """Move a user to the address of their new connection, keeping
+        the user's place in the connected users order"""
+        user = self.get_user(old_addr)
+        user.addr = new_addr
+        user.host = new_addr[0]
+        user.port = new_addr[1]
+        self.connected_users = {
+                (new_addr if addr == old_addr else addr): other
+                for addr, other in self.connected_users.items()
+                }
+        return user
 
     def set_user_name(self, addr: Address, name: str):
         """Assign a user's name"""
         user = self.connected_users.get(addr)
         if user is None:
-            self.logger.error(f"Did not find user with host: {addr[0]}, port: {addr[1]}")
+            self.logger.error("Did not find user with host: %s, port: %s", addr[0], addr[1])
             raise UserNotFoundError
         user.set_name(name)
             
     def set_values(self) -> None:
         """Set the values for the user. The clients use this for the color that the user is playing as"""
         if len(self.connected_users) != 2:
-            self.logger.error(f"Incorect number of users during set value action. Expected 2, found {len(self.connected_users)}")
+            self.logger.error("Incorect number of users during set value action. Expected 2, found %s", len(self.connected_users))
             raise NotEnoughUsersError
         curr = 1
         for user in self.connected_users.values():
@@ -110,12 +123,12 @@ class Users:
     def first_user(self) -> User:
         """Randomly pick a user to be the first user for the game"""
         if len(self.connected_users) != 2:
-            self.logger.error(f"Incorrect number of users during first user action")
+            self.logger.error("Incorrect number of users during first user action")
             raise NotEnoughUsersError
         li = list(self.connected_users.keys())
         first_user = self.connected_users.get(choice(li))
         if first_user is None:
-            self.logger.error(f"First user failed unexpectadly. None found")
+            self.logger.error("First user failed unexpectadly. None found")
             raise FailedFirstUserError
         return first_user
 
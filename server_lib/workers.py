@@ -0,0 +1,242 @@
+import json
+import os
+import selectors
+import signal
+import socket
+import time
+from logging import Logger
+from typing import Any, Callable
+
+from server_lib.logs import stop_logging
+
+
+# Seconds between stats reports from each worker, and between aggregated stats logs
+STATS_INTERVAL = 10.0
+# A worker that exits sooner than this after starting is restarted with a delay
+RESTART_BACKOFF = 1.0
+# Stats that are averages, by the stat counting what each worker averaged over.
+# They are combined weighted by that count instead of summed
+AVERAGED_STATS = {"rtt_avg_ms": "rtt_measured"}
+
+
+def listen_socket(port: int, reuse_port: bool = False) -> socket.socket:
+    """Create a TCP socket listening on any routable address at the given port.
+    With reuse_port several processes can each bind their own socket to the port,
+    and the kernel spreads incoming connections between them"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(('', port))
+    sock.listen()
+    return sock
+
+
+class Worker:
+    """Supervisor side record of a single worker process"""
+
+    def __init__(self, index: int) -> None:
+        self.index = index
+        self.pid = 0
+        self.started = 0.0
+        # Read end of the worker's stats pipe, and bytes of a partial line
+        self.stats_fd = -1
+        self.stats_buf = b""
+        self.stats: dict[str, Any] = {}
+        self.restart_at: float|None = None
+
+
+class Supervisor:
+    """Runs the server in N forked worker processes that share one port. Each
+    worker runs its own event loop and hosts its own games. Workers bind their own
+    socket with SO_REUSEPORT where the platform supports it, otherwise they inherit
+    a listening socket bound by the supervisor. Crashed workers are restarted, and
+    the stats each worker reports over a pipe are aggregated and logged."""
+
+    def __init__(self, logger: Logger, port: int, workers: int, make_server: Callable[[], Any]) -> None:
+        """make_server creates a selector or asyncio server in the worker process"""
+        self.logger = logger
+        self.port = port
+        self.make_server = make_server
+        self.workers = [Worker(index) for index in range(workers)]
+        self.reuse_port = hasattr(socket, "SO_REUSEPORT")
+        self.sock: socket.socket|None = None
+        self.sel = selectors.DefaultSelector()
+        self.running = True
+
+    def run(self) -> None:
+        """Start all workers, then supervise them until interrupted"""
+        if self.reuse_port:
+            self.logger.info("Starting %s workers sharing port %s with SO_REUSEPORT", len(self.workers), self.port)
+        else:
+            self.sock = listen_socket(self.port)
+            self.logger.info("Starting %s workers sharing an inherited socket on port %s", len(self.workers), self.port)
+        for worker in self.workers:
+            self.spawn(worker)
+        next_report = time.monotonic() + STATS_INTERVAL
+        while self.running:
+            now = time.monotonic()
+            timeout = max(0.0, min(next_report - now, RESTART_BACKOFF))
+            for key, _ in self.sel.select(timeout):
+                self.read_stats(key.data)
+            self.reap()
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.restart_at is not None and now >= worker.restart_at:
+                    self.spawn(worker)
+            if now >= next_report:
+                self.report()
+                next_report = now + STATS_INTERVAL
+
+    def spawn(self, worker: Worker) -> None:
+        """Fork a worker process. The child never returns from this call"""
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            self.run_worker(worker, write_fd)
+        os.close(write_fd)
+        os.set_blocking(read_fd, False)
+        worker.pid = pid
+        worker.started = time.monotonic()
+        worker.restart_at = None
+        worker.stats_fd = read_fd
+        worker.stats_buf = b""
+        worker.stats = {}
+        self.sel.register(read_fd, selectors.EVENT_READ, worker)
+        self.logger.info("Started worker %s with pid %s", worker.index, pid)
+
+    def run_worker(self, worker: Worker, stats_fd: int) -> None:
+        """Body of a worker process. Runs a server on the shared port and reports
+        its stats to the supervisor over the pipe"""
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        self.sel.close()
+        for other in self.workers:
+            if other.stats_fd >= 0:
+                os.close(other.stats_fd)
+        os.set_blocking(stats_fd, False)
+
+        def report(stats: dict) -> None:
+            stats["worker"] = worker.index
+            line = json.dumps(stats).encode("utf-8") + b"\n"
+            try:
+                os.write(stats_fd, line)
+            except (BlockingIOError, BrokenPipeError):
+                pass
+
+        server = self.make_server()
+        server.listen_sock = self.sock
+        server.reuse_port = self.reuse_port
+        server.stats_reporter = report
+        server.stats_interval = STATS_INTERVAL
+        # Each worker has its own metrics, served at the metrics port plus the
+        # worker index and written to the metrics file suffixed with the index
+        if server.metrics_port is not None:
+            server.metrics_port += worker.index
+        if server.metrics_file is not None:
+            server.metrics_file = f"{server.metrics_file}.{worker.index}"
+        code = 0
+        try:
+            server.run()
+        except KeyboardInterrupt:
+            server.shutdown()
+        except Exception:
+            self.logger.exception("Worker %s failed", worker.index)
+            server.shutdown()
+            code = 1
+        # os._exit skips atexit handlers, write out queued log records first
+        stop_logging()
+        os._exit(code)
+
+    def read_stats(self, worker: Worker) -> None:
+        """Read stats lines reported by a worker. The last complete line is kept"""
+        try:
+            data = os.read(worker.stats_fd, 65536)
+        except BlockingIOError:
+            return
+        if not data:
+            self.close_stats(worker)
+            return
+        lines = (worker.stats_buf + data).split(b"\n")
+        worker.stats_buf = lines.pop()
+        for line in lines:
+            try:
+                worker.stats = json.loads(line)
+            except ValueError:
+                self.logger.warning("Malformed stats from worker %s", worker.index)
+
+    def close_stats(self, worker: Worker) -> None:
+        """Stop reading the stats pipe of an exited worker"""
+        if worker.stats_fd >= 0:
+            self.sel.unregister(worker.stats_fd)
+            os.close(worker.stats_fd)
+            worker.stats_fd = -1
+
+    def reap(self) -> None:
+        """Collect exited workers and schedule their restart"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            for worker in self.workers:
+                if worker.pid != pid:
+                    continue
+                worker.pid = 0
+                self.close_stats(worker)
+                if not self.running:
+                    break
+                self.logger.warning("Worker %s (pid %s) exited with status %s. Restarting", worker.index, pid, os.waitstatus_to_exitcode(status))
+                # Back off when a worker keeps failing right after starting
+                delay = 0.0
+                if time.monotonic() - worker.started < RESTART_BACKOFF:
+                    delay = RESTART_BACKOFF
+                worker.restart_at = time.monotonic() + delay
+
+    def aggregate(self) -> dict[str, int|float]:
+        """Sum of the latest numeric stats of every worker. Averages are
+        averaged over all workers, weighted by what each worker averaged over"""
+        totals: dict[str, int|float] = {}
+        weighted: dict[str, float] = {}
+        for worker in self.workers:
+            for name, value in worker.stats.items():
+                if name == "worker" or not isinstance(value, (int, float)):
+                    continue
+                if name in AVERAGED_STATS:
+                    weighted[name] = weighted.get(name, 0.0) + value * worker.stats.get(AVERAGED_STATS[name], 0)
+                else:
+                    totals[name] = totals.get(name, 0) + value
+        for name, total in weighted.items():
+            count = totals.get(AVERAGED_STATS[name], 0)
+            totals[name] = round(total / count) if count else 0
+        return totals
+
+    def report(self) -> None:
+        """Log the aggregated stats of all workers"""
+        alive = sum(1 for worker in self.workers if worker.pid)
+        line = f"Workers alive: {alive}/{len(self.workers)}"
+        for name, value in sorted(self.aggregate().items()):
+            line += f", {name}: {value}"
+        self.logger.info(line)
+
+    def shutdown(self) -> None:
+        """Stop all workers and wait for them to exit"""
+        self.running = False
+        self.logger.info("Shutting down workers")
+        for worker in self.workers:
+            if worker.pid:
+                try:
+                    os.kill(worker.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+        for worker in self.workers:
+            if worker.pid:
+                try:
+                    os.waitpid(worker.pid, 0)
+                except ChildProcessError:
+                    pass
+                worker.pid = 0
+        if self.sock is not None:
+            self.sock.close()
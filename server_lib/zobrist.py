@@ -0,0 +1,43 @@
+import random
+
+# Seed of the key generator. Keys are the same in every process and every run,
+# so hashes can be stored on disk and shared between processes
+ZOBRIST_SEED = 0x436F6E6E656374
+
+# Board size, keys are generated for every cell
+COLUMNS = 7
+ROWS = 6
+
+
+def generate_keys(seed: int = ZOBRIST_SEED) -> dict[int, dict[tuple[int, int], int]]:
+    """Random 64-bit key of every (column, row) cell for each player value"""
+    rng = random.Random(seed)
+    keys: dict[int, dict[tuple[int, int], int]] = {1: {}, -1: {}}
+    for column in range(COLUMNS):
+        for row in range(ROWS):
+            for value in (1, -1):
+                keys[value][(column, row)] = rng.getrandbits(64)
+    return keys
+
+
+# Key of a stone of each player value on each cell. The hash of a position is
+# the XOR of the keys of its stones, so placing a stone updates it in O(1)
+ZOBRIST_KEYS = generate_keys()
+
+# Key of the mirror image cell, across the center column. The XOR of these keys
+# is the hash of the position mirrored left to right
+MIRROR_KEYS = {value: {(column, row): keys[(COLUMNS - 1 - column, row)] for column, row in keys}
+               for value, keys in ZOBRIST_KEYS.items()}
+
+
+# Change of a stone's key when it changes side, its key as a stone of the
+# player to move XOR its key as a stone of the opponent. Hashes are keyed by
+# the side to move, so after every move each stone changes side, which is one
+# XOR with the combined swap keys of the occupied cells
+SWAP_KEYS = {cell: ZOBRIST_KEYS[1][cell] ^ ZOBRIST_KEYS[-1][cell] for cell in ZOBRIST_KEYS[1]}
+MIRROR_SWAP_KEYS = {cell: MIRROR_KEYS[1][cell] ^ MIRROR_KEYS[-1][cell] for cell in MIRROR_KEYS[1]}
+
+
+def canonical(position_hash: int, mirror_hash: int) -> int:
+    """Hash shared by a position and its mirror image"""
+    return min(position_hash, mirror_hash)
@@ -0,0 +1,141 @@
+import argparse
+import logging
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from server_lib.book import position_key, write_table
+from server_lib.bot import BOARD_MASK, BOTTOM_MASK, COLUMN_MASKS, MOVE_ORDER, WIN_SCORE, winning_cells
+from server_lib.tablebase import BOARD_CELLS, TABLEBASE_MAGIC, Tablebase
+from server_lib.zobrist import COLUMNS
+
+# Default most empty cells of tablebase positions
+TABLEBASE_CELLS = 12
+
+# Default number of endgame positions the tablebase is solved from
+TABLEBASE_SEEDS = 1000
+
+# Endgame positions solved by each task of the generator pool
+SEEDS_PER_TASK = 50
+
+# Games played before giving up on finding more endgame positions, per position wanted
+PLAYOUT_ATTEMPTS = 100
+
+
+def playout(rng: random.Random, stones: int) -> tuple[int, int]|None:
+    """Play random moves until the board has the given number of stones. Like
+    the bots, players block an immediate win of their opponent. The game is
+    dropped, and None returned, once the player to move can win at once"""
+    position = 0
+    mask = 0
+    while mask.bit_count() < stones:
+        possible = (mask + BOTTOM_MASK) & BOARD_MASK
+        if winning_cells(position, mask) & possible:
+            return None
+        forced = winning_cells(position ^ mask, mask) & possible
+        moves = forced if forced else possible
+        column = rng.choice([c for c in range(COLUMNS) if moves & COLUMN_MASKS[c]])
+        position, mask = position ^ mask, mask | (possible & COLUMN_MASKS[column])
+    return position, mask
+
+
+def solve(position: int, mask: int, entries: dict[int, tuple[int, int]]) -> int:
+    """Exact score of the position for the player to move, searched to the end
+    of the game. The best column and score of the position and of every
+    position reachable from it are stored in entries, for the canonical
+    orientation of each position"""
+    key, mirrored = position_key(position, mask)
+    entry = entries.get(key)
+    if entry is not None:
+        return entry[1]
+    moves = mask.bit_count()
+    possible = (mask + BOTTOM_MASK) & BOARD_MASK
+    wins = winning_cells(position, mask) & possible
+    if wins:
+        column = next(c for c in MOVE_ORDER if wins & COLUMN_MASKS[c])
+        score = WIN_SCORE - moves - 1
+    else:
+        column = -1
+        score = -WIN_SCORE
+        for c in MOVE_ORDER:
+            move = possible & COLUMN_MASKS[c]
+            if not move:
+                continue
+            # Filling the last cell without winning draws
+            result = 0 if moves + 1 == BOARD_CELLS else -solve(position ^ mask, mask | move, entries)
+            if column < 0 or result > score:
+                column = c
+                score = result
+    entries[key] = (COLUMNS - 1 - column if mirrored else column, score)
+    return score
+
+
+def solve_seeds(seeds: list[tuple[int, int]]) -> dict[int, tuple[int, int]]:
+    """Entries of the seed positions and every position reachable from them.
+    Run in a generator process"""
+    entries: dict[int, tuple[int, int]] = {}
+    for position, mask in seeds:
+        solve(position, mask, entries)
+    return entries
+
+
+def generate(logger: logging.Logger, entries: dict[int, tuple[int, int]], cells: int, count: int, seed: int, jobs: int) -> None:
+    """Add exact results of endgame positions to the tablebase entries. Every
+    position with at most cells empty cells cannot be listed, so count
+    positions with exactly that many empty cells are reached by random games,
+    and they and every position reachable from them are solved to the end.
+    Positions are solved by a pool of jobs processes"""
+    start = time.monotonic()
+    rng = random.Random(seed)
+    seeds: dict[int, tuple[int, int]] = {}
+    attempts = 0
+    while len(seeds) < count and attempts < count * PLAYOUT_ATTEMPTS:
+        attempts += 1
+        found = playout(rng, BOARD_CELLS - cells)
+        if found is None:
+            continue
+        key = position_key(*found)[0]
+        if key not in entries:
+            seeds.setdefault(key, found)
+    logger.info(f"Found {len(seeds)} positions in {attempts} games in {time.monotonic() - start:.1f}s")
+    positions = list(seeds.values())
+    tasks = [positions[i:i + SEEDS_PER_TASK] for i in range(0, len(positions), SEEDS_PER_TASK)]
+    with ProcessPoolExecutor(jobs) as executor:
+        for done, solved in enumerate(executor.map(solve_seeds, tasks), 1):
+            entries.update(solved)
+            logger.info(f"Solved {min(done * SEEDS_PER_TASK, len(positions))}/{len(positions)} positions, "
+                        f"{len(entries)} entries, {time.monotonic() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate an endgame tablebase for the ConnectFour server")
+    parser.add_argument("-o", "--output", required=True, help="Tablebase file to write")
+    parser.add_argument("--cells", help=f"Most empty cells of tablebase positions: Default {TABLEBASE_CELLS}", type=int,
+                        default=TABLEBASE_CELLS)
+    parser.add_argument("--seeds", help=f"Endgame positions to solve, with every position reachable from them: Default {TABLEBASE_SEEDS}",
+                        type=int, default=TABLEBASE_SEEDS)
+    parser.add_argument("--seed", help="Random seed of the games that find endgame positions: Default 0", type=int, default=0)
+    parser.add_argument("-j", "--jobs", help="Processes solving positions: Default the number of CPUs", type=int,
+                        default=os.cpu_count() or 1)
+    parser.add_argument("--extend", help="Keep the positions of an existing tablebase at the output and add new ones",
+                        action="store_true")
+    parser.add_argument("--loglevel", help="Log verbosity level: Default INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="INFO")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger('CONNECT-FOUR TABLEBASE')
+    entries: dict[int, tuple[int, int]] = {}
+    cells = args.cells
+    if args.extend and os.path.exists(args.output):
+        tablebase = Tablebase(args.output)
+        entries = {key: (column, score) for key, column, score in tablebase.entries()}
+        cells = max(cells, tablebase.limit)
+        tablebase.close()
+        logger.info(f"Extending {args.output}, {len(entries)} positions")
+    try:
+        generate(logger, entries, args.cells, args.seeds, args.seed, args.jobs)
+    except KeyboardInterrupt:
+        print("Interrupt signal received, shutting down")
+        raise SystemExit(1)
+    write_table(args.output, TABLEBASE_MAGIC, entries, cells)
+    logger.info(f"Wrote {len(entries)} positions to {args.output}")